@@ -1,19 +1,36 @@
 import sys
 import logging
-import io
 import os
 import shutil
+import threading
 import click # Importante para inputs no terminal
-from flask import Flask, request, jsonify, render_template, make_response, redirect, url_for, flash
+from flask import (Flask, request, jsonify, render_template, make_response, redirect, url_for, flash, send_file, Response,
+                   stream_with_context)
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
 from datetime import datetime
+import hashlib
+import hmac
+from sqlalchemy import or_, and_, func, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import joinedload, load_only, selectinload
 
 # Importa a lógica de PDF (que agora espera uma lista unificada e o tipo de relatório)
-from pdf_generator import gerar_pdf_com_anexos
+from pdf_generator import gerar_pdf_com_anexos, AnexosComErro, PoolConversao, campos_do_relatorio, converter_imagem_para_pdf, caminho_paginas_imagem, EXTENSOES_IMAGEM
+from report_cache import ReportCache, hash_stream, hash_arquivo
+from chunked_uploads import ChunkedUploads, UploadError
+from report_jobs import ReportJobs
+from blob_store import BlobStore
+from user_cache import UserCache, UsuarioSessao
+from project_archive import gerar_zip, LeitorZip, ArquivoInvalido
+import metrics
+from project_fields import (CAMPOS_GERAIS, CAMPOS_POR_FASE, CAMPOS_PROJETO, CAMPOS_RELATORIO_PROJETO, LAYOUTS,
+                            selecionar_campos_projeto,
+                            layout_atual, colunas_projeto, ler_textos, gravar_textos,
+                            gravar_textos_tabela, migrar_layout)
 from config import Config
-from models import db, User, Project, Attachment
+from models import db, User, Project, Attachment, Blob
 
 # Configuração de Logs
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
@@ -35,10 +52,222 @@ login_manager.init_app(app)
 login_manager.login_view = 'login'
 login_manager.login_message = "Por favor, faça login para acessar o sistema."
 
+# Cache em disco dos relatórios PDF (invalidado ao salvar projeto ou remover anexos)
+report_cache = ReportCache(app.config['REPORT_CACHE_DIR'], app.config['REPORT_CACHE_MAX_BYTES'])
+
+# Jobs de geração de relatórios em segundo plano (pool de processos + estado em disco)
+report_jobs = ReportJobs(app.config['REPORT_JOBS_DIR'], app.config['REPORT_JOB_WORKERS'], app.config['REPORT_JOB_TTL'],
+                         ao_concluir=lambda estatisticas, tipo: metrics.registrar_pdf(estatisticas, tipo, 'job'))
+
+# Sessões de upload em partes (retomáveis) gravadas direto na pasta do projeto
+chunked_uploads = ChunkedUploads(app.config['UPLOAD_SESSION_TTL'])
+
+# Conteúdo dos anexos, guardado uma única vez por hash (compartilhado entre projetos)
+blob_store = BlobStore(app.config['BLOB_STORAGE_DIR'])
+# Conversão paralela das imagens nos relatórios síncronos (os jobs já rodam em processos próprios)
+pool_conversao = PoolConversao(app.config['REPORT_CONVERSION_WORKERS'])
+
+# Índice vetorial dos anexos de cada projeto, atualizado em segundo plano ao salvar arquivos.
+# Criado no primeiro uso (ver indices_projetos): project_index carrega o llama_index, que não
+# precisa pesar na subida de cada worker nem estar instalado para o resto do app funcionar.
+_indices_projetos = None
+_lock_indices = threading.Lock()
+
+# Usuários carregados a cada requisição, guardados por alguns segundos (sem ida ao banco)
+user_cache = UserCache(app.config['USER_CACHE_TTL'], app.config['USER_CACHE_MARKER'])
+
+# Métricas por requisição (tempo, consultas SQL) expostas em /metrics no formato do Prometheus
+metrics.instalar(app, Engine)
+metrics.registro.medidor('smart_tpm_user_cache_hits', 'Acertos do cache de usuários.',
+                         lambda: user_cache.acertos)
+metrics.registro.medidor('smart_tpm_user_cache_misses', 'Faltas do cache de usuários.',
+                         lambda: user_cache.faltas)
+metrics.registro.medidor('smart_tpm_project_indexes_loaded', 'Índices de projeto abertos em memória.',
+                         lambda: _indices_projetos.carregados() if _indices_projetos else 0)
+
+def carregar_usuario(user_id):
+    # Correção: db.session.get para evitar LegacyAPIWarning
+    user = db.session.get(User, user_id)
+    return UsuarioSessao.de(user) if user else None
+
 @login_manager.user_loader
 def load_user(user_id):
-    # Correção: db.session.get para evitar LegacyAPIWarning
-    return db.session.get(User, int(user_id))
+    # current_user é uma cópia leve (UsuarioSessao); para alterar o usuário, carregue-o do banco
+    return user_cache.obter(int(user_id), carregar_usuario)
+
+# ------------------------------------------------------------------
+# --- FUNÇÕES AUXILIARES DE ANEXOS ---
+# ------------------------------------------------------------------
+
+def pasta_projeto(user_id, project_id):
+    """Pasta dos arquivos de um projeto: storage/<usuario>/<projeto>."""
+    return os.path.join(app.root_path, 'storage', str(user_id), str(project_id))
+
+def registrar_anexo(project, sha256, tamanho, filename, content_type, origem=None):
+    """
+    Registra no banco um anexo apontando para um blob, somando uma referência a ele e
+    gerando a versão pré-convertida das imagens. Não faz commit.
+
+    `origem` é o arquivo recebido (ex.: de `blob_store.receber`), sempre consumido: ele só vai
+    para o armazenamento depois que a referência está presa (FOR UPDATE), pois até lá uma
+    remoção simultânea do mesmo conteúdo pode apagar o blob. Sem `origem`, o blob precisa
+    existir (senão FileNotFoundError e o chamador deve pedir os bytes).
+    """
+    try:
+        referenciar_blob(sha256, tamanho)
+        if origem:
+            blob_store.guardar_arquivo(origem, sha256)
+        elif not blob_store.existe(sha256):
+            raise FileNotFoundError(f"Blob {sha256[:12]} não está no armazenamento")
+    finally:
+        if origem and os.path.exists(origem):
+            os.remove(origem)
+    blob_path = blob_store.caminho(sha256)
+    new_attachment = Attachment(
+        project_id=project.id,
+        filename=filename,
+        filepath=blob_path,
+        filetype=content_type,
+        file_size=tamanho,
+        blob_sha256=sha256
+    )
+    # Imagens já ficam convertidas em página PDF para os relatórios
+    # (a versão é do blob, então um conteúdo repetido reaproveita a conversão)
+    gerar_paginas_anexo(new_attachment, blob_path)
+    db.session.add(new_attachment)
+    return new_attachment
+
+def caminho_anexo(attachment):
+    """
+    Caminho do arquivo de um anexo: o blob ou, para anexos ainda não migrados
+    (`flask migrate-blobs`), a cópia na pasta do projeto.
+    """
+    if attachment.blob_sha256:
+        return blob_store.caminho(attachment.blob_sha256)
+    return os.path.join(pasta_projeto(attachment.project.user_id, attachment.project_id), attachment.filename)
+
+def referenciar_blob(sha256, tamanho):
+    """Soma uma referência ao blob, criando o registro na primeira vez. Não faz commit."""
+    # FOR UPDATE: uploads/remoções simultâneos do mesmo conteúdo não perdem contagens
+    blob = db.session.get(Blob, sha256, with_for_update=True)
+    if blob is None:
+        blob = Blob(sha256=sha256, size=tamanho, ref_count=0)
+        db.session.add(blob)
+    blob.ref_count += 1
+    db.session.flush()
+    return blob
+
+def liberar_blob(sha256):
+    """
+    Remove uma referência ao blob. Ao chegar a zero, a função retorna True e o registro
+    fica com ref_count 0 até apagar_blobs_liberados (após o commit). Não faz commit.
+    """
+    blob = db.session.get(Blob, sha256, with_for_update=True)
+    if blob is None or blob.ref_count <= 0:
+        return False
+    blob.ref_count -= 1
+    return blob.ref_count == 0
+
+def apagar_blobs_liberados(hashes):
+    """
+    Após o commit, apaga do disco os blobs (e derivados) que ficaram sem referência.
+    Cada arquivo é removido com o registro preso (FOR UPDATE), que é o mesmo lock pedido
+    por referenciar_blob: um upload simultâneo do mesmo conteúdo ou referencia antes
+    (e o blob fica) ou espera a remoção e grava o arquivo de novo.
+    """
+    for sha256 in set(hashes):
+        try:
+            blob = db.session.get(Blob, sha256, with_for_update=True)
+            # Um novo upload do mesmo conteúdo pode tê-lo referenciado de novo nesse meio-tempo
+            if blob is not None and blob.ref_count > 0:
+                db.session.rollback()
+                continue
+            blob_store.remover(sha256)
+            if blob is not None:
+                db.session.delete(blob)
+            db.session.commit()
+            print(f"--- Blob removido: {sha256[:12]}")
+        except Exception as e:
+            db.session.rollback()
+            print(f"!!! Erro ao remover o blob {sha256[:12]}: {e}")
+
+def indices_projetos():
+    """Índices dos projetos, importando o project_index (e o llama_index) só na primeira chamada."""
+    global _indices_projetos
+    with _lock_indices:
+        if _indices_projetos is None:
+            from project_index import IndicesProjetos
+            _indices_projetos = IndicesProjetos(app.config['PROJECT_INDEX_DIR'], app.config['PROJECT_INDEX_EMBEDDER'],
+                                                app.config['PROJECT_INDEX_EMBED_MODEL'],
+                                                app.config['PROJECT_INDEX_MAX_LOADED'])
+        return _indices_projetos
+
+def anexos_para_indice(project):
+    """Anexos atuais do projeto no formato do índice: (sha256, caminho no disco, nome original)."""
+    return [(att.blob_sha256 or f'anexo-{att.id}', caminho_anexo(att), att.filename)
+            for att in project.attachments]
+
+def atualizar_indice_projeto(project):
+    """Agenda a sincronização do índice do projeto com os anexos atuais (após o commit)."""
+    try:
+        indices_projetos().agendar(project.user_id, project.id, anexos_para_indice(project))
+    except Exception as e:
+        print(f"!!! Erro ao agendar o índice do projeto {project.id}: {e}")
+
+def remover_indice_projeto(user_id, project_id):
+    """Apaga o índice de um projeto excluído (se a busca não foi usada neste processo, basta apagar a pasta)."""
+    if _indices_projetos is not None:
+        _indices_projetos.remover(user_id, project_id)
+    else:
+        shutil.rmtree(os.path.join(app.config['PROJECT_INDEX_DIR'], str(user_id), str(project_id)), ignore_errors=True)
+
+def opcoes_imagem():
+    """Configurações atuais de redução das imagens anexadas (DPI alvo e qualidade JPEG)."""
+    return {
+        'dpi': app.config['REPORT_IMAGE_DPI'],
+        'qualidade': app.config['REPORT_IMAGE_JPEG_QUALITY'],
+    }
+
+def gerar_paginas_anexo(attachment, origem):
+    """
+    Gera a versão em PDF de um anexo de imagem para as configurações atuais, gravada ao
+    lado do original (ex.: <sha256> -> <sha256>.150dpi-q80.pdf), e registra o caminho em
+    `attachment.pages_path`. Versões já geradas para essas configurações são reaproveitadas.
+    Não faz commit: quem chama decide quando persistir.
+    """
+    if not attachment.filename.lower().endswith(EXTENSOES_IMAGEM):
+        return None
+
+    opcoes = opcoes_imagem()
+    pages_path = caminho_paginas_imagem(origem, **opcoes)
+    if os.path.exists(pages_path):
+        attachment.pages_path = pages_path
+        return pages_path
+
+    tmp_path = pages_path + '.tmp'
+    try:
+        converter_imagem_para_pdf(origem, tmp_path, **opcoes)
+        os.replace(tmp_path, pages_path)
+    except Exception as e:
+        print(f"!!! Erro ao converter imagem {attachment.filename} para PDF: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+
+    attachment.pages_path = pages_path
+    return pages_path
+
+def remover_paginas_anexo(origem):
+    """
+    Remove todas as versões em PDF (uma por configuração) geradas para um anexo antigo,
+    ainda na pasta do projeto. As versões de blobs são removidas junto com o blob.
+    """
+    pasta, nome = os.path.split(origem)
+    if not os.path.isdir(pasta):
+        return
+    for arquivo in os.listdir(pasta):
+        if arquivo.startswith(nome + '.') and arquivo.endswith('.pdf') and 'dpi-q' in arquivo:
+            os.remove(os.path.join(pasta, arquivo))
 
 # ------------------------------------------------------------------
 # --- ROTAS DE AUTENTICAÇÃO E PERFIL ---
@@ -80,7 +309,8 @@ def update_profile():
         new_email = data.get('email')
         new_password = data.get('new_password')
 
-        user = current_user
+        # current_user é só uma cópia em cache: a alteração é feita na linha do banco
+        user = db.session.get(User, current_user.id)
 
         # 1. Atualiza E-mail se fornecido e diferente
         if new_email and new_email != user.email:
@@ -96,12 +326,19 @@ def update_profile():
             user.password_hash = generate_password_hash(new_password)
 
         db.session.commit()
+        user_cache.invalidar(user.id)
         return jsonify({"message": "Perfil atualizado com sucesso!"})
 
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/status/cache_usuarios', methods=['GET'])
+@login_required
+def status_cache_usuarios():
+    """Acertos, faltas e taxa de acerto do cache de usuários deste processo."""
+    return jsonify(user_cache.estatisticas())
+
 # ------------------------------------------------------------------
 # --- ROTAS DE NAVEGAÇÃO (FRONTEND) ---
 # ------------------------------------------------------------------
@@ -128,26 +365,99 @@ def fase_3():
 # --- ROTAS DE API (CRUD PROJETOS) ---
 # ------------------------------------------------------------------
 
+def etag_de(*partes):
+    """ETag curto calculado a partir das partes que identificam uma versão da resposta."""
+    return hashlib.sha1(':'.join(str(p) for p in partes).encode('utf-8')).hexdigest()[:32]
+
+def resposta_nao_modificada(etag, last_modified=None):
+    """
+    Retorna uma resposta 304 (sem corpo) se o cliente já possui esta versão, conferindo
+    If-None-Match e, quando ele não vier, If-Modified-Since. Caso contrário, None.
+    """
+    if request.if_none_match:
+        nao_modificado = request.if_none_match.contains(etag)
+    else:
+        # Last-Modified tem precisão de segundos
+        nao_modificado = bool(last_modified and request.if_modified_since and
+                              last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None))
+    if not nao_modificado:
+        return None
+    return aplicar_validadores(make_response('', 304), etag, last_modified)
+
+def aplicar_validadores(response, etag, last_modified=None):
+    """
+    Acrescenta ETag/Last-Modified. O no-cache faz o navegador revalidar a cada fetch,
+    reaproveitando a cópia local quando o servidor responder 304.
+    """
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def ler_cursor_projetos(cursor):
+    """Cursor da listagem: '<updated_at ISO>_<id>' do último projeto já entregue."""
+    data_iso, _, project_id = cursor.rpartition('_')
+    return datetime.fromisoformat(data_iso), int(project_id)
+
 @app.route('/api/projects', methods=['GET'])
 @login_required
 def list_projects():
     """
     Lista simples para a sidebar.
     Retorna apenas ID, Nome e Data para leveza.
+
+    Paginação por cursor (keyset): `limit` define o tamanho da página e `cursor` continua
+    logo após o último projeto da página anterior. O cursor da próxima página vem no
+    header X-Next-Cursor (ausente na última página).
+    Responde 304 se a página não mudou desde a versão que o navegador já tem.
     """
     try:
-        # Busca projetos ordenados por data de atualização
-        projects = Project.query.filter_by(user_id=current_user.id).order_by(Project.updated_at.desc()).all()
+        limite = min(request.args.get('limit', app.config['PROJECT_LIST_PAGE_SIZE'], type=int),
+                     app.config['PROJECT_LIST_MAX_PAGE_SIZE'])
+        if limite < 1:
+            return jsonify({"error": "limit deve ser positivo"}), 400
+        cursor = request.args.get('cursor')
+
+        # Apenas as colunas exibidas (sem os campos de texto das fases), servidas pelo
+        # índice (user_id, updated_at, id): o custo não cresce com o número de projetos
+        query = db.session.query(Project.id, Project.name, Project.updated_at) \
+            .filter(Project.user_id == current_user.id)
+
+        if cursor:
+            try:
+                cursor_data, cursor_id = ler_cursor_projetos(cursor)
+            except ValueError:
+                return jsonify({"error": "Cursor inválido"}), 400
+            query = query.filter(or_(Project.updated_at < cursor_data,
+                                     and_(Project.updated_at == cursor_data, Project.id < cursor_id)))
+
+        # Busca projetos ordenados por data de atualização (um a mais para saber se há próxima página)
+        projects = query.order_by(Project.updated_at.desc(), Project.id.desc()).limit(limite + 1).all()
+
+        # Versão da página: ids e datas das linhas lidas (toda alteração troca o updated_at;
+        # a linha extra cobre o X-Next-Cursor). Sem contar os demais projetos do usuário
+        etag = etag_de('lista', current_user.id, limite, cursor,
+                       *(f'{p.id}@{p.updated_at.isoformat()}' for p in projects))
+        ultima_atualizacao = projects[0].updated_at if projects else None
+        # Só o ETag decide o 304 aqui: o Last-Modified não muda quando um projeto é excluído
+        if request.if_none_match.contains(etag):
+            return aplicar_validadores(make_response('', 304), etag, ultima_atualizacao)
         
         project_list = []
-        for p in projects:
+        for p in projects[:limite]:
             project_list.append({
                 'id': p.id,
                 'name': p.name,
                 'updated_at': p.updated_at.strftime('%d/%m/%Y %H:%M')
             })
         
-        return jsonify(project_list)
+        response = jsonify(project_list)
+        if len(projects) > limite:
+            ultimo = projects[limite - 1]
+            response.headers['X-Next-Cursor'] = f"{ultimo.updated_at.isoformat()}_{ultimo.id}"
+        return aplicar_validadores(response, etag, ultima_atualizacao)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -155,58 +465,65 @@ def list_projects():
 @login_required
 def get_project(project_id):
     """
-    Retorna TODOS os dados do projeto (Fases 1, 2 e 3) para preencher os formulários.
+    Retorna os dados do projeto (Fases 1, 2 e 3) para preencher os formulários.
+    `?phase=fase2` (ou `fields=req_l1,req_l2,...`) limita a resposta, e a leitura no banco,
+    às colunas daquela fase; sem seletor, TODOS os campos são retornados.
+    Responde 304 (sem ler os textos do projeto) se o navegador já tiver a versão atual.
     """
     try:
-        # Correção: db.session.get
-        project = db.session.get(Project, project_id)
+        try:
+            campos, incluir_anexos = selecionar_campos_projeto(request.args.get('phase'), request.args.get('fields'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # Versão do projeto: data de atualização + anexos (quantidade e maior id), numa consulta leve
+        assinatura = db.session.query(Project.user_id, Project.updated_at,
+                                      func.count(Attachment.id), func.max(Attachment.id)) \
+            .outerjoin(Attachment, Attachment.project_id == Project.id) \
+            .filter(Project.id == project_id) \
+            .group_by(Project.id, Project.user_id, Project.updated_at).first()
         
-        if not project:
+        if not assinatura:
             return jsonify({"error": "Projeto não encontrado"}), 404
 
-        if project.user_id != current_user.id:
+        owner_id, updated_at, qtd_anexos, ultimo_anexo = assinatura
+        if owner_id != current_user.id:
             return jsonify({"error": "Acesso não autorizado"}), 403
-        
+
+        # Cada seleção de campos é uma representação diferente, com ETag próprio
+        etag = etag_de('projeto', project_id, updated_at, qtd_anexos, ultimo_anexo,
+                       ','.join(sorted(campos)), incluir_anexos)
+        nao_modificado = resposta_nao_modificada(etag, updated_at)
+        if nao_modificado:
+            return nao_modificado
+
+        # Apenas as colunas pedidas; os anexos, se pedidos, vêm na mesma consulta (JOIN)
+        opcoes = [load_only(Project.version, *colunas_projeto(campos))]
+        if incluir_anexos:
+            opcoes.append(joinedload(Project.attachments))
+        project = db.session.get(Project, project_id, options=opcoes)
+
+        dados = {'id': project.id, 'version': project.version}
+        for chave in campos:
+            if chave in CAMPOS_GERAIS:
+                dados[chave] = getattr(project, CAMPOS_GERAIS[chave])
+        # Textos das fases: das colunas já carregadas ou, no layout em tabela, só das linhas pedidas
+        dados.update(ler_textos(project, campos))
+
         # Recupera os anexos do banco
-        attachments_data = []
-        for att in project.attachments:
-            attachments_data.append({
-                'id': att.id,
-                'filename': att.filename,
-                'size': att.file_size,
-                'filetype': att.filetype
-            })
-            
-        return jsonify({
-            'id': project.id,
-            'name': project.name,
-            'responsible': project.responsible,
-            
-            # --- FASE 1: Negócio ---
-            'context': project.context_desc,
-            'business_desc': project.business_desc,
-            'business_rules': project.business_rules,
-            'specialist_desc': project.specialist_desc,
-            'things_desc': project.things_desc,
-            
-            # --- FASE 2: Requisitos (Top-Down) ---
-            'req_l6': project.req_l6_display,
-            'req_l5': project.req_l5_abstraction,
-            'req_l4': project.req_l4_storage,
-            'req_l3': project.req_l3_border,
-            'req_l2': project.req_l2_connectivity,
-            'req_l1': project.req_l1_sensor,
-
-            # --- FASE 3: Implementação (Bottom-Up) ---
-            'impl_l1': project.impl_l1_sensor,
-            'impl_l2': project.impl_l2_connectivity,
-            'impl_l3': project.impl_l3_border,
-            'impl_l4': project.impl_l4_storage,
-            'impl_l5': project.impl_l5_abstraction,
-            'impl_l6': project.impl_l6_display,
-
-            'attachments': attachments_data
-        })
+        if incluir_anexos:
+            attachments_data = []
+            for att in project.attachments:
+                attachments_data.append({
+                    'id': att.id,
+                    'filename': att.filename,
+                    'size': att.file_size,
+                    'filetype': att.filetype
+                })
+            dados['attachments'] = attachments_data
+
+        response = jsonify(dados)
+        return aplicar_validadores(response, etag, updated_at)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -224,11 +541,17 @@ def save_project():
 
         # 1. Gerencia Projeto (Insert ou Update)
         if project_id and project_id != 'null' and project_id != '':
-            # Update: Busca existente
-            project = db.session.get(Project, project_id)
+            # Update: Busca existente (travando a linha até o commit)
+            project = db.session.get(Project, project_id, with_for_update=True)
             if not project or project.user_id != current_user.id:
                 return jsonify({"error": "Não autorizado"}), 404
-            
+
+            # Versão informada pelo formulário: recusa gravar sobre alterações mais novas
+            if data.get('version') and data.get('version') != str(project.version):
+                return jsonify({"error": "O projeto foi alterado em outra aba. Recarregue antes de salvar.",
+                                "version": project.version}), 409
+
+            project.version = (project.version or 0) + 1
             msg = "Projeto atualizado com sucesso!"
         else:
             # Insert: Cria novo
@@ -246,74 +569,98 @@ def save_project():
         
         project.updated_at = datetime.utcnow()
 
-        # --- ATUALIZA FASE 1 (Se os campos vierem no request) ---
-        if 'context' in data: project.context_desc = data.get('context')
-        if 'business_desc' in data: project.business_desc = data.get('business_desc')
-        if 'business_rules' in data: project.business_rules = data.get('business_rules')
-        if 'specialist_desc' in data: project.specialist_desc = data.get('specialist_desc')
-        if 'things_desc' in data: project.things_desc = data.get('things_desc')
-
-        # --- ATUALIZA FASE 2 (Requisitos) ---
-        if 'req_l6' in data: project.req_l6_display = data.get('req_l6')
-        if 'req_l5' in data: project.req_l5_abstraction = data.get('req_l5')
-        if 'req_l4' in data: project.req_l4_storage = data.get('req_l4')
-        if 'req_l3' in data: project.req_l3_border = data.get('req_l3')
-        if 'req_l2' in data: project.req_l2_connectivity = data.get('req_l2')
-        if 'req_l1' in data: project.req_l1_sensor = data.get('req_l1')
-
-        # --- ATUALIZA FASE 3 (Implementação) ---
-        if 'impl_l1' in data: project.impl_l1_sensor = data.get('impl_l1')
-        if 'impl_l2' in data: project.impl_l2_connectivity = data.get('impl_l2')
-        if 'impl_l3' in data: project.impl_l3_border = data.get('impl_l3')
-        if 'impl_l4' in data: project.impl_l4_storage = data.get('impl_l4')
-        if 'impl_l5' in data: project.impl_l5_abstraction = data.get('impl_l5')
-        if 'impl_l6' in data: project.impl_l6_display = data.get('impl_l6')
-
-        db.session.flush() # Garante que o ID do projeto exista antes de salvar anexos
+        db.session.flush() # Garante que o ID do projeto exista antes de salvar anexos e textos
+
+        # --- ATUALIZA FASES 1, 2 e 3 (apenas os campos que vierem no request) ---
+        gravar_textos(project, {chave: data.get(chave) for campos in CAMPOS_POR_FASE.values()
+                                for chave in campos if chave in data})
 
         # 2. Gerencia Arquivos no Disco (Se houver uploads)
+        saved_count = 0
         if uploaded_files:
-            storage_base = os.path.join(app.root_path, 'storage')
-            user_folder = str(current_user.id)
-            proj_folder = str(project.id)
-            full_save_path = os.path.join(storage_base, user_folder, proj_folder)
-            
-            if not os.path.exists(full_save_path):
-                os.makedirs(full_save_path)
-
-            saved_count = 0
             for file in uploaded_files:
                 if file and file.filename:
                     filename = secure_filename(file.filename)
-                    file_path = os.path.join(full_save_path, filename)
-                    
-                    # Salva no disco
-                    file.save(file_path)
-                    file_size = os.path.getsize(file_path)
+
+                    # Recebe em um temporário; vai para o armazenamento ao ser registrado
+                    # (uma única vez por conteúdo; arquivo repetido não ocupa espaço)
+                    sha256, tmp_path, tamanho = blob_store.receber(file.stream)
                     
                     # Salva no banco
-                    new_attachment = Attachment(
-                        project_id=project.id,
-                        filename=filename,
-                        filepath=file_path,
-                        filetype=file.content_type,
-                        file_size=file_size
-                    )
-                    db.session.add(new_attachment)
+                    registrar_anexo(project, sha256, tamanho, filename, file.content_type, origem=tmp_path)
                     saved_count += 1
 
         db.session.commit()
+        report_cache.invalidar(current_user.id, project.id)
+        if uploaded_files and saved_count:
+            atualizar_indice_projeto(project)
         
         return jsonify({
             "message": msg,
             "project_id": project.id,
-            "name": project.name
+            "name": project.name,
+            "version": project.version
         })
 
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/projects/<int:project_id>', methods=['PATCH'])
+@login_required
+def patch_project(project_id):
+    """
+    Salvamento incremental (autosave). JSON: {"version": n, "fields": {"req_l1": "...", ...}}
+    com apenas os campos alterados (mesmas chaves do GET).
+    Gera um único UPDATE condicionado à versão: se outra aba salvou antes, nada é
+    gravado e a resposta é 409 com a versão atual.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        versao = data.get('version')
+        campos = data.get('fields')
+        if not isinstance(versao, int) or not isinstance(campos, dict) or not campos:
+            return jsonify({"error": "Informe version e fields"}), 400
+
+        desconhecidos = [chave for chave in campos if chave not in CAMPOS_PROJETO]
+        if desconhecidos:
+            return jsonify({"error": f"Campo desconhecido: {', '.join(desconhecidos)}"}), 400
+        if 'name' in campos and not (campos['name'] or '').strip():
+            return jsonify({"error": "O nome do projeto não pode ficar vazio"}), 400
+
+        agora = datetime.utcnow()
+        # Colunas de projects alteradas (no layout em tabela, só nome/responsável;
+        # os textos das fases vão para as linhas de project_fields, depois da checagem de versão)
+        em_tabela = layout_atual() == 'tabela'
+        colunas = {CAMPOS_PROJETO[chave]: valor for chave, valor in campos.items()
+                   if chave in CAMPOS_GERAIS or not em_tabela}
+        resultado = db.session.execute(
+            update(Project)
+            .where(Project.id == project_id, Project.user_id == current_user.id, Project.version == versao)
+            .values(version=Project.version + 1, updated_at=agora, **colunas)
+            .execution_options(synchronize_session=False)
+        )
+
+        if resultado.rowcount == 0:
+            db.session.rollback()
+            atual = db.session.query(Project.user_id, Project.version).filter(Project.id == project_id).first()
+            if not atual or atual.user_id != current_user.id:
+                return jsonify({"error": "Projeto não encontrado"}), 404
+            return jsonify({"error": "O projeto foi alterado em outra aba.", "version": atual.version}), 409
+
+        if em_tabela:
+            gravar_textos_tabela(project_id, campos)
+        db.session.commit()
+        report_cache.invalidar(current_user.id, project_id)
+        return jsonify({
+            "message": "Alterações salvas.",
+            "version": versao + 1,
+            "updated_at": agora.strftime('%d/%m/%Y %H:%M')
+        })
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/projects/<int:project_id>', methods=['DELETE'])
 @login_required
 def delete_project(project_id):
@@ -325,7 +672,10 @@ def delete_project(project_id):
         if project.user_id != current_user.id:
             return jsonify({"error": "Não autorizado"}), 403
 
-        # Remove arquivos físicos
+        # Anexos em blobs: só perdem a referência (o conteúdo pode estar em outros projetos)
+        hashes = [att.blob_sha256 for att in project.attachments if att.blob_sha256]
+
+        # Remove arquivos físicos (anexos antigos e uploads em partes não finalizados)
         storage_base = os.path.join(app.root_path, 'storage')
         project_path = os.path.join(storage_base, str(current_user.id), str(project.id))
 
@@ -338,7 +688,12 @@ def delete_project(project_id):
 
         # Remove do banco
         db.session.delete(project)
+        db.session.flush()
+        liberados = [sha256 for sha256 in hashes if liberar_blob(sha256)]
         db.session.commit()
+        apagar_blobs_liberados(liberados)
+        report_cache.invalidar(current_user.id, project_id)
+        remover_indice_projeto(current_user.id, project_id)
 
         return jsonify({"message": "Projeto excluído com sucesso."})
 
@@ -357,96 +712,357 @@ def delete_attachment(attachment_id):
         if attachment.project.user_id != current_user.id:
              return jsonify({"error": "Não autorizado"}), 403
              
-        # Remove arquivo físico
-        if os.path.exists(attachment.filepath):
-            os.remove(attachment.filepath)
+        sha256 = attachment.blob_sha256
+        if not sha256:
+            # Anexo antigo: remove arquivo físico (e as versões pré-convertidas em PDF, se houver)
+            file_path = caminho_anexo(attachment)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            remover_paginas_anexo(file_path)
             
-        # Remove do banco
+        # Remove do banco (o blob só perde uma referência)
+        project = attachment.project
+        project_id = project.id
+        project.updated_at = datetime.utcnow()
         db.session.delete(attachment)
+        db.session.flush()
+        liberado = bool(sha256) and liberar_blob(sha256)
         db.session.commit()
+        if liberado:
+            apagar_blobs_liberados([sha256])
+        report_cache.invalidar(current_user.id, project_id)
+        atualizar_indice_projeto(project)
         
         return jsonify({"message": "Anexo removido."})
     except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+# ------------------------------------------------------------------
+# --- UPLOAD DE ANEXOS EM PARTES (RETOMÁVEL) ---
+# ------------------------------------------------------------------
+
+def _projeto_do_usuario(project_id):
+    """Retorna o projeto se ele existir e pertencer ao usuário logado."""
+    project = db.session.get(Project, project_id)
+    if not project or project.user_id != current_user.id:
+        return None
+    return project
+
+def blob_do_usuario(user_id, sha256):
+    """O blob já é referenciado por algum anexo dos projetos do usuário?"""
+    return db.session.query(Attachment.id).join(Project, Attachment.project_id == Project.id) \
+        .filter(Attachment.blob_sha256 == sha256, Project.user_id == user_id).first() is not None
+
+@app.route('/api/projects/<int:project_id>/uploads', methods=['POST'])
+@login_required
+def iniciar_upload(project_id):
+    """
+    Inicia um upload em partes. JSON: filename, size, content_type e, opcionalmente,
+    sha256 (conferido ao finalizar). Retorna o upload_id e o offset inicial.
+    Se o sha256 informado já estiver em um anexo do próprio usuário, o anexo é
+    registrado na hora (resposta com "deduplicado": true) e nenhum byte precisa ser
+    enviado. Blobs só de outros usuários não contam: saber o hash não prova ter o
+    arquivo, então o envio segue normal e o conteúdo é conferido ao finalizar.
+    """
+    try:
+        project = _projeto_do_usuario(project_id)
+        if not project:
+            return jsonify({"error": "Não autorizado"}), 404
+
+        data = request.json or {}
+        filename = secure_filename(data.get('filename') or '')
+        size = data.get('size')
+        if not filename or not isinstance(size, int) or size < 0:
+            return jsonify({"error": "Informe filename e size"}), 400
+
+        content_type = data.get('content_type') or 'application/octet-stream'
+        sha256 = (data.get('sha256') or '').lower()
+        blob = db.session.get(Blob, sha256) if sha256 else None
+        attachment = None
+        if blob and blob.size == size and blob_store.existe(sha256) and \
+                blob_do_usuario(current_user.id, sha256):
+            try:
+                attachment = registrar_anexo(project, sha256, size, filename, content_type)
+            except FileNotFoundError:
+                # Blob apagado depois da conferência acima: segue como um upload normal
+                db.session.rollback()
+        if attachment:
+            project.updated_at = datetime.utcnow()
+            db.session.commit()
+            report_cache.invalidar(current_user.id, project.id)
+            atualizar_indice_projeto(project)
+            return jsonify({
+                "message": "Anexo enviado com sucesso!",
+                "deduplicado": True,
+                "id": attachment.id,
+                "filename": attachment.filename,
+                "size": attachment.file_size,
+                "offset": size,
+                "sha256": sha256
+            })
+
+        sessao = chunked_uploads.iniciar(pasta_projeto(current_user.id, project.id), filename, size,
+                                         content_type, sha256=sha256 or None)
+        return jsonify(sessao), 201
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/projects/<int:project_id>/uploads/<upload_id>', methods=['GET'])
+@login_required
+def estado_upload(project_id, upload_id):
+    """Informa o offset já recebido, para retomar um upload interrompido."""
+    project = _projeto_do_usuario(project_id)
+    sessao = project and chunked_uploads.estado(pasta_projeto(current_user.id, project.id), upload_id)
+    if not sessao:
+        return jsonify({"error": "Upload não encontrado"}), 404
+    return jsonify(sessao)
+
+@app.route('/api/projects/<int:project_id>/uploads/<upload_id>', methods=['PUT'])
+@login_required
+def enviar_parte_upload(project_id, upload_id):
+    """
+    Recebe uma parte do arquivo no corpo bruto da requisição (sem parsing de formulário).
+    O header Upload-Offset deve ser igual ao offset já recebido; se não for, responde 409
+    com o offset correto.
+    """
+    project = _projeto_do_usuario(project_id)
+    if not project:
+        return jsonify({"error": "Não autorizado"}), 404
+
+    try:
+        offset = int(request.headers.get('Upload-Offset', request.args.get('offset', '')))
+    except ValueError:
+        return jsonify({"error": "Header Upload-Offset obrigatório"}), 400
+
+    try:
+        novo_offset = chunked_uploads.anexar(pasta_projeto(current_user.id, project.id), upload_id,
+                                             offset, request.stream)
+        return jsonify({"upload_id": upload_id, "offset": novo_offset})
+    except UploadError as e:
+        return jsonify({"error": str(e), "offset": e.offset}), e.status
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/projects/<int:project_id>/uploads/<upload_id>/finalizar', methods=['POST'])
+@login_required
+def finalizar_upload(project_id, upload_id):
+    """Confere o arquivo recebido, move-o para o armazenamento de blobs e só então registra o Attachment."""
+    try:
+        project = _projeto_do_usuario(project_id)
+        if not project:
+            return jsonify({"error": "Não autorizado"}), 404
+
+        project_dir = pasta_projeto(current_user.id, project.id)
+        sessao = chunked_uploads.estado(project_dir, upload_id)
+        if not sessao:
+            return jsonify({"error": "Upload não encontrado"}), 404
+
+        # O hash calculado durante o envio já é o endereço do blob (sem reler o arquivo)
+        recebido_path = os.path.join(project_dir, '.uploads', f'{upload_id}.recebido')
+        sessao, digest = chunked_uploads.finalizar(project_dir, upload_id, recebido_path)
+        tamanho = os.path.getsize(recebido_path)
+
+        attachment = registrar_anexo(project, digest, tamanho, sessao['filename'], sessao['content_type'],
+                                     origem=recebido_path)
+        project.updated_at = datetime.utcnow()
+        db.session.commit()
+        report_cache.invalidar(current_user.id, project.id)
+        atualizar_indice_projeto(project)
+
+        return jsonify({
+            "message": "Anexo enviado com sucesso!",
+            "id": attachment.id,
+            "filename": attachment.filename,
+            "size": attachment.file_size,
+            "sha256": digest
+        })
+    except UploadError as e:
+        return jsonify({"error": str(e), "offset": e.offset}), e.status
+    except Exception as e:
+        db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/projects/<int:project_id>/uploads/<upload_id>', methods=['DELETE'])
+@login_required
+def cancelar_upload(project_id, upload_id):
+    """Descarta um upload em partes não finalizado."""
+    project = _projeto_do_usuario(project_id)
+    if not project:
+        return jsonify({"error": "Não autorizado"}), 404
+    chunked_uploads.cancelar(pasta_projeto(current_user.id, project.id), upload_id)
+    return jsonify({"message": "Upload cancelado."})
+
 # ------------------------------------------------------------------
 # --- ROTA DE GERAÇÃO DE RELATÓRIO (PDF) ---
 # ------------------------------------------------------------------
 
+def dados_relatorio_completo(project, form):
+    """
+    Campos das três fases para o relatório completo: os textos salvos do projeto,
+    sobrepostos pelos campos enviados no formulário (o que está na tela prevalece).
+    """
+    dados = {}
+    if project:
+        textos = ler_textos(project, list(CAMPOS_RELATORIO_PROJETO.values()))
+        for campo, chave in CAMPOS_RELATORIO_PROJETO.items():
+            valor = textos[chave] if chave in textos else getattr(project, CAMPOS_PROJETO[chave])
+            if valor:
+                dados[campo] = valor
+    for campo in CAMPOS_RELATORIO_PROJETO:
+        if form.get(campo):
+            dados[campo] = form.get(campo)
+    return dados
+
+def preparar_relatorio(form, uploaded_files):
+    """
+    Identifica o tipo de relatório (fase1, fase2, fase3 ou completo), monta os dados,
+    a lista unificada de anexos e a chave do cache. Usada pela geração síncrona e pelos jobs.
+
+    REGRA DE NEGÓCIO: Anexos devem ser incluídos APENAS na Fase 1 (e no relatório completo).
+
+    Retorna (tipo_relatorio, data, lista_anexos, cache_project_id, chave).
+    """
+    data = form.to_dict()
+    project_id = data.get('project_id')
+    tipo_relatorio = data.get('tipo_relatorio', 'fase1') # Padrão fase1
+    
+    lista_anexos_unificada = []
+
+    print(f"--- Iniciando Geração de PDF ({tipo_relatorio}). Projeto ID: {project_id} ---")
+
+    # Projeto salvo do usuário (relatórios sem projeto ficam no grupo 'avulso' do cache)
+    project = None
+    geracao = None
+    if project_id and project_id != 'null' and project_id != '':
+        try:
+            # Lida antes do projeto: uma invalidação durante a montagem muda a chave do cache
+            geracao = report_cache.geracao(current_user.id, int(project_id))
+            project = db.session.get(Project, int(project_id))
+            if project and project.user_id != current_user.id:
+                project = None
+        except Exception as e_db:
+            print(f"!!! Erro ao recuperar projeto do banco: {e_db}")
+    cache_project_id = project.id if project else None
+
+    # Relatório completo: as fases que não estão na tela vêm do projeto salvo
+    if tipo_relatorio == 'completo':
+        data.update(dados_relatorio_completo(project, form))
+
+    # LÓGICA DE FILTRO: Só processa anexos se for Fase 1 (ou o completo, que a inclui)
+    if tipo_relatorio in ('fase1', 'completo'):
+        print(f"--- Processando anexos para {tipo_relatorio} ---")
+        
+        # 1. Processa Arquivos NOVOS (Upload)
+        # O stream do Werkzeug (memória ou arquivo temporário) é usado diretamente, sem cópia
+        for f in uploaded_files:
+            if f and f.filename:
+                lista_anexos_unificada.append({
+                    'filename': f.filename,
+                    'stream': f.stream,
+                    'hash': hash_stream(f.stream),
+                    'origem': 'upload'
+                })
+
+        # 2. Processa Arquivos EXISTENTES (Banco de Dados/Disco)
+        if project:
+            try:
+                paginas_geradas = False
+                for att in project.attachments:
+                    safe_path = caminho_anexo(att)
+                    
+                    if not os.path.exists(safe_path):
+                        continue
+
+                    # Imagens sem versão pré-convertida para as configurações atuais
+                    # (enviadas antes da pré-conversão ou após mudar DPI/qualidade) são convertidas aqui
+                    pages_path = att.pages_path
+                    esperado = caminho_paginas_imagem(safe_path, **opcoes_imagem())
+                    if att.filename.lower().endswith(EXTENSOES_IMAGEM) and not (pages_path == esperado and os.path.exists(pages_path)):
+                        pages_path = gerar_paginas_anexo(att, safe_path)
+                        paginas_geradas = paginas_geradas or bool(pages_path)
+
+                    if pages_path:
+                        # Só as páginas prontas são usadas; a imagem original não é lida
+                        lista_anexos_unificada.append({
+                            'filename': att.filename,
+                            'paginas': pages_path,
+                            'hash': att.blob_sha256 or hash_arquivo(safe_path),
+                            'origem': 'disco'
+                        })
+                    else:
+                        # Apenas o caminho: o gerador abre o arquivo quando for anexá-lo
+                        lista_anexos_unificada.append({
+                            'filename': att.filename,
+                            'caminho': safe_path,
+                            'hash': att.blob_sha256 or hash_arquivo(safe_path),
+                            'origem': 'disco'
+                        })
+
+                if paginas_geradas:
+                    db.session.commit()
+            except Exception as e_db:
+                print(f"!!! Erro ao recuperar anexos do banco: {e_db}")
+    else:
+        print(f"--- Ignorando anexos para relatório da {tipo_relatorio} ---")
+
+    # Chave do cache: tipo + campos que aparecem no PDF + conteúdo de cada anexo
+    campos = {c: data.get(c) for c in campos_do_relatorio(tipo_relatorio)}
+    hashes_anexos = [(a['filename'], a['hash']) for a in lista_anexos_unificada]
+    chave = ReportCache.chave(tipo_relatorio, campos, hashes_anexos, opcoes_imagem(), geracao)
+
+    return tipo_relatorio, data, lista_anexos_unificada, cache_project_id, chave
+
+def enviar_pdf(arquivo, filename_pdf, etag=None):
+    """Resposta de download de um PDF já aberto (fechado pelo Flask ao terminar o envio)."""
+    response = send_file(arquivo, mimetype='application/pdf', as_attachment=True,
+                         download_name=filename_pdf, etag=etag)
+    # Com um arquivo aberto o send_file não sabe o tamanho (sem Content-Length nem Range)
+    if response.status_code == 200:
+        response.content_length = os.fstat(arquivo.fileno()).st_size
+    return response
+
 @app.route('/api/gerar_relatorio', methods=['POST'])
 @login_required 
 def handle_gerar_relatorio():
     """
-    Rota Controller: Identifica o tipo de relatório (fase1, fase2, fase3),
-    prepara os dados e chama o gerador.
-    
-    REGRA DE NEGÓCIO: Anexos devem ser incluídos APENAS na Fase 1.
+    Rota Controller: prepara os dados e chama o gerador, respondendo com o PDF.
     """
     try:
-        # Recupera dados do formulário
-        data = request.form
-        project_id = data.get('project_id')
-        tipo_relatorio = data.get('tipo_relatorio', 'fase1') # Padrão fase1
-        
-        lista_anexos_unificada = []
+        # Recupera dados do formulário (no relatório completo, complementados pelo projeto salvo)
+        tipo_relatorio, data, lista_anexos_unificada, cache_project_id, chave = \
+            preparar_relatorio(request.form, request.files.getlist('anexos'))
 
-        print(f"--- Iniciando Geração de PDF ({tipo_relatorio}). Projeto ID: {project_id} ---")
+        # O navegador já possui esta versão do relatório
+        if request.if_none_match.contains(chave):
+            response = make_response('', 304)
+            response.set_etag(chave)
+            return response
 
-        # LÓGICA DE FILTRO: Só processa anexos se for Fase 1
-        if tipo_relatorio == 'fase1':
-            print("--- Processando anexos para Fase 1 ---")
-            
-            # 1. Processa Arquivos NOVOS (Upload na memória)
-            uploaded_files = request.files.getlist('anexos')
-            for f in uploaded_files:
-                if f and f.filename:
-                    buf = io.BytesIO()
-                    f.save(buf) 
-                    buf.seek(0)
-                    
-                    lista_anexos_unificada.append({
-                        'filename': f.filename,
-                        'stream': buf,
-                        'origem': 'upload'
-                    })
-
-            # 2. Processa Arquivos EXISTENTES (Banco de Dados/Disco)
-            if project_id and project_id != 'null' and project_id != '':
-                try:
-                    project = db.session.get(Project, int(project_id))
-                    
-                    if project and project.user_id == current_user.id:
-                        storage_base = os.path.join(app.root_path, 'storage')
-                        
-                        for att in project.attachments:
-                            safe_path = os.path.join(storage_base, str(current_user.id), str(project.id), att.filename)
-                            
-                            if os.path.exists(safe_path):
-                                with open(safe_path, 'rb') as f_disk:
-                                    file_content = f_disk.read()
-                                    buf = io.BytesIO(file_content)
-                                    buf.seek(0)
-                                    
-                                    lista_anexos_unificada.append({
-                                        'filename': att.filename,
-                                        'stream': buf,
-                                        'origem': 'disco'
-                                    })
-                except Exception as e_db:
-                    print(f"!!! Erro ao recuperar anexos do banco: {e_db}")
+        filename_pdf = f'Relatorio_{tipo_relatorio}_TpM.pdf'
+        # O PDF segue aberto até a resposta: uma invalidação (a cada salvamento) ou o limite
+        # do cache podem apagá-lo do disco a qualquer momento
+        arquivo = report_cache.abrir(current_user.id, cache_project_id, chave)
+
+        if arquivo:
+            print(f"--- Relatório servido do cache ({chave[:12]}) ---")
         else:
-            print(f"--- Ignorando anexos para relatório da {tipo_relatorio} ---")
+            # Chama a função de lógica de negócio passando o tipo.
+            # O PDF é escrito direto em disco (arquivo do cache), sem cópia final em memória.
+            estatisticas = {}
+            with report_cache.escrever(current_user.id, cache_project_id, chave, manter_aberto=True) as arquivo:
+                gerar_pdf_com_anexos(data, lista_anexos_unificada, tipo_relatorio=tipo_relatorio, destino=arquivo,
+                                     dpi_imagens=app.config['REPORT_IMAGE_DPI'],
+                                     qualidade_jpeg=app.config['REPORT_IMAGE_JPEG_QUALITY'],
+                                     estatisticas=estatisticas, pool_conversao=pool_conversao)
+                # Sair com erro descarta o temporário: um relatório incompleto não entra no cache
+                if estatisticas['anexos_com_erro']:
+                    raise AnexosComErro(estatisticas['anexos_com_erro'])
+            metrics.registrar_pdf(estatisticas, tipo_relatorio, 'sincrono')
 
-        # Chama a função de lógica de negócio passando o tipo
-        pdf_buffer = gerar_pdf_com_anexos(data, lista_anexos_unificada, tipo_relatorio=tipo_relatorio)
-
-        # Prepara a resposta HTTP 
-        filename_pdf = f'Relatorio_{tipo_relatorio}_TpM.pdf'
-        response = make_response(pdf_buffer.getvalue())
-        response.headers['Content-Type'] = 'application/pdf'
-        response.headers['Content-Disposition'] = f'attachment; filename={filename_pdf}'
-        
-        return response
+        # Prepara a resposta HTTP: o arquivo é enviado em blocos (streaming) pelo send_file
+        return enviar_pdf(arquivo, filename_pdf, etag=chave)
 
     except Exception as e:
         print(f"!!! CRITICAL ERROR no handle_gerar_relatorio: {e}")
@@ -454,6 +1070,279 @@ def handle_gerar_relatorio():
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+# ------------------------------------------------------------------
+# --- RELATÓRIOS EM SEGUNDO PLANO (JOBS) ---
+# ------------------------------------------------------------------
+
+@app.route('/api/relatorios', methods=['POST'])
+@login_required
+def submeter_relatorio():
+    """
+    Modo job: recebe o mesmo formulário de /api/gerar_relatorio, agenda a geração
+    no pool de processos e responde imediatamente com o id do job (HTTP 202).
+    Se o relatório já estiver no cache, o job nasce concluído.
+    """
+    try:
+        tipo_relatorio, data, lista_anexos_unificada, cache_project_id, chave = \
+            preparar_relatorio(request.form, request.files.getlist('anexos'))
+
+        pronto = report_cache.abrir(current_user.id, cache_project_id, chave)
+        try:
+            job_id = report_jobs.submeter(
+                current_user.id, data, lista_anexos_unificada, tipo_relatorio,
+                filename_pdf=f'Relatorio_{tipo_relatorio}_TpM.pdf',
+                dpi_imagens=app.config['REPORT_IMAGE_DPI'],
+                qualidade_jpeg=app.config['REPORT_IMAGE_JPEG_QUALITY'],
+                publicar_em={
+                    'dir': app.config['REPORT_CACHE_DIR'],
+                    'max_bytes': app.config['REPORT_CACHE_MAX_BYTES'],
+                    'user_id': current_user.id,
+                    'project_id': cache_project_id,
+                    'chave': chave,
+                },
+                pronto=pronto
+            )
+        finally:
+            if pronto:
+                pronto.close()
+        print(f"--- Job de relatório {job_id} criado ({tipo_relatorio}) ---")
+
+        resposta = dict(report_jobs.status(job_id, current_user.id))
+        resposta['job_id'] = job_id
+        resposta['status_url'] = url_for('status_relatorio', job_id=job_id)
+        if resposta['status'] == 'concluido':
+            resposta['download_url'] = url_for('baixar_relatorio', job_id=job_id)
+        return jsonify(resposta), 202
+
+    except Exception as e:
+        print(f"!!! Erro ao criar job de relatório: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/relatorios/<job_id>', methods=['GET'])
+@login_required
+def status_relatorio(job_id):
+    """Polling: informa se o job está pendente, concluído ou com erro."""
+    status = report_jobs.status(job_id, current_user.id)
+    if status is None:
+        return jsonify({"error": "Job não encontrado ou expirado"}), 404
+
+    status = dict(status)
+    if status['status'] == 'concluido':
+        status['download_url'] = url_for('baixar_relatorio', job_id=job_id)
+    return jsonify(status)
+
+@app.route('/api/relatorios/<job_id>/arquivo', methods=['GET'])
+@login_required
+def baixar_relatorio(job_id):
+    """Entrega o PDF de um job concluído."""
+    resultado = report_jobs.arquivo(job_id, current_user.id)
+    if resultado is None:
+        return jsonify({"error": "Relatório não encontrado ou expirado"}), 404
+
+    arquivo, filename_pdf = resultado
+    return enviar_pdf(arquivo, filename_pdf)
+
+# ------------------------------------------------------------------
+# --- EXPORTAÇÃO / IMPORTAÇÃO DE PROJETOS (ZIP) ---
+# ------------------------------------------------------------------
+
+# Projetos lidos do banco / gravados por vez na exportação e na importação
+LOTE_PROJETOS = 100
+
+def serializar_projeto(project):
+    """
+    JSON de um projeto para a exportação e a lista dos arquivos dos seus anexos
+    [(sha256, caminho, nome)]. Anexos cujo arquivo sumiu do disco ficam de fora.
+    """
+    textos = ler_textos(project, [c for campos in CAMPOS_POR_FASE.values() for c in campos])
+    dados = {
+        'id': project.id,
+        'name': project.name,
+        'responsible': project.responsible,
+        'created_at': project.created_at.isoformat() if project.created_at else None,
+        'updated_at': project.updated_at.isoformat() if project.updated_at else None,
+        'textos': {chave: valor for chave, valor in textos.items() if valor is not None},
+        'anexos': [],
+    }
+    arquivos = []
+    for att in project.attachments:
+        caminho = caminho_anexo(att)
+        if not os.path.exists(caminho):
+            print(f"!!! Exportação: arquivo do anexo {att.id} não encontrado ({caminho})")
+            continue
+        sha256 = att.blob_sha256 or hash_arquivo(caminho)
+        dados['anexos'].append({
+            'filename': att.filename,
+            'filetype': att.filetype,
+            'file_size': att.file_size,
+            'sha256': sha256,
+            'uploaded_at': att.uploaded_at.isoformat() if att.uploaded_at else None,
+        })
+        arquivos.append((sha256, caminho, att.filename))
+    return dados, arquivos
+
+def projetos_para_exportar(user_id):
+    """Projetos do usuário em lotes (cursor pelo id), liberados da sessão a cada lote."""
+    ultimo_id = 0
+    while True:
+        lote = (Project.query.options(selectinload(Project.attachments))
+                .filter(Project.user_id == user_id, Project.id > ultimo_id)
+                .order_by(Project.id).limit(LOTE_PROJETOS).all())
+        if not lote:
+            return
+        for project in lote:
+            yield serializar_projeto(project)
+        ultimo_id = lote[-1].id
+        db.session.expunge_all()
+
+def exportar_projetos(user):
+    """Gerador dos bytes do ZIP com todos os projetos e anexos de um usuário."""
+    return gerar_zip(projetos_para_exportar(user.id), {'usuario': user.username})
+
+def _data_iso(valor):
+    return datetime.fromisoformat(valor) if valor else None
+
+def importar_projetos(user_id, leitor):
+    """
+    Cria, para o usuário, os projetos de um ZIP exportado (sempre como projetos novos).
+    Os anexos voltam para o armazenamento deduplicado (conteúdos já existentes não são
+    gravados de novo) e cada lote de projetos é gravado com um único commit.
+    Retorna (projetos, anexos) importados.
+    """
+    total_projetos, total_anexos = 0, 0
+    lote = []
+
+    def gravar_lote():
+        nonlocal total_projetos, total_anexos
+        gravados = []
+        try:
+            # Um flush para o lote inteiro: os ids saem de uma vez
+            db.session.add_all(project for project, _ in lote)
+            db.session.flush()
+            for project, dados in lote:
+                if layout_atual() == 'tabela':
+                    gravar_textos(project, dados.get('textos') or {})
+                for anexo in dados.get('anexos') or []:
+                    with leitor.abrir_anexo(anexo.get('sha256')) as origem:
+                        sha256, tmp_path, tamanho = blob_store.receber(origem)
+                    if sha256 != anexo['sha256']:
+                        os.remove(tmp_path)
+                        raise ArquivoInvalido(f"Conteúdo do anexo '{anexo.get('filename')}' não confere com o hash")
+                    gravados.append(sha256)
+                    registrar_anexo(project, sha256, tamanho, anexo['filename'],
+                                    anexo.get('filetype') or 'application/octet-stream', origem=tmp_path)
+                    total_anexos += 1
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # Blobs gravados neste lote e que ficaram sem registro no banco
+            apagar_blobs_liberados(gravados)
+            raise
+        total_projetos += len(lote)
+        lote.clear()
+        db.session.expunge_all()
+
+    for dados in leitor.projetos():
+        project = Project(
+            user_id=user_id,
+            name=(dados.get('name') or 'Projeto importado')[:150],
+            responsible=dados.get('responsible'),
+            created_at=_data_iso(dados.get('created_at')),
+        )
+        # No layout em colunas os textos vão no próprio INSERT do projeto
+        if layout_atual() == 'colunas':
+            gravar_textos(project, dados.get('textos') or {})
+        lote.append((project, dados))
+        if len(lote) >= LOTE_PROJETOS:
+            gravar_lote()
+            print(f"--- {total_projetos} projeto(s) importado(s)")
+    if lote:
+        gravar_lote()
+    return total_projetos, total_anexos
+
+@app.route('/api/export', methods=['GET'])
+@login_required
+def exportar():
+    """Baixa um ZIP com todos os projetos e anexos do usuário, gerado sob demanda (streaming)."""
+    nome = f"smart_tpm_{secure_filename(current_user.username) or current_user.id}_{datetime.utcnow():%Y%m%d}.zip"
+    resposta = Response(stream_with_context(exportar_projetos(current_user)), mimetype='application/zip')
+    resposta.headers['Content-Disposition'] = f'attachment; filename="{nome}"'
+    resposta.headers['Cache-Control'] = 'no-store'
+    return resposta
+
+@app.route('/api/import', methods=['POST'])
+@login_required
+def importar():
+    """Importa um ZIP gerado por /api/export (campo 'arquivo') como projetos novos do usuário."""
+    arquivo = request.files.get('arquivo')
+    if not arquivo or not arquivo.filename:
+        return jsonify({"error": "Envie o arquivo .zip no campo 'arquivo'"}), 400
+    try:
+        leitor = LeitorZip(arquivo.stream)
+        try:
+            projetos, anexos = importar_projetos(current_user.id, leitor)
+        finally:
+            leitor.fechar()
+        return jsonify({"message": "Importação concluída.", "projetos": projetos, "anexos": anexos})
+    except ArquivoInvalido as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"!!! Erro ao importar projetos: {e}")
+        return jsonify({"error": str(e)}), 500
+
+# ------------------------------------------------------------------
+# --- BUSCA NOS ANEXOS DO PROJETO ---
+# ------------------------------------------------------------------
+
+@app.route('/api/projects/<int:project_id>/busca', methods=['GET'])
+@login_required
+def buscar_anexos(project_id):
+    """
+    Busca semântica nos anexos de um projeto: ?q=<texto>&k=<quantidade, padrão 5>.
+    Consulta só o índice do próprio projeto (anexos ainda em indexação não aparecem).
+    """
+    consulta = (request.args.get('q') or '').strip()
+    if not consulta:
+        return jsonify({"error": "Informe o texto da busca no parâmetro 'q'"}), 400
+    k = max(1, min(request.args.get('k', 5, type=int), 20))
+    try:
+        project = _projeto_do_usuario(project_id)
+        if not project:
+            return jsonify({"error": "Não autorizado"}), 404
+
+        resultados = indices_projetos().buscar(current_user.id, project_id, consulta, k)
+        # Liga cada trecho ao anexo atual (o índice pode ainda citar um anexo recém-removido)
+        anexos = {att.blob_sha256 or f'anexo-{att.id}': att for att in project.attachments}
+        itens = []
+        for item in resultados:
+            attachment = anexos.get(item.pop('sha256'))
+            if attachment:
+                itens.append(dict(item, attachment_id=attachment.id))
+        return jsonify({"resultados": itens})
+    except ImportError as e:
+        return jsonify({"error": f"Busca indisponível neste servidor: {e}"}), 503
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# ------------------------------------------------------------------
+# --- MÉTRICAS (PROMETHEUS) ---
+# ------------------------------------------------------------------
+
+@app.route('/metrics', methods=['GET'])
+def exportar_metricas():
+    """
+    Métricas deste processo no formato texto do Prometheus. Sem login (para o coletor),
+    mas exige 'Authorization: Bearer <METRICS_TOKEN>'. Sem token configurado o endpoint
+    fica desativado: tempos por rota e consultas ao banco não são públicos, e atrás de um
+    proxy reverso não dá para confiar no endereço de origem (localhost) para liberá-lo.
+    """
+    token = app.config.get('METRICS_TOKEN')
+    if not token:
+        return jsonify({"error": "Métricas desativadas (configure METRICS_TOKEN)"}), 404
+    if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+        return jsonify({"error": "Não autorizado"}), 401
+    return Response(metrics.registro.exportar(), mimetype='text/plain; version=0.0.4')
+
 # ------------------------------------------------------------------
 # --- COMANDOS CLI (SETUP & ADMIN) ---
 # ------------------------------------------------------------------
@@ -462,12 +1351,114 @@ def handle_gerar_relatorio():
 def setup_db():
     """Cria as tabelas no banco de dados MariaDB."""
     try:
-        from models import User, Project, Attachment
+        from models import User, Project, Attachment, Blob, ProjectField
         db.create_all()
         print(">>> Sucesso! Tabelas criadas.")
     except Exception as e:
         print(f">>> Erro ao criar tabelas: {e}")
 
+@app.cli.command("migrate-fields")
+@click.option('--para', 'destino', type=click.Choice(LAYOUTS), default='tabela', show_default=True,
+              help="Layout de destino dos textos das fases.")
+def migrate_fields(destino):
+    """Move os textos das fases entre as colunas de projects e a tabela project_fields."""
+    try:
+        atualizar_esquema()
+
+        ids = [project_id for (project_id,) in db.session.query(Project.id).order_by(Project.id)]
+        for i, project_id in enumerate(ids, 1):
+            migrar_layout(db.session.get(Project, project_id), destino)
+            # Commits em lotes: bancos grandes não ficam com uma transação gigante
+            if i % 100 == 0:
+                db.session.commit()
+                db.session.expunge_all()
+                print(f"--- {i}/{len(ids)} projetos")
+        db.session.commit()
+
+        print(f">>> Sucesso! Textos de {len(ids)} projeto(s) no layout '{destino}'.")
+        if app.config['PROJECT_FIELDS_LAYOUT'] != destino:
+            print(f">>> Defina PROJECT_FIELDS_LAYOUT={destino} e reinicie a aplicação.")
+    except Exception as e:
+        db.session.rollback()
+        print(f">>> Erro ao migrar os textos: {e}")
+
+def atualizar_esquema():
+    """
+    Leva um banco já existente ao esquema atual dos models: cria tabelas novas e
+    acrescenta colunas e índices que faltam (o create_all não altera tabelas existentes).
+    """
+    from sqlalchemy import inspect, text
+    db.create_all()
+
+    inspetor = inspect(db.engine)
+    for tabela in db.metadata.sorted_tables:
+        colunas = {c['name'] for c in inspetor.get_columns(tabela.name)}
+        with db.engine.begin() as conn:
+            for coluna in tabela.columns:
+                if coluna.name not in colunas:
+                    tipo = coluna.type.compile(dialect=db.engine.dialect)
+                    padrao = f" DEFAULT {coluna.server_default.arg}" if coluna.server_default is not None else ""
+                    conn.execute(text(f"ALTER TABLE {tabela.name} ADD COLUMN {coluna.name} {tipo}{padrao}"))
+                    print(f"--- Coluna criada: {tabela.name}.{coluna.name}")
+
+        indices = {i['name'] for i in inspetor.get_indexes(tabela.name)}
+        for indice in tabela.indexes:
+            if indice.name not in indices:
+                indice.create(db.engine)
+                print(f"--- Índice criado: {indice.name}")
+
+@app.cli.command("upgrade-db")
+def upgrade_db():
+    """Atualiza as tabelas de um banco existente (colunas e índices novos)."""
+    try:
+        atualizar_esquema()
+        print(">>> Sucesso! Esquema atualizado.")
+    except Exception as e:
+        print(f">>> Erro ao atualizar o esquema: {e}")
+
+@app.cli.command("migrate-blobs")
+def migrate_blobs():
+    """Move os anexos antigos (uma cópia por projeto) para o armazenamento deduplicado."""
+    try:
+        atualizar_esquema()
+
+        migrados, repetidos, economia = 0, 0, 0
+        for att in Attachment.query.filter(Attachment.blob_sha256.is_(None)).all():
+            origem = caminho_anexo(att)
+            if not os.path.exists(origem):
+                print(f"!!! Arquivo do anexo {att.id} não encontrado: {origem}")
+                continue
+
+            with open(origem, 'rb') as f:
+                sha256, tmp_path, tamanho = blob_store.receber(f)
+            try:
+                blob = referenciar_blob(sha256, tamanho)
+                if blob.ref_count > 1:
+                    repetidos += 1
+                    economia += tamanho
+                # Só depois da referência presa (ver registrar_anexo)
+                blob_path = blob_store.guardar_arquivo(tmp_path, sha256)[1]
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            att.blob_sha256 = sha256
+            att.filepath = blob_path
+            att.file_size = tamanho
+            att.pages_path = None
+            gerar_paginas_anexo(att, blob_path)
+            db.session.commit()
+
+            # A cópia antiga só é apagada depois que o banco já aponta para o blob
+            os.remove(origem)
+            remover_paginas_anexo(origem)
+            migrados += 1
+
+        print(f">>> Sucesso! {migrados} anexo(s) migrado(s), {repetidos} repetido(s) "
+              f"({economia / (1024 * 1024):.1f} MB liberados).")
+    except Exception as e:
+        db.session.rollback()
+        print(f">>> Erro ao migrar anexos: {e}")
+
 @app.cli.command("create-users")
 def create_users():
     """Cria usuários de teste padrão."""
@@ -484,6 +1475,7 @@ def create_users():
             new_user = User(username=username, email=email, password_hash=hashed_pw)
             db.session.add(new_user)
         db.session.commit()
+        user_cache.invalidar()
         print(">>> Usuários criados com sucesso!")
     except Exception as e:
         db.session.rollback()
@@ -511,6 +1503,7 @@ def add_user():
         
         db.session.add(new_user)
         db.session.commit()
+        user_cache.invalidar()
         
         print(f"\n>>> Sucesso! Usuário '{username}' criado.")
         
@@ -518,5 +1511,78 @@ def add_user():
         db.session.rollback()
         print(f"Erro ao criar usuário: {e}")
 
+@app.cli.command("export-projects")
+@click.argument('username')
+@click.argument('destino', type=click.Path(dir_okay=False, writable=True))
+def export_projects(username, destino):
+    """Exporta todos os projetos (e anexos) de um usuário para um arquivo ZIP."""
+    try:
+        user = User.query.filter_by(username=username).first()
+        if not user:
+            print(f"Erro: O usuário '{username}' não existe.")
+            return
+
+        tamanho = 0
+        with open(destino, 'wb') as f:
+            for pedaco in exportar_projetos(user):
+                f.write(pedaco)
+                tamanho += len(pedaco)
+        print(f">>> Sucesso! Projetos de '{username}' exportados para {destino} "
+              f"({tamanho / (1024 * 1024):.1f} MB).")
+    except Exception as e:
+        print(f">>> Erro ao exportar projetos: {e}")
+
+@app.cli.command("import-projects")
+@click.argument('username')
+@click.argument('arquivo', type=click.Path(exists=True, dir_okay=False))
+def import_projects(username, arquivo):
+    """Importa um ZIP gerado por export-projects como projetos novos do usuário."""
+    try:
+        user = User.query.filter_by(username=username).first()
+        if not user:
+            print(f"Erro: O usuário '{username}' não existe.")
+            return
+
+        leitor = LeitorZip(arquivo)
+        try:
+            projetos, anexos = importar_projetos(user.id, leitor)
+        finally:
+            leitor.fechar()
+        print(f">>> Sucesso! {projetos} projeto(s) e {anexos} anexo(s) importados para '{username}'.")
+    except Exception as e:
+        print(f">>> Erro ao importar projetos: {e}")
+
+@app.cli.command("index-projects")
+@click.option('--usuario', 'username', default=None, help="Só os projetos deste usuário")
+def index_projects(username):
+    """Constrói/atualiza agora os índices dos anexos dos projetos (ex.: anexos enviados antes do índice existir)."""
+    try:
+        filtros = []
+        if username:
+            user = User.query.filter_by(username=username).first()
+            if not user:
+                print(f"Erro: O usuário '{username}' não existe.")
+                return
+            filtros.append(Project.user_id == user.id)
+
+        indices = indices_projetos()
+        total, ultimo_id = 0, 0
+        while True:
+            lote = (Project.query.options(selectinload(Project.attachments))
+                    .filter(Project.id > ultimo_id, *filtros)
+                    .order_by(Project.id).limit(LOTE_PROJETOS).all())
+            if not lote:
+                break
+            for project in lote:
+                trechos = indices.construir(project.user_id, project.id, anexos_para_indice(project))
+                if trechos:
+                    print(f"--- Projeto {project.id}: {trechos} trecho(s) novo(s)")
+            total += len(lote)
+            ultimo_id = lote[-1].id
+            db.session.expunge_all()
+        print(f">>> Sucesso! {total} projeto(s) verificados.")
+    except Exception as e:
+        print(f">>> Erro ao indexar projetos: {e}")
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
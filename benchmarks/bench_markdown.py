@@ -0,0 +1,110 @@
+# benchmarks/bench_markdown.py
+"""
+Compara o tokenizador de Markdown do pdf_generator com a cadeia antiga
+(markdown2 -> BeautifulSoup -> regex) em textos de requisitos grandes.
+
+Uso (na raiz do projeto):
+    pip install markdown2 beautifulsoup4   # apenas para a cadeia antiga
+    python benchmarks/bench_markdown.py [--secoes 200] [--repeticoes 20]
+"""
+import os
+import re
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pdf_generator import PDF, analisar_markdown, formatar_texto_usuario
+
+
+def texto_requisitos(secoes):
+    """Gera um texto de requisitos sintético com títulos, parágrafos e listas aninhadas."""
+    partes = []
+    for i in range(secoes):
+        partes.append(f"## Requisito {i}")
+        partes.append(
+            f"O sistema deve coletar a **temperatura** do sensor {i} a cada _30 segundos_ "
+            f"e enviar os dados ao gateway, mantendo ***alta disponibilidade*** mesmo com falhas de rede."
+        )
+        partes.append("- Restrições")
+        partes.append("  - Consumo de energia **baixo**")
+        partes.append("  - Alcance mínimo de _100 m_")
+        partes.append("    - Em ambiente industrial")
+        partes.append("- Critérios de aceite")
+        partes.append("")
+    return "\n".join(partes)
+
+
+def cadeia_antiga(markdown_text):
+    """Reprodução da análise anterior: markdown2 -> BeautifulSoup -> get_text -> regex."""
+    import markdown2
+    from bs4 import BeautifulSoup
+
+    def spans(line_text):
+        line_text = line_text.replace("\n", " ").strip()
+        line_text = re.sub(r"\*\*(.*?)\*\*", r"<b>\1</b>", line_text)
+        line_text = re.sub(r"_(.*?)_", r"<i>\1</i>", line_text)
+        resultado, style = [], ""
+        for part in re.split(r"(<b>|</b>|<i>|</i>)", line_text):
+            if part == "<b>": style = "B"
+            elif part == "</b>": style = ""
+            elif part == "<i>": style = "I"
+            elif part == "</i>": style = ""
+            elif part: resultado.append((style, part))
+        return resultado
+
+    html = markdown2.markdown(markdown_text, extras=["cuddled-lists"])
+    soup = BeautifulSoup(html, "html.parser")
+    layout = []
+    for elem in soup.children:
+        if elem.name is None: continue
+        text = elem.get_text(" ", strip=True)
+        if not text: continue
+        if elem.name in ["h1", "h2", "h3"]:
+            layout.append(("titulo", text))
+        elif elem.name == "p":
+            layout.append(("paragrafo", spans(text)))
+        elif elem.name in ["ul", "ol"]:
+            layout.append(("lista", [spans(li.get_text(" ", strip=True)) for li in elem.find_all("li")]))
+    return layout
+
+
+def medir(funcao, texto, repeticoes):
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        funcao(texto)
+    return (time.perf_counter() - inicio) / repeticoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--secoes', type=int, default=200, help='Quantidade de requisitos no texto sintético')
+    parser.add_argument('--repeticoes', type=int, default=20, help='Repetições por medição')
+    args = parser.parse_args()
+
+    texto = formatar_texto_usuario(texto_requisitos(args.secoes))
+    print(f"--- Texto sintético: {args.secoes} requisitos, {len(texto) / 1024:.1f} KB ---")
+
+    # __wrapped__ ignora o LRU: mede a análise de fato, não o acerto do cache
+    t_novo = medir(analisar_markdown.__wrapped__, texto, args.repeticoes)
+    print(f"Tokenizador direto:          {t_novo * 1000:8.2f} ms")
+
+    try:
+        t_antigo = medir(cadeia_antiga, texto, args.repeticoes)
+        print(f"markdown2 + BS4 + regex:     {t_antigo * 1000:8.2f} ms")
+        print(f"-> {t_antigo / t_novo:.1f}x mais rápido")
+    except ImportError:
+        print("(markdown2/beautifulsoup4 não instalados: cadeia antiga não medida)")
+
+    analisar_markdown.cache_clear()
+    inicio = time.perf_counter()
+    pdf = PDF()
+    pdf.add_page()
+    pdf.add_markdown_body(texto, (41, 128, 185))
+    pdf.output()
+    print(f"Renderização completa no PDF: {(time.perf_counter() - inicio) * 1000:8.2f} ms ({pdf.page_no()} páginas)")
+
+
+if __name__ == "__main__":
+    main()
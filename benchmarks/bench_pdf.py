@@ -0,0 +1,419 @@
+# benchmarks/bench_pdf.py
+"""
+Suíte de desempenho da geração de PDFs: formatar_texto_usuario, PDF.add_markdown_body
+e gerar_pdf_com_anexos, com fixtures sintéticas e determinísticas (textos mínimos e
+enormes, listas profundas, 0/10/100 anexos mistos de PDF e imagem, fotos 4K).
+
+Para cada cenário mede o tempo de parede (mediana das repetições), o pico de memória
+(tracemalloc, em uma execução separada das medições de tempo) e o tamanho da saída.
+A memória alocada fora do Python (buffers de imagem do Pillow) não entra no pico.
+
+Uso (na raiz do projeto):
+    python benchmarks/bench_pdf.py                        # roda todos os cenários
+    python benchmarks/bench_pdf.py --listar
+    python benchmarks/bench_pdf.py --cenarios markdown_grande,relatorio_10_anexos
+    python benchmarks/bench_pdf.py --salvar baseline.json # grava a linha de base
+    python benchmarks/bench_pdf.py --comparar baseline.json [--tolerancia 0.10]
+
+Com --comparar, o script termina com código 1 se algum cenário ficar mais lento ou
+usar mais memória que a linha de base além da tolerância.
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import statistics
+import tracemalloc
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fpdf import FPDF, XPos, YPos
+from PIL import Image, ImageDraw
+
+from config import Config
+from pdf_generator import (PDF, CAMPOS_RELATORIO, PoolConversao, analisar_markdown, caminho_paginas_imagem,
+                           converter_imagem_para_pdf, formatar_texto_usuario, gerar_pdf_com_anexos)
+
+# Versão do formato do arquivo de linha de base
+VERSAO_BASELINE = 1
+COR_DESTAQUE = (41, 128, 185)
+
+
+# ------------------------------------------------------------------
+# --- FIXTURES SINTÉTICAS ---
+# ------------------------------------------------------------------
+# Tudo é gerado a partir de sementes fixas: duas execuções produzem os mesmos bytes,
+# então resultados gravados como linha de base continuam comparáveis.
+
+def texto_pequeno():
+    return "##Objetivo\nMonitorar a **temperatura** da sala.\n-Sensor\n-Gateway"
+
+
+def texto_grande(secoes=400):
+    """Campo enorme: títulos, parágrafos longos com ênfases e listas curtas."""
+    partes = []
+    for i in range(secoes):
+        partes.append(f"## Requisito {i}")
+        partes.append(
+            f"O sistema deve coletar a **temperatura** do sensor {i} a cada _30 segundos_ e enviar "
+            f"os dados ao gateway, mantendo ***alta disponibilidade*** mesmo com falhas de rede. "
+            f"Leituras fora da faixa esperada devem gerar um alerta para o operador responsável."
+        )
+        partes.append("- Restrições")
+        partes.append("  - Consumo de energia **baixo**")
+        partes.append("- Critérios de aceite")
+        partes.append("")
+    return "\n".join(partes)
+
+
+def texto_listas_profundas(listas=60, profundidade=8):
+    """Listas aninhadas em muitos níveis, com itens que quebram linha."""
+    partes = []
+    for i in range(listas):
+        partes.append(f"## Hierarquia {i}")
+        for nivel in range(profundidade):
+            recuo = "  " * nivel
+            partes.append(f"{recuo}- Nível {nivel}: componente **{i}.{nivel}** com descrição _um pouco longa_ "
+                          f"para forçar a quebra de linha dentro do item da lista")
+        for nivel in range(profundidade - 1, -1, -2):
+            partes.append(f"{'  ' * nivel}- Retorno ao nível {nivel}")
+        partes.append("")
+    return "\n".join(partes)
+
+
+def dados_relatorio(tipo_relatorio, texto):
+    data = {'nome_projeto': 'Projeto de Benchmark', 'responsavel': 'Equipe'}
+    for campo, _ in CAMPOS_RELATORIO[tipo_relatorio]:
+        data[campo] = texto
+    return data
+
+
+def gerar_imagem(caminho, largura, altura, semente, formato='JPEG'):
+    """Imagem com textura (ruído ampliado) e formas, para a compressão não ficar trivial."""
+    rnd = random.Random(semente)
+    base = Image.frombytes('RGB', (largura // 8, altura // 8), rnd.randbytes((largura // 8) * (altura // 8) * 3))
+    img = base.resize((largura, altura), Image.BICUBIC)
+    desenho = ImageDraw.Draw(img)
+    for _ in range(40):
+        x, y = rnd.randrange(largura), rnd.randrange(altura)
+        r = rnd.randrange(20, max(21, largura // 6))
+        cor = tuple(rnd.randrange(256) for _ in range(3))
+        desenho.ellipse((x - r, y - r, x + r, y + r), fill=cor)
+    if formato == 'JPEG':
+        img.save(caminho, format='JPEG', quality=90)
+    else:
+        img.save(caminho, format=formato)
+
+
+def gerar_pdf_anexo(caminho, paginas, semente):
+    rnd = random.Random(semente)
+    pdf = FPDF()
+    pdf.set_font('Helvetica', '', 11)
+    for p in range(paginas):
+        pdf.add_page()
+        for _ in range(30):
+            pdf.multi_cell(0, 6, f"Página {p + 1} - medição {rnd.randrange(10 ** 6)} registrada no ensaio de campo.",
+                           new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.output(caminho)
+
+
+class Fixtures:
+    """Arquivos de anexo gerados sob demanda em uma pasta temporária e reaproveitados entre cenários."""
+
+    def __init__(self, pasta):
+        self.pasta = pasta
+        self._cache = {}
+
+    def _arquivo(self, nome, gerar):
+        if nome not in self._cache:
+            caminho = os.path.join(self.pasta, nome)
+            gerar(caminho)
+            self._cache[nome] = caminho
+        return self._cache[nome]
+
+    def anexos_mistos(self, quantidade):
+        """Metade PDFs de 3 páginas, metade imagens (JPEG e PNG de 1600x1200) ainda não convertidas."""
+        anexos = []
+        for i in range(quantidade):
+            if i % 2 == 0:
+                nome = f'doc_{i % 10}.pdf'
+                caminho = self._arquivo(nome, lambda c, s=i: gerar_pdf_anexo(c, 3, s))
+            else:
+                ext, formato = ('jpg', 'JPEG') if i % 4 == 1 else ('png', 'PNG')
+                nome = f'foto_{i % 10}.{ext}'
+                caminho = self._arquivo(nome, lambda c, s=i, f=formato: gerar_imagem(c, 1600, 1200, s, f))
+            anexos.append({'filename': nome, 'caminho': caminho})
+        return anexos
+
+    def fotos_4k(self, quantidade, pre_convertidas=False):
+        """Fotos 3840x2160; com `pre_convertidas`, usa a versão em PDF feita no upload."""
+        anexos = []
+        for i in range(quantidade):
+            nome = f'foto4k_{i}.jpg'
+            caminho = self._arquivo(nome, lambda c, s=1000 + i: gerar_imagem(c, 3840, 2160, s))
+            anexo = {'filename': nome, 'caminho': caminho}
+            if pre_convertidas:
+                dpi, qualidade = Config.REPORT_IMAGE_DPI, Config.REPORT_IMAGE_JPEG_QUALITY
+                anexo['paginas'] = self._arquivo(
+                    os.path.basename(caminho_paginas_imagem(caminho, dpi, qualidade)),
+                    lambda c, o=caminho: converter_imagem_para_pdf(o, c, dpi=dpi, qualidade=qualidade))
+            anexos.append(anexo)
+        return anexos
+
+
+# ------------------------------------------------------------------
+# --- CENÁRIOS ---
+# ------------------------------------------------------------------
+# Cada cenário é uma função sem argumentos (preparada fora da medição) que executa o
+# trabalho uma vez e retorna (bytes de saída, estatísticas por etapa ou None).
+
+def cenario_formatar(texto):
+    def executar():
+        return len(formatar_texto_usuario(texto).encode('utf-8')), None
+    return executar
+
+
+def cenario_markdown(texto):
+    texto = formatar_texto_usuario(texto)
+
+    def executar():
+        # Sem o LRU: mede a análise e o desenho, não o acerto do cache
+        analisar_markdown.cache_clear()
+        pdf = PDF()
+        pdf.add_page()
+        pdf.add_markdown_body(texto, COR_DESTAQUE)
+        return len(pdf.output()), None
+    return executar
+
+
+def cenario_relatorio(pasta, data, anexos, tipo_relatorio='fase1', pool_conversao=None):
+    saida = os.path.join(pasta, 'saida.pdf')
+
+    def executar():
+        analisar_markdown.cache_clear()
+        estatisticas = {}
+        with open(saida, 'wb') as destino:
+            gerar_pdf_com_anexos(data, anexos, tipo_relatorio=tipo_relatorio, destino=destino,
+                                 dpi_imagens=Config.REPORT_IMAGE_DPI,
+                                 qualidade_jpeg=Config.REPORT_IMAGE_JPEG_QUALITY,
+                                 estatisticas=estatisticas, pool_conversao=pool_conversao)
+        etapas = {k: estatisticas[k] for k in ('render', 'conversao', 'juncao', 'escrita')}
+        return estatisticas['bytes_saida'], etapas
+    return executar
+
+
+def cenario_fases_separadas(pasta, data, anexos):
+    """As três exportações (fase1, fase2, fase3) que o relatório completo substitui."""
+    fases = [cenario_relatorio(pasta, data, anexos if tipo == 'fase1' else [], tipo_relatorio=tipo)
+             for tipo in ('fase1', 'fase2', 'fase3')]
+
+    def executar():
+        total, etapas = 0, {}
+        for fase in fases:
+            bytes_saida, etapas_fase = fase()
+            total += bytes_saida
+            for k, v in etapas_fase.items():
+                etapas[k] = etapas.get(k, 0.0) + v
+        return total, etapas
+    return executar
+
+
+def montar_cenarios(fixtures, pool_conversao):
+    """Nome -> função que prepara o cenário (as fixtures só são geradas se o cenário rodar)."""
+    pasta = fixtures.pasta
+    return {
+        'formatar_texto_pequeno': lambda: cenario_formatar(texto_pequeno()),
+        'formatar_texto_grande': lambda: cenario_formatar(texto_grande()),
+        'markdown_pequeno': lambda: cenario_markdown(texto_pequeno()),
+        'markdown_grande': lambda: cenario_markdown(texto_grande()),
+        'markdown_listas_profundas': lambda: cenario_markdown(texto_listas_profundas()),
+        'relatorio_0_anexos': lambda: cenario_relatorio(
+            pasta, dados_relatorio('fase1', texto_grande(60)), []),
+        'relatorio_10_anexos': lambda: cenario_relatorio(
+            pasta, dados_relatorio('fase1', texto_pequeno()), fixtures.anexos_mistos(10)),
+        'relatorio_100_anexos': lambda: cenario_relatorio(
+            pasta, dados_relatorio('fase1', texto_pequeno()), fixtures.anexos_mistos(100)),
+        'relatorio_fotos_4k': lambda: cenario_relatorio(
+            pasta, dados_relatorio('fase1', texto_pequeno()), fixtures.fotos_4k(6)),
+        'relatorio_100_anexos_paralelo': lambda: cenario_relatorio(
+            pasta, dados_relatorio('fase1', texto_pequeno()), fixtures.anexos_mistos(100),
+            pool_conversao=pool_conversao),
+        'relatorio_fotos_4k_paralelo': lambda: cenario_relatorio(
+            pasta, dados_relatorio('fase1', texto_pequeno()), fixtures.fotos_4k(6), pool_conversao=pool_conversao),
+        'relatorio_fotos_4k_pre_convertidas': lambda: cenario_relatorio(
+            pasta, dados_relatorio('fase1', texto_pequeno()), fixtures.fotos_4k(6, pre_convertidas=True)),
+        'relatorio_tres_fases_separadas': lambda: cenario_fases_separadas(
+            pasta, dados_relatorio('completo', texto_grande(10)), fixtures.anexos_mistos(10)),
+        'relatorio_completo': lambda: cenario_relatorio(
+            pasta, dados_relatorio('completo', texto_grande(10)), fixtures.anexos_mistos(10),
+            tipo_relatorio='completo'),
+        'relatorio_fase3_grande': lambda: cenario_relatorio(
+            pasta, dados_relatorio('fase3', texto_grande(60)), [], tipo_relatorio='fase3'),
+    }
+
+
+# ------------------------------------------------------------------
+# --- MEDIÇÃO ---
+# ------------------------------------------------------------------
+
+def medir(executar, repeticoes):
+    """
+    Uma execução de aquecimento, uma com tracemalloc (pico de memória) e `repeticoes`
+    execuções cronometradas sem tracemalloc, que distorceria o tempo.
+    Os prints do gerador são descartados para não pesarem na medição.
+    """
+    descarte = io.StringIO()
+    with redirect_stdout(descarte):
+        executar()
+
+        tracemalloc.start()
+        try:
+            executar()
+            _, pico = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        tempos = []
+        bytes_saida, etapas = 0, None
+        for _ in range(repeticoes):
+            descarte.seek(0)
+            descarte.truncate()
+            inicio = time.perf_counter()
+            bytes_saida, etapas = executar()
+            tempos.append(time.perf_counter() - inicio)
+
+    resultado = {
+        'tempo_s': statistics.median(tempos),
+        'tempo_min_s': min(tempos),
+        'pico_memoria_bytes': pico,
+        'bytes_saida': bytes_saida,
+    }
+    if etapas:
+        resultado['etapas_s'] = etapas
+    return resultado
+
+
+def formatar_bytes(n):
+    for unidade in ('B', 'KB', 'MB'):
+        if abs(n) < 1024:
+            return f"{n:.0f} {unidade}" if unidade == 'B' else f"{n:.1f} {unidade}"
+        n /= 1024
+    return f"{n:.1f} GB"
+
+
+def variacao(atual, base):
+    if not base:
+        return None
+    return (atual - base) / base
+
+
+def comparar(resultados, baseline, tolerancia, tolerancia_memoria, folga_s):
+    """Imprime a comparação com a linha de base e retorna os nomes dos cenários com regressão."""
+    regressoes = []
+    base_cenarios = baseline.get('cenarios', {})
+    print(f"\n--- Comparação com a linha de base ({baseline.get('data', '?')}) ---")
+    print(f"{'cenário':38} {'tempo':>22} {'memória':>24} {'saída':>10}")
+    for nome, atual in resultados.items():
+        base = base_cenarios.get(nome)
+        if base is None:
+            print(f"{nome:38} (sem linha de base)")
+            continue
+
+        d_tempo = variacao(atual['tempo_s'], base['tempo_s'])
+        d_mem = variacao(atual['pico_memoria_bytes'], base['pico_memoria_bytes'])
+        d_bytes = variacao(atual['bytes_saida'], base['bytes_saida'])
+        marcas = []
+        # Cenários de poucos milissegundos oscilam muito: exige também um aumento absoluto mínimo
+        if d_tempo is not None and d_tempo > tolerancia and atual['tempo_s'] - base['tempo_s'] > folga_s:
+            marcas.append('TEMPO')
+        if d_mem is not None and d_mem > tolerancia_memoria:
+            marcas.append('MEMÓRIA')
+        if marcas:
+            regressoes.append(nome)
+
+        def pct(d):
+            return '   n/a' if d is None else f"{d * 100:+6.1f}%"
+
+        print(f"{nome:38} {base['tempo_s'] * 1000:8.1f}→{atual['tempo_s'] * 1000:8.1f}ms {pct(d_tempo)}"
+              f" {formatar_bytes(base['pico_memoria_bytes']):>8}→{formatar_bytes(atual['pico_memoria_bytes']):>8} {pct(d_mem)}"
+              f" {pct(d_bytes)}"
+              + (f"   !!! REGRESSÃO ({', '.join(marcas)})" if marcas else ''))
+    return regressoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cenarios', help='Lista de cenários separados por vírgula (padrão: todos)')
+    parser.add_argument('--listar', action='store_true', help='Lista os cenários disponíveis e sai')
+    parser.add_argument('--repeticoes', type=int, default=5, help='Execuções cronometradas por cenário')
+    parser.add_argument('--processos', type=int, default=Config.REPORT_CONVERSION_WORKERS,
+                        help='Processos de conversão nos cenários *_paralelo')
+    parser.add_argument('--salvar', metavar='ARQUIVO', help='Grava os resultados como linha de base (JSON)')
+    parser.add_argument('--comparar', metavar='ARQUIVO', help='Compara com uma linha de base gravada')
+    parser.add_argument('--tolerancia', type=float, default=0.10,
+                        help='Aumento de tempo aceito antes de acusar regressão (0.10 = 10%%)')
+    parser.add_argument('--tolerancia-memoria', type=float, default=0.10,
+                        help='Aumento do pico de memória aceito antes de acusar regressão')
+    parser.add_argument('--folga-ms', type=float, default=2.0,
+                        help='Aumento absoluto de tempo ignorado na comparação (ruído de medição)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='bench_pdf_') as pasta:
+        fixtures = Fixtures(pasta)
+        cenarios = montar_cenarios(fixtures, PoolConversao(args.processos))
+
+        if args.listar:
+            print("\n".join(cenarios))
+            return 0
+
+        nomes = args.cenarios.split(',') if args.cenarios else list(cenarios)
+        desconhecidos = [n for n in nomes if n not in cenarios]
+        if desconhecidos:
+            parser.error(f"cenários desconhecidos: {', '.join(desconhecidos)}")
+
+        print(f"--- bench_pdf: {len(nomes)} cenários, {args.repeticoes} repetições ---")
+        print(f"{'cenário':38} {'tempo (mediana)':>16} {'mínimo':>10} {'pico memória':>13} {'saída':>10}")
+        resultados = {}
+        for nome in nomes:
+            executar = cenarios[nome]()
+            r = resultados[nome] = medir(executar, args.repeticoes)
+            print(f"{nome:38} {r['tempo_s'] * 1000:13.1f} ms {r['tempo_min_s'] * 1000:7.1f} ms"
+                  f" {formatar_bytes(r['pico_memoria_bytes']):>13} {formatar_bytes(r['bytes_saida']):>10}")
+            if 'etapas_s' in r:
+                print("    " + "  ".join(f"{k}={v * 1000:.1f}ms" for k, v in r['etapas_s'].items()))
+
+    if args.salvar:
+        with open(args.salvar, 'w', encoding='utf-8') as f:
+            json.dump({
+                'versao': VERSAO_BASELINE,
+                'data': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'python': platform.python_version(),
+                'plataforma': platform.platform(),
+                'repeticoes': args.repeticoes,
+                'cenarios': resultados,
+            }, f, indent=2, ensure_ascii=False)
+        print(f"\n>>> Linha de base gravada em {args.salvar}")
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('versao') != VERSAO_BASELINE:
+            print(f"!!! Linha de base em formato incompatível (versão {baseline.get('versao')})")
+            return 2
+        regressoes = comparar(resultados, baseline, args.tolerancia, args.tolerancia_memoria,
+                                args.folga_ms / 1000)
+        if regressoes:
+            print(f"\n!!! {len(regressoes)} cenário(s) com regressão: {', '.join(regressoes)}")
+            return 1
+        print("\n>>> Nenhuma regressão acima da tolerância.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
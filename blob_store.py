@@ -0,0 +1,89 @@
+import os
+import shutil
+import hashlib
+import tempfile
+
+# Tamanho dos blocos lidos ao gravar/hashear conteúdos (1 MB)
+TAMANHO_BLOCO = 1024 * 1024
+
+
+class BlobStore:
+    """
+    Armazenamento dos anexos endereçado pelo conteúdo.
+
+    Cada arquivo é gravado uma única vez em `base_dir/<2 primeiros hex>/<sha256>`, não
+    importa quantos projetos o utilizem. A contagem de referências fica no banco (tabela
+    `blobs`); aqui só se cuida dos bytes. Arquivos derivados de um blob (ex.: versões em
+    PDF das imagens) ficam ao lado dele, com o hash como prefixo, e são removidos junto.
+    """
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+
+    def caminho(self, sha256):
+        return os.path.join(self.base_dir, sha256[:2], sha256)
+
+    def existe(self, sha256):
+        return os.path.exists(self.caminho(sha256))
+
+    def guardar_arquivo(self, origem, sha256=None):
+        """
+        Move um arquivo já gravado (no mesmo disco) para o armazenamento.
+        Se o conteúdo já existir, o arquivo de origem é descartado (deduplicação).
+        Retorna (sha256, caminho, tamanho).
+        """
+        if sha256 is None:
+            h = hashlib.sha256()
+            with open(origem, 'rb') as f:
+                for bloco in iter(lambda: f.read(TAMANHO_BLOCO), b''):
+                    h.update(bloco)
+            sha256 = h.hexdigest()
+
+        destino = self.caminho(sha256)
+        tamanho = os.path.getsize(origem)
+        if os.path.exists(destino):
+            os.remove(origem)
+        else:
+            os.makedirs(os.path.dirname(destino), exist_ok=True)
+            try:
+                os.replace(origem, destino)
+            except OSError:
+                # Origem em outro disco: copia para um temporário ao lado do destino e renomeia
+                tmp_path = f'{destino}.{os.getpid()}.tmp'
+                shutil.copyfile(origem, tmp_path)
+                os.replace(tmp_path, destino)
+                os.remove(origem)
+        return sha256, destino, tamanho
+
+    def receber(self, stream):
+        """
+        Grava um stream em um temporário dentro do armazenamento, calculando o SHA-256
+        durante a escrita (uma única passada). Retorna (sha256, caminho do temporário, tamanho);
+        quem chama o passa depois a `guardar_arquivo` (ou o apaga).
+        """
+        os.makedirs(self.base_dir, exist_ok=True)
+        h = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.base_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                for bloco in iter(lambda: stream.read(TAMANHO_BLOCO), b''):
+                    h.update(bloco)
+                    tmp.write(bloco)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return h.hexdigest(), tmp_path, os.path.getsize(tmp_path)
+
+    def remover(self, sha256):
+        """Apaga o blob e todos os arquivos derivados dele."""
+        pasta = os.path.dirname(self.caminho(sha256))
+        if not os.path.isdir(pasta):
+            return
+        for nome in os.listdir(pasta):
+            if nome == sha256 or nome.startswith(sha256 + '.'):
+                try:
+                    os.remove(os.path.join(pasta, nome))
+                except OSError:
+                    pass
+
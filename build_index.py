@@ -1,45 +1,249 @@
 # build_index.py
+import os
 import sys
+import json
+import time
+import hashlib
 import logging
-from llama_index.core import VectorStoreIndex, SimpleDirectoryReader, StorageContext
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from llama_index.core import VectorStoreIndex, SimpleDirectoryReader, StorageContext, load_index_from_storage
+from llama_index.core.ingestion import run_transformations
+from llama_index.core.schema import MetadataMode
 from llama_index.core.settings import Settings
-from llama_index.embeddings.ollama import OllamaEmbedding
-from llama_index.llms.ollama import Ollama
+from vector_store import ArmazemVetores, ARQUIVO_CABECALHO
 
 # Configura o logging para vermos o que está acontecendo
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 logging.getLogger().addHandler(logging.StreamHandler(stream=sys.stdout))
 
+# Manifesto do índice: para cada arquivo de docs/, o hash do conteúdo e os ids dos
+# documentos gerados a partir dele (usados para remover os vetores quando o arquivo muda)
+ARQUIVO_MANIFESTO = 'index_manifest.json'
+# Versão 2: vetores e trechos no ArmazemVetores (binário, mmap) em vez dos JSON do LlamaIndex
+VERSAO_MANIFESTO = 2
+
+# Tamanho dos blocos lidos ao calcular o hash dos arquivos (1 MB)
+TAMANHO_BLOCO = 1024 * 1024
+
+
+def hash_arquivo(caminho):
+    h = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(TAMANHO_BLOCO), b''):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+def listar_arquivos(pasta):
+    """Arquivos indexáveis da pasta (mesmo critério do SimpleDirectoryReader: sem ocultos, sem subpastas)."""
+    arquivos = {}
+    for nome in sorted(os.listdir(pasta)):
+        caminho = os.path.join(pasta, nome)
+        if not nome.startswith('.') and os.path.isfile(caminho):
+            arquivos[nome] = caminho
+    return arquivos
+
+
+def carregar_manifesto(persist_dir):
+    caminho = os.path.join(persist_dir, ARQUIVO_MANIFESTO)
+    try:
+        with open(caminho, encoding='utf-8') as f:
+            manifesto = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifesto.get('versao') != VERSAO_MANIFESTO:
+        return None
+    return manifesto
+
+
+def salvar_manifesto(persist_dir, manifesto):
+    # Grava em um temporário e renomeia: uma interrupção não deixa o manifesto pela metade
+    caminho = os.path.join(persist_dir, ARQUIVO_MANIFESTO)
+    with open(caminho + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifesto, f, indent=1, ensure_ascii=False)
+    os.replace(caminho + '.tmp', caminho)
+
+
+def planejar(arquivos, anteriores):
+    """
+    Compara os arquivos atuais com os do manifesto.
+    O hash só é recalculado quando tamanho ou data de modificação mudaram.
+    Retorna (novos, alterados, removidos, inalterados) e o estado atual de cada arquivo.
+    """
+    novos, alterados, inalterados = [], [], []
+    estado = {}
+    for nome, caminho in arquivos.items():
+        st = os.stat(caminho)
+        anterior = anteriores.get(nome)
+        if anterior and anterior['tamanho'] == st.st_size and anterior['mtime_ns'] == st.st_mtime_ns:
+            sha256 = anterior['sha256']
+        else:
+            sha256 = hash_arquivo(caminho)
+        estado[nome] = {'sha256': sha256, 'tamanho': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+        if anterior is None:
+            novos.append(nome)
+        elif anterior['sha256'] != sha256:
+            alterados.append(nome)
+        else:
+            inalterados.append(nome)
+            estado[nome]['doc_ids'] = anterior.get('doc_ids', [])
+    removidos = [nome for nome in anteriores if nome not in arquivos]
+    return novos, alterados, removidos, inalterados, estado
+
+
+def configurar_modelos(args):
+    """Define o embedder (Ollama ou o local, sem modelo) e o LLM nas Settings do LlamaIndex."""
+    if args.embedder == 'local':
+        from local_embedder import EmbedderLocal
+        Settings.embed_model = EmbedderLocal(dimensao=args.dimensao, embed_batch_size=args.lote_embedding)
+        return
+
+    from llama_index.embeddings.ollama import OllamaEmbedding
+    from llama_index.llms.ollama import Ollama
+    # ATENÇÃO: Confirme que os nomes dos modelos estão corretos
+    Settings.llm = Ollama(model="llama3:8b")
+    Settings.embed_model = OllamaEmbedding(model_name=args.modelo_embedding, embed_batch_size=args.lote_embedding)
+
+
+def gerar_embeddings(nodes, embed_model, lote, concorrencia):
+    """
+    Calcula os vetores dos trechos em lotes de `lote` textos, com no máximo `concorrencia`
+    requisições ao embedder ao mesmo tempo (threads: o trabalho é esperar o servidor).
+    Os vetores ficam em node.embedding, e o insert_nodes não os recalcula.
+    Retorna o tempo gasto em segundos.
+    """
+    inicio = time.perf_counter()
+    textos = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+    inicios = range(0, len(textos), lote)
+
+    def embutir(i):
+        return embed_model.get_text_embedding_batch(textos[i:i + lote])
+
+    with ThreadPoolExecutor(max_workers=max(1, concorrencia)) as executor:
+        # map devolve na ordem dos lotes, então cada vetor volta para o seu trecho
+        for i, vetores in zip(inicios, executor.map(embutir, inicios)):
+            for node, vetor in zip(nodes[i:i + lote], vetores):
+                node.embedding = vetor
+    return time.perf_counter() - inicio
+
+
+def identificar_embedder(args):
+    """Identificação do embedder guardada no manifesto: vetores de outro modelo não se misturam."""
+    if args.embedder == 'local':
+        return f'local:{args.dimensao}'
+    return f'ollama:{args.modelo_embedding}'
+
+
+def indice_existe(persist_dir):
+    return all(os.path.exists(os.path.join(persist_dir, nome)) for nome in ('docstore.json', ARQUIVO_CABECALHO))
+
+
+def carregar_indice(persist_dir):
+    """Índice persistido em `persist_dir` (os modelos já devem estar configurados)."""
+    storage_context = StorageContext.from_defaults(persist_dir=persist_dir,
+                                                   vector_store=ArmazemVetores.from_persist_dir(persist_dir))
+    return load_index_from_storage(storage_context)
+
+
+def novo_indice():
+    return VectorStoreIndex([], storage_context=StorageContext.from_defaults(vector_store=ArmazemVetores()))
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Constrói/atualiza o índice vetorial dos documentos.")
+    parser.add_argument('--docs', default='docs', help="Pasta dos documentos (padrão: docs)")
+    # Fora de storage/, que guarda os arquivos dos usuários
+    parser.add_argument('--persist-dir', default='./indices/docs', help="Pasta do índice persistido (padrão: ./indices/docs)")
+    parser.add_argument('--completo', action='store_true', help="Ignora o manifesto e reconstrói tudo")
+    parser.add_argument('--verificar', action='store_true', help="Só mostra o que mudou, sem indexar")
+    parser.add_argument('--embedder', choices=('ollama', 'local'), default='ollama',
+                        help="'local' usa vetores determinísticos sem modelo (medição de vazão e testes)")
+    parser.add_argument('--modelo-embedding', default='mxbai-embed-large', help="Modelo de embedding do Ollama")
+    parser.add_argument('--lote-embedding', type=int, default=32, help="Trechos enviados por requisição ao embedder")
+    parser.add_argument('--concorrencia', type=int, default=4, help="Requisições simultâneas ao embedder")
+    parser.add_argument('--dimensao', type=int, default=384, help="Dimensão dos vetores do embedder local")
+    args = parser.parse_args()
+
     try:
         print("--- Iniciando build_index.py ---")
-        
-        print("1. Configurando os modelos (Ollama)...")
-        # ATENÇÃO: Confirme que os nomes dos modelos estão corretos
-        Settings.llm = Ollama(model="llama3:8b")
-        Settings.embed_model = OllamaEmbedding(model_name="mxbai-embed-large") # Você mencionou este modelo, confirme
 
-        print("2. Carregando documentos da pasta 'docs/'...")
+        print(f"1. Verificando documentos da pasta '{args.docs}/'...")
         # Garanta que a pasta 'docs' existe e tem arquivos dentro
-        documents = SimpleDirectoryReader("docs").load_data()
-        
-        if not documents:
-            print("\n!!! ERRO: Nenhum documento encontrado na pasta 'docs/'. !!!")
+        arquivos = listar_arquivos(args.docs)
+        if not arquivos:
+            print(f"\n!!! ERRO: Nenhum documento encontrado na pasta '{args.docs}/'. !!!")
             print("Por favor, adicione arquivos (.pdf, .txt, .md) na pasta 'docs' e tente novamente.")
             return
 
-        print(f"-> {len(documents)} documento(s) carregado(s).")
+        embedder = identificar_embedder(args)
+        manifesto = None if args.completo else carregar_manifesto(args.persist_dir)
+        if manifesto and not indice_existe(args.persist_dir):
+            print("-> Manifesto sem índice persistido: reconstruindo tudo.")
+            manifesto = None
+        elif manifesto and manifesto.get('embedder') != embedder:
+            print(f"-> Índice feito com outro embedder ({manifesto.get('embedder')}): reconstruindo tudo.")
+            manifesto = None
+        elif manifesto is None:
+            print("-> Sem manifesto válido: o índice será reconstruído do zero.")
+
+        anteriores = manifesto['arquivos'] if manifesto else {}
+        novos, alterados, removidos, inalterados, estado = planejar(arquivos, anteriores)
+        print(f"-> {len(novos)} novo(s), {len(alterados)} alterado(s), {len(removidos)} removido(s), "
+              f"{len(inalterados)} sem alteração.")
+        for rotulo, nomes in (('+', novos), ('~', alterados), ('-', removidos)):
+            for nome in nomes:
+                print(f"   {rotulo} {nome}")
+
+        if args.verificar:
+            return
+        if manifesto and not (novos or alterados or removidos):
+            print("\n--- Índice já está atualizado. Nada a fazer. ---")
+            return
+
+        print(f"2. Configurando os modelos ({embedder})...")
+        configurar_modelos(args)
+
+        if manifesto:
+            index = carregar_indice(args.persist_dir)
+        else:
+            index = novo_indice()
+
+        print("3. Removendo vetores de documentos alterados ou apagados...")
+        for nome in alterados + removidos:
+            for doc_id in anteriores[nome].get('doc_ids', []):
+                index.delete_ref_doc(doc_id, delete_from_docstore=True)
 
-        print("3. Criando o índice vetorial (isso pode demorar)...")
-        # Esta é a linha que cria o índice em memória
-        index = VectorStoreIndex.from_documents(documents)
+        a_indexar = novos + alterados
+        print(f"4. Indexando {len(a_indexar)} arquivo(s) (isso pode demorar)...")
+        documentos, nodes = [], []
+        for nome in a_indexar:
+            # filename_as_id: ids estáveis (caminho + parte), guardados no manifesto
+            docs_arquivo = SimpleDirectoryReader(input_files=[arquivos[nome]], filename_as_id=True).load_data()
+            nodes_arquivo = run_transformations(docs_arquivo, Settings.transformations, show_progress=True)
+            documentos.extend(docs_arquivo)
+            nodes.extend(nodes_arquivo)
+            estado[nome]['doc_ids'] = [doc.doc_id for doc in docs_arquivo]
+            print(f"-> {nome}: {len(docs_arquivo)} documento(s), {len(nodes_arquivo)} trecho(s)")
 
-        print("4. Salvando o índice em disco na pasta './storage'...")
-        # Esta é a linha que CRIA a pasta e os arquivos (como docstore.json)
-        index.storage_context.persist(persist_dir="./storage")
+        # Os trechos de todos os arquivos compartilham os lotes de embedding
+        duracao = gerar_embeddings(nodes, Settings.embed_model, args.lote_embedding, args.concorrencia)
+        vazao = len(nodes) / duracao if duracao else 0
+        print(f"-> Embeddings: {len(nodes)} trecho(s) em {duracao:.1f}s ({vazao:.1f} trechos/s; "
+              f"lote {args.lote_embedding}, concorrência {args.concorrencia})")
+        index.insert_nodes(nodes)
+        for doc in documentos:
+            index.docstore.set_document_hash(doc.doc_id, doc.hash)
+
+        print(f"5. Salvando o índice em disco na pasta '{args.persist_dir}'...")
+        # Vetores e trechos vão para os arquivos binários do ArmazemVetores; os JSON
+        # do LlamaIndex (docstore.json etc.) ficam só com os hashes e a estrutura do índice
+        index.storage_context.persist(persist_dir=args.persist_dir)
+        salvar_manifesto(args.persist_dir, {'versao': VERSAO_MANIFESTO, 'embedder': embedder, 'arquivos': estado})
 
         print("\n--- Processo Concluído! ---")
-        print("A pasta 'storage/' foi criada com sucesso.")
+        print(f"O índice em '{args.persist_dir}/' está atualizado.")
         print("Agora você pode rodar 'python app.py'")
 
     except Exception as e:
@@ -48,7 +252,7 @@ def main():
         print("1. O Ollama está rodando? (Rode 'ollama list' em outro terminal)")
         print("2. Os modelos 'llama3:8b' e 'mxbai-embed-large' estão baixados? (Rode 'ollama pull mxbai-embed-large')")
         print("3. A pasta 'docs/' existe e contém arquivos?")
-        
+
         # Imprime o traceback completo para debug
         import traceback
         traceback.print_exc()
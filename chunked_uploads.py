@@ -0,0 +1,227 @@
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem trava entre processos (só a deste processo)
+    fcntl = None
+
+# Tamanho dos blocos lidos do corpo da requisição (64 KB)
+TAMANHO_BLOCO = 64 * 1024
+
+# Ids de upload são uuid4 em hexadecimal (evita caminhos arbitrários vindos da URL)
+_UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+class UploadError(Exception):
+    """
+    Erro de protocolo do upload em partes. Carrega o status HTTP sugerido
+    e, quando faz sentido, o offset atual para o cliente retomar.
+    """
+    def __init__(self, mensagem, status=400, offset=None):
+        super().__init__(mensagem)
+        self.status = status
+        self.offset = offset
+
+
+class ChunkedUploads:
+    """
+    Uploads em partes (iniciar / anexar parte / finalizar), retomáveis.
+
+    Cada sessão fica na pasta do projeto, em `.uploads/<id>.json` (metadados) e
+    `.uploads/<id>.part` (bytes recebidos). O offset confirmado é sempre o tamanho do
+    arquivo .part, então uma conexão interrompida é retomada a partir do último byte
+    gravado. O SHA-256 é calculado de forma incremental durante a escrita; se o estado
+    parcial não estiver neste processo (outro worker ou reinício), é refeito a partir do disco.
+
+    Partes simultâneas da mesma sessão (retentativa do cliente, duas abas) são serializadas
+    por uma trava no arquivo de metadados. Sessões sem atividade há mais de `ttl` segundos
+    são removidas ao iniciar um novo upload no projeto.
+    """
+
+    def __init__(self, ttl=24 * 3600):
+        self.ttl = ttl
+        self._hashes = {}   # upload_id -> (offset, sha256 parcial, última atividade)
+        self._lock = threading.Lock()
+        # Sem fcntl, a trava vale só entre as threads deste processo
+        self._lock_escrita = threading.Lock()
+
+    @staticmethod
+    def _caminhos(project_dir, upload_id):
+        pasta = os.path.join(project_dir, '.uploads')
+        return os.path.join(pasta, f'{upload_id}.json'), os.path.join(pasta, f'{upload_id}.part')
+
+    @contextmanager
+    def _travar(self, project_dir, upload_id):
+        """
+        Trava exclusiva da sessão (flock nos metadados) enquanto uma parte é gravada ou o
+        upload é finalizado. Quem estiver esperando deve reler o estado depois de travar.
+        """
+        meta_path, _ = self._caminhos(project_dir, upload_id)
+        try:
+            arquivo = open(meta_path, 'rb')
+        except OSError:
+            raise UploadError('Upload não encontrado', 404)
+        with arquivo:
+            if fcntl is not None:
+                fcntl.flock(arquivo, fcntl.LOCK_EX)
+                yield
+            else:
+                with self._lock_escrita:
+                    yield
+
+    def limpar_expirados(self, project_dir):
+        """
+        Remove as sessões do projeto sem atividade (último byte recebido) há mais de `ttl`
+        segundos e esquece os hashes parciais de sessões paradas em qualquer projeto.
+        """
+        limite = time.time() - self.ttl
+        with self._lock:
+            for upload_id in [u for u, estado in self._hashes.items() if estado[2] < limite]:
+                del self._hashes[upload_id]
+
+        pasta = os.path.join(project_dir, '.uploads')
+        if not os.path.isdir(pasta):
+            return
+        for nome in os.listdir(pasta):
+            upload_id, extensao = os.path.splitext(nome)
+            if extensao != '.json' or not _UPLOAD_ID_RE.match(upload_id):
+                continue
+            meta_path, part_path = self._caminhos(project_dir, upload_id)
+            try:
+                ultima = max(os.path.getmtime(meta_path),
+                             os.path.getmtime(part_path) if os.path.exists(part_path) else 0)
+            except OSError:
+                continue
+            if ultima < limite:
+                self.cancelar(project_dir, upload_id)
+                print(f"--- Upload abandonado removido: {upload_id}")
+
+    def iniciar(self, project_dir, filename, size, content_type, sha256=None):
+        """Cria a sessão de upload e retorna seus metadados (com offset 0)."""
+        self.limpar_expirados(project_dir)
+        upload_id = uuid.uuid4().hex
+        meta_path, part_path = self._caminhos(project_dir, upload_id)
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+
+        meta = {
+            'upload_id': upload_id,
+            'filename': filename,
+            'size': size,
+            'content_type': content_type,
+            'sha256': sha256,
+            'criado_em': time.time(),
+        }
+        open(part_path, 'wb').close()
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+
+        with self._lock:
+            self._hashes[upload_id] = (0, hashlib.sha256(), time.time())
+        return dict(meta, offset=0)
+
+    def estado(self, project_dir, upload_id):
+        """Metadados da sessão com o offset confirmado, ou None se ela não existir."""
+        if not _UPLOAD_ID_RE.match(upload_id or ''):
+            return None
+        meta_path, part_path = self._caminhos(project_dir, upload_id)
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            meta['offset'] = os.path.getsize(part_path)
+        except (OSError, ValueError):
+            return None
+        return meta
+
+    def _hash_ate(self, upload_id, part_path, offset):
+        with self._lock:
+            estado = self._hashes.get(upload_id)
+        if estado and estado[0] == offset:
+            return estado[1]
+
+        # Estado parcial ausente neste processo: refaz o hash do que já está no disco
+        h = hashlib.sha256()
+        with open(part_path, 'rb') as f:
+            for bloco in iter(lambda: f.read(TAMANHO_BLOCO), b''):
+                h.update(bloco)
+        return h
+
+    def anexar(self, project_dir, upload_id, offset, stream):
+        """
+        Grava o corpo `stream` a partir de `offset` e retorna o novo offset confirmado.
+        O offset informado precisa ser exatamente o tamanho já recebido.
+        """
+        with self._travar(project_dir, upload_id):
+            # Relido sob a trava: outra requisição pode ter gravado ou finalizado nesse meio-tempo
+            meta = self.estado(project_dir, upload_id)
+            if meta is None:
+                raise UploadError('Upload não encontrado', 404)
+            if offset != meta['offset']:
+                raise UploadError('Offset divergente do já recebido', 409, meta['offset'])
+            return self._gravar_parte(project_dir, upload_id, meta, stream)
+
+    def _gravar_parte(self, project_dir, upload_id, meta, stream):
+        _, part_path = self._caminhos(project_dir, upload_id)
+        atual = meta['offset']
+        h = self._hash_ate(upload_id, part_path, atual)
+
+        try:
+            # Escrita na posição confirmada (não em modo append)
+            with open(part_path, 'r+b') as f:
+                f.seek(atual)
+                while True:
+                    bloco = stream.read(TAMANHO_BLOCO)
+                    if not bloco:
+                        break
+                    if atual + len(bloco) > meta['size']:
+                        raise UploadError('Parte excede o tamanho declarado do arquivo', 413, atual)
+                    f.write(bloco)
+                    h.update(bloco)
+                    atual += len(bloco)
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            # Mesmo com a conexão interrompida, arquivo e hash parcial ficam consistentes
+            with self._lock:
+                self._hashes[upload_id] = (atual, h, time.time())
+
+        return atual
+
+    def finalizar(self, project_dir, upload_id, destino):
+        """
+        Confere tamanho (e hash, se informado no início), move o arquivo para `destino`
+        e encerra a sessão. Retorna (metadados, sha256).
+        """
+        with self._travar(project_dir, upload_id):
+            meta = self.estado(project_dir, upload_id)
+            if meta is None:
+                raise UploadError('Upload não encontrado', 404)
+            if meta['offset'] != meta['size']:
+                raise UploadError('Upload incompleto', 409, meta['offset'])
+
+            meta_path, part_path = self._caminhos(project_dir, upload_id)
+            digest = self._hash_ate(upload_id, part_path, meta['offset']).hexdigest()
+            if meta.get('sha256') and meta['sha256'].lower() != digest:
+                raise UploadError('Hash do arquivo recebido não confere', 422, meta['offset'])
+
+            os.replace(part_path, destino)
+            os.remove(meta_path)
+        with self._lock:
+            self._hashes.pop(upload_id, None)
+        return meta, digest
+
+    def cancelar(self, project_dir, upload_id):
+        """Descarta uma sessão de upload e os bytes já recebidos."""
+        if not _UPLOAD_ID_RE.match(upload_id or ''):
+            return
+        for path in self._caminhos(project_dir, upload_id):
+            if os.path.exists(path):
+                os.remove(path)
+        with self._lock:
+            self._hashes.pop(upload_id, None)
@@ -1,5 +1,7 @@
 import os
 
+basedir = os.path.abspath(os.path.dirname(__file__))
+
 class Config:
     """
     Classe de configuração para separar segredos do código principal.
@@ -14,3 +16,47 @@ class Config:
     
     # Desativa notificação de modificações para economizar recursos
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Token exigido pelo endpoint /metrics (Authorization: Bearer ...); sem ele o endpoint fica desativado
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+
+    # Cache (por processo) dos usuários carregados a cada requisição: validade em segundos e
+    # arquivo marcador usado para invalidar os caches de todos os processos
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL') or 60)
+    USER_CACHE_MARKER = os.environ.get('USER_CACHE_MARKER') or os.path.join(basedir, 'cache', 'usuarios.marcador')
+
+    # Listagem de projetos da sidebar: itens por página (padrão) e máximo aceito no parâmetro `limit`
+    PROJECT_LIST_PAGE_SIZE = int(os.environ.get('PROJECT_LIST_PAGE_SIZE') or 50)
+    PROJECT_LIST_MAX_PAGE_SIZE = int(os.environ.get('PROJECT_LIST_MAX_PAGE_SIZE') or 200)
+
+    # Onde ficam os textos das fases: 'colunas' (uma coluna por campo em projects) ou
+    # 'tabela' (uma linha por campo em project_fields). Trocar exige `flask migrate-fields`
+    PROJECT_FIELDS_LAYOUT = os.environ.get('PROJECT_FIELDS_LAYOUT') or 'colunas'
+
+    # Uploads em partes sem atividade há mais deste tempo (segundos) são descartados
+    UPLOAD_SESSION_TTL = int(os.environ.get('UPLOAD_SESSION_TTL') or 24 * 3600)
+
+    # Armazenamento deduplicado dos anexos (um arquivo por conteúdo, com contagem de referências)
+    BLOB_STORAGE_DIR = os.environ.get('BLOB_STORAGE_DIR') or os.path.join(basedir, 'storage', 'blobs')
+
+    # Cache em disco dos relatórios PDF gerados (endereçado pelo conteúdo, com limite de tamanho e LRU)
+    REPORT_CACHE_DIR = os.environ.get('REPORT_CACHE_DIR') or os.path.join(basedir, 'cache', 'relatorios')
+    REPORT_CACHE_MAX_BYTES = int(os.environ.get('REPORT_CACHE_MAX_BYTES') or 200 * 1024 * 1024)
+
+    # Imagens anexadas: resolução alvo (DPI) ao enquadrar em A4 e qualidade da recompressão JPEG (0 desativa)
+    REPORT_IMAGE_DPI = int(os.environ.get('REPORT_IMAGE_DPI', 150))
+    REPORT_IMAGE_JPEG_QUALITY = int(os.environ.get('REPORT_IMAGE_JPEG_QUALITY', 80))
+    # Processos (por worker web) que convertem em paralelo as imagens dos relatórios síncronos (0 desativa)
+    REPORT_CONVERSION_WORKERS = int(os.environ.get('REPORT_CONVERSION_WORKERS') or 2)
+
+    # Geração assíncrona de relatórios: pasta dos jobs, processos no pool e validade (segundos) dos PDFs prontos
+    REPORT_JOBS_DIR = os.environ.get('REPORT_JOBS_DIR') or os.path.join(basedir, 'cache', 'jobs')
+    REPORT_JOB_WORKERS = int(os.environ.get('REPORT_JOB_WORKERS') or 2)
+    REPORT_JOB_TTL = int(os.environ.get('REPORT_JOB_TTL') or 3600)
+
+    # Índices vetoriais dos anexos, um por projeto (fora de storage/, que guarda os arquivos dos usuários):
+    # pasta, embedder ('ollama' ou 'local', sem modelo) e quantos índices ficam abertos em memória (LRU)
+    PROJECT_INDEX_DIR = os.environ.get('PROJECT_INDEX_DIR') or os.path.join(basedir, 'indices', 'projetos')
+    PROJECT_INDEX_EMBEDDER = os.environ.get('PROJECT_INDEX_EMBEDDER') or 'ollama'
+    PROJECT_INDEX_EMBED_MODEL = os.environ.get('PROJECT_INDEX_EMBED_MODEL') or 'mxbai-embed-large'
+    PROJECT_INDEX_MAX_LOADED = int(os.environ.get('PROJECT_INDEX_MAX_LOADED') or 16)
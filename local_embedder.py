@@ -0,0 +1,50 @@
+import re
+import math
+import hashlib
+from typing import List
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import Field
+
+_RE_PALAVRA = re.compile(r'\w+', re.UNICODE)
+
+
+def vetor_texto(texto, dimensao):
+    """
+    Vetor determinístico de um texto por "feature hashing": cada palavra (e cada par
+    de palavras vizinhas) soma +1/-1 em uma posição escolhida pelo hash. Textos com
+    palavras em comum ficam próximos; não há modelo, rede nem aleatoriedade.
+    """
+    vetor = [0.0] * dimensao
+    palavras = _RE_PALAVRA.findall(texto.lower())
+    termos = palavras + [f'{a} {b}' for a, b in zip(palavras, palavras[1:])]
+    for termo in termos:
+        h = int.from_bytes(hashlib.blake2b(termo.encode('utf-8'), digest_size=8).digest(), 'little')
+        vetor[h % dimensao] += 1.0 if (h >> 63) else -1.0
+    norma = math.sqrt(sum(v * v for v in vetor))
+    return [v / norma for v in vetor] if norma else vetor
+
+
+class EmbedderLocal(BaseEmbedding):
+    """
+    Embedder offline e determinístico para medir a vazão do indexador e testar o
+    pipeline sem Ollama. A qualidade da busca é só lexical: não use em produção.
+    """
+
+    dimensao: int = Field(default=384, description="Tamanho dos vetores gerados.")
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "EmbedderLocal"
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return vetor_texto(text, self.dimensao)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return [vetor_texto(t, self.dimensao) for t in texts]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return vetor_texto(query, self.dimensao)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return vetor_texto(query, self.dimensao)
@@ -0,0 +1,213 @@
+import time
+import bisect
+import threading
+
+# Limites (segundos) dos histogramas de duração: de 1 ms a 1 min
+BUCKETS_DURACAO = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Limites das contagens de consultas SQL por requisição
+BUCKETS_CONSULTAS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+# Limites (bytes) dos tamanhos de PDF gerados: de 16 KB a 256 MB
+BUCKETS_BYTES = tuple(16 * 1024 * 4 ** i for i in range(8))
+
+
+def _rotulos(nomes, valores, extra=''):
+    partes = [f'{n}="{_escapar(v)}"' for n, v in zip(nomes, valores)]
+    if extra:
+        partes.append(extra)
+    return '{' + ','.join(partes) + '}' if partes else ''
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Contador:
+    """Contador monotônico com rótulos (formato Prometheus `counter`)."""
+
+    tipo = 'counter'
+
+    def __init__(self, nome, ajuda, rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def inc(self, valor=1, *rotulos):
+        with self._lock:
+            self._valores[rotulos] = self._valores.get(rotulos, 0) + valor
+
+    def amostras(self):
+        with self._lock:
+            itens = sorted(self._valores.items())
+        for rotulos, valor in itens:
+            yield f'{self.nome}{_rotulos(self.rotulos, rotulos)} {valor}'
+
+
+class Histograma:
+    """
+    Histograma com rótulos (formato Prometheus `histogram`). Cada observação custa
+    uma busca binária nos limites e três somas sob o lock; os acumulados por
+    faixa só são calculados na leitura do /metrics.
+    """
+
+    tipo = 'histogram'
+
+    def __init__(self, nome, ajuda, rotulos=(), buckets=BUCKETS_DURACAO):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self.buckets = tuple(buckets)
+        self._series = {}   # rótulos -> [contagens por faixa (+Inf no fim), soma, total]
+        self._lock = threading.Lock()
+
+    def observar(self, valor, *rotulos):
+        indice = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(rotulos)
+            if serie is None:
+                serie = self._series[rotulos] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            serie[0][indice] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def amostras(self):
+        with self._lock:
+            itens = sorted((r, (list(s[0]), s[1], s[2])) for r, s in self._series.items())
+        for rotulos, (contagens, soma, total) in itens:
+            acumulado = 0
+            for limite, qtd in zip(self.buckets + ('+Inf',), contagens):
+                acumulado += qtd
+                le = f'le="{limite}"'
+                yield f'{self.nome}_bucket{_rotulos(self.rotulos, rotulos, le)} {acumulado}'
+            yield f'{self.nome}_sum{_rotulos(self.rotulos, rotulos)} {soma}'
+            yield f'{self.nome}_count{_rotulos(self.rotulos, rotulos)} {total}'
+
+
+class Medidor:
+    """Valor lido no momento da coleta (formato Prometheus `gauge`), a partir de uma função."""
+
+    tipo = 'gauge'
+
+    def __init__(self, nome, ajuda, funcao):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.funcao = funcao
+
+    def amostras(self):
+        valor = self.funcao()
+        if valor is not None:
+            yield f'{self.nome} {valor}'
+
+
+class Registro:
+    """Conjunto de métricas do processo, exportado no formato texto do Prometheus."""
+
+    def __init__(self):
+        self._metricas = []
+
+    def adicionar(self, metrica):
+        self._metricas.append(metrica)
+        return metrica
+
+    def contador(self, *args, **kwargs):
+        return self.adicionar(Contador(*args, **kwargs))
+
+    def histograma(self, *args, **kwargs):
+        return self.adicionar(Histograma(*args, **kwargs))
+
+    def medidor(self, *args, **kwargs):
+        return self.adicionar(Medidor(*args, **kwargs))
+
+    def exportar(self):
+        linhas = []
+        for metrica in self._metricas:
+            linhas.append(f'# HELP {metrica.nome} {metrica.ajuda}')
+            linhas.append(f'# TYPE {metrica.nome} {metrica.tipo}')
+            linhas.extend(metrica.amostras())
+        return '\n'.join(linhas) + '\n'
+
+
+# ------------------------------------------------------------------
+# --- MÉTRICAS DA APLICAÇÃO ---
+# ------------------------------------------------------------------
+# Os valores são por processo: com vários workers do gunicorn, cada um expõe os seus.
+
+registro = Registro()
+
+requisicoes = registro.contador(
+    'smart_tpm_http_requests_total', 'Requisições HTTP atendidas.', ('rota', 'metodo', 'status'))
+duracao_requisicao = registro.histograma(
+    'smart_tpm_http_request_duration_seconds', 'Tempo total de atendimento por rota.', ('rota',))
+consultas_requisicao = registro.histograma(
+    'smart_tpm_sql_queries_per_request', 'Consultas SQL executadas por requisição.', ('rota',),
+    buckets=BUCKETS_CONSULTAS)
+tempo_sql_requisicao = registro.histograma(
+    'smart_tpm_sql_duration_seconds_per_request', 'Tempo gasto em SQL por requisição.', ('rota',))
+
+relatorios = registro.contador(
+    'smart_tpm_pdf_reports_total', 'Relatórios PDF gerados.', ('tipo', 'modo'))
+duracao_etapa_pdf = registro.histograma(
+    'smart_tpm_pdf_stage_duration_seconds',
+    'Tempo por etapa do gerar_pdf_com_anexos (render, conversao, juncao, escrita).', ('etapa',))
+bytes_anexos = registro.contador(
+    'smart_tpm_pdf_attachment_bytes_total', 'Bytes de anexos processados na geração de PDFs.')
+bytes_saida = registro.histograma(
+    'smart_tpm_pdf_output_bytes', 'Tamanho dos PDFs gerados.', buckets=BUCKETS_BYTES)
+
+ETAPAS_PDF = ('render', 'conversao', 'juncao', 'escrita')
+
+
+def registrar_pdf(estatisticas, tipo_relatorio, modo):
+    """Registra as estatísticas preenchidas por gerar_pdf_com_anexos(estatisticas=...)."""
+    if not estatisticas:
+        return
+    relatorios.inc(1, tipo_relatorio, modo)
+    for etapa in ETAPAS_PDF:
+        if etapa in estatisticas:
+            duracao_etapa_pdf.observar(estatisticas[etapa], etapa)
+    bytes_anexos.inc(estatisticas.get('bytes_anexos', 0))
+    if 'bytes_saida' in estatisticas:
+        bytes_saida.observar(estatisticas['bytes_saida'])
+
+
+def instalar(app, engine_cls):
+    """
+    Liga a coleta por requisição ao Flask (tempo total, consultas e tempo de SQL por rota)
+    e aos eventos de cursor do SQLAlchemy. O custo no caminho quente são algumas leituras
+    de relógio e somas; nada é formatado até o /metrics ser lido.
+    """
+    from flask import g, request, has_request_context
+    from sqlalchemy import event
+
+    @event.listens_for(engine_cls, 'before_cursor_execute')
+    def _antes_sql(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metricas_inicio', []).append(time.perf_counter())
+
+    @event.listens_for(engine_cls, 'after_cursor_execute')
+    def _depois_sql(conn, cursor, statement, parameters, context, executemany):
+        inicio = conn.info['metricas_inicio'].pop()
+        if has_request_context() and 'metricas_sql' in g:
+            g.metricas_sql[0] += 1
+            g.metricas_sql[1] += time.perf_counter() - inicio
+
+    @event.listens_for(engine_cls, 'handle_error')
+    def _erro_sql(contexto):
+        # Consulta com erro não passa pelo after_cursor_execute: descarta o início anotado
+        if contexto.connection is not None and contexto.connection.info.get('metricas_inicio'):
+            contexto.connection.info['metricas_inicio'].pop()
+
+    @app.before_request
+    def _inicio_requisicao():
+        g.metricas_inicio = time.perf_counter()
+        g.metricas_sql = [0, 0.0]
+
+    @app.after_request
+    def _fim_requisicao(response):
+        if 'metricas_inicio' in g:
+            rota = request.url_rule.rule if request.url_rule else 'nao_encontrada'
+            requisicoes.inc(1, rota, request.method, response.status_code)
+            duracao_requisicao.observar(time.perf_counter() - g.metricas_inicio, rota)
+            consultas_requisicao.observar(g.metricas_sql[0], rota)
+            tempo_sql_requisicao.observar(g.metricas_sql[1], rota)
+        return response
@@ -31,6 +31,10 @@ class Project(db.Model):
     Armazena os dados preenchidos nos formulários de todas as fases.
     """
     __tablename__ = 'projects'
+    # Listagem da sidebar: projetos do usuário do mais recente ao mais antigo (id desempata o cursor)
+    __table_args__ = (
+        db.Index('ix_projects_user_updated', 'user_id', 'updated_at', 'id'),
+    )
 
     id = db.Column(db.BigInteger, primary_key=True)
     user_id = db.Column(db.BigInteger, db.ForeignKey('users.id'), nullable=False)
@@ -40,6 +44,8 @@ class Project(db.Model):
     responsible = db.Column(db.String(100))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Versão da linha (controle de concorrência otimista): +1 a cada gravação
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
 
     # --- FASE 1: Considering the Business ---
     context_desc = db.Column(db.Text)     # Contextualização (NOVO)
@@ -66,11 +72,31 @@ class Project(db.Model):
 
     # Relacionamentos
     attachments = db.relationship('Attachment', backref='project', lazy=True, cascade="all, delete-orphan")
+    # Textos das fases no layout em tabela (PROJECT_FIELDS_LAYOUT='tabela')
+    fields = db.relationship('ProjectField', lazy=True, cascade="all, delete-orphan")
 
     def __repr__(self):
         return f'<Project {self.name}>'
 
 
+class ProjectField(db.Model):
+    """
+    Tabela de Textos das fases (layout em tabela, opcional).
+    Uma linha estreita por campo preenchido, em vez das colunas Text de Project:
+    editar um nível ou ler uma fase toca apenas as linhas envolvidas.
+    Ver `flask migrate-fields` para mover os dados entre os layouts.
+    """
+    __tablename__ = 'project_fields'
+
+    project_id = db.Column(db.BigInteger, db.ForeignKey('projects.id'), primary_key=True)
+    phase = db.Column(db.SmallInteger, primary_key=True)    # 1, 2 ou 3
+    level = db.Column(db.String(30), primary_key=True)      # Fase 1: context, business_desc...; Fases 2 e 3: l1..l6
+    value = db.Column(db.Text)
+
+    def __repr__(self):
+        return f'<ProjectField {self.project_id} fase{self.phase} {self.level}>'
+
+
 class Attachment(db.Model):
     """
     Tabela de Anexos.
@@ -85,8 +111,34 @@ class Attachment(db.Model):
     filepath = db.Column(db.String(500), nullable=False)
     filetype = db.Column(db.String(50), nullable=False)
     file_size = db.Column(db.Integer)
+    # Versão em PDF (página pronta para o relatório) gerada no upload de imagens
+    pages_path = db.Column(db.String(500))
+    # Conteúdo no armazenamento deduplicado (filepath aponta para o blob).
+    # Anexos antigos, ainda na pasta do projeto, ficam sem blob até rodar `flask migrate-blobs`.
+    blob_sha256 = db.Column(db.String(64), db.ForeignKey('blobs.sha256'), index=True)
     
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def __repr__(self):
         return f'<Attachment {self.filename}>'
+
+
+class Blob(db.Model):
+    """
+    Tabela de Conteúdos dos anexos.
+    Cada arquivo é guardado uma única vez (endereçado pelo SHA-256) e compartilhado
+    entre os anexos de qualquer projeto. O arquivo só é apagado quando a última
+    referência é removida.
+    """
+    __tablename__ = 'blobs'
+
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    attachments = db.relationship('Attachment', backref='blob', lazy=True)
+
+    def __repr__(self):
+        return f'<Blob {self.sha256[:12]} refs={self.ref_count}>'
@@ -1,10 +1,19 @@
 import io
 import re
+import html
 import os
+import shutil
+import tempfile
+import time
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import nullcontext
+from functools import lru_cache
 from fpdf import FPDF
 from fpdf.enums import XPos, YPos
-import markdown2
-from bs4 import BeautifulSoup
 from pypdf import PdfWriter, PdfReader
 from PIL import Image
 
@@ -36,11 +45,23 @@ class PDF(FPDF):
         self.line(self.l_margin, self.get_y(), self.w - self.r_margin, self.get_y())
         self.ln(5)
 
+    def add_phase_title(self, title, subtitle, color):
+        """Abertura de uma fase no relatório completo (sempre em página nova)."""
+        r, g, b = color
+        self.set_text_color(r, g, b)
+        self.set_font('Helvetica', 'B', 18)
+        self.cell(0, 12, title, new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='L')
+        if subtitle:
+            self.set_text_color(0, 0, 0)
+            self.set_font('Helvetica', 'I', 10)
+            self.cell(0, 8, subtitle, new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='L')
+        self.ln(6)
+
     def add_markdown_body(self, markdown_text, color):
         r, g, b = color
-        # Converte Markdown para HTML para processar tags básicas
-        html = markdown2.markdown(markdown_text, extras=["cuddled-lists"])
-        soup = BeautifulSoup(html, "html.parser")
+        # Layout já analisado (títulos, parágrafos e listas aninhadas com trechos em negrito/itálico),
+        # memorizado por texto: exportações repetidas não passam de novo pelo tokenizador
+        layout = analisar_markdown(markdown_text)
         
         original_l_margin = self.l_margin
         content_width = self.w - self.l_margin - self.r_margin - 10
@@ -57,7 +78,7 @@ class PDF(FPDF):
         self.set_draw_color(r, g, b)
         self.set_line_width(0.3)
 
-        def render_formatted_line(line_text, is_list_item=False, indent=0):
+        def render_formatted_line(spans, is_list_item=False, indent=0):
             self.set_text_color(0, 0, 0)
             if is_list_item:
                 bullet_x = self.get_x() + (indent * 5)
@@ -70,54 +91,39 @@ class PDF(FPDF):
             else:
                 self.set_x(self.get_x() + (indent * 5))
             
-            # Tratamento simples de negrito e itálico (regex básico)
-            line_text = line_text.replace("\n", " ").strip()
-            line_text = re.sub(r"\*\*(.*?)\*\*", r"<b>\1</b>", line_text)
-            line_text = re.sub(r"_(.*?)_", r"<i>\1</i>", line_text)
-            
-            # Simulação de write_html (ou uso direto se FPDF suportar na versão instalada)
-            # Aqui usamos uma lógica manual para garantir compatibilidade básica
-            parts = re.split(r"(<b>|</b>|<i>|</i>)", line_text)
-            style = ""
-            for part in parts:
-                if part == "<b>": style = "B"
-                elif part == "</b>": style = ""
-                elif part == "<i>": style = "I"
-                elif part == "</i>": style = ""
-                elif part:
-                    self.set_font("Helvetica", style, 10)
-                    self.write(6, part)
+            for style, part in spans:
+                self.set_font("Helvetica", style, 10)
+                self.write(6, part)
             self.ln(6)
 
-        for elem in soup.children:
-            if elem.name is None: continue
-            text = elem.get_text(" ", strip=True)
-            if not text: continue
-            
-            if elem.name == "h1":
-                self.set_font("Helvetica", "B", 12)
-                self.set_text_color(r, g, b)
-                self.multi_cell(content_width, 8, text)
-                self.ln(2)
-            elif elem.name == "h2":
-                self.set_font("Helvetica", "B", 11)
+        # Fonte e altura de linha de cada nível de título
+        estilos_titulo = {1: (12, 8), 2: (11, 7), 3: (10, 7)}
+
+        for bloco in layout:
+            tipo = bloco[0]
+            if tipo == "titulo":
+                _, nivel, text = bloco
+                tamanho, altura = estilos_titulo[nivel]
+                self.set_font("Helvetica", "B", tamanho)
                 self.set_text_color(r, g, b)
-                self.multi_cell(content_width, 7, text)
+                self.multi_cell(content_width, altura, text)
                 self.ln(2)
-            elif elem.name == "h3":
-                self.set_font("Helvetica", "B", 10)
-                self.set_text_color(r, g, b)
-                self.multi_cell(content_width, 7, text)
+            elif tipo == "paragrafo":
+                render_formatted_line(bloco[1], is_list_item=False)
                 self.ln(2)
-            elif elem.name == "p":
-                render_formatted_line(elem.get_text(" ", strip=True), is_list_item=False)
+            elif tipo == "lista":
+                for nivel, item_spans in bloco[1]:
+                    render_formatted_line(item_spans, is_list_item=True, indent=nivel)
                 self.ln(2)
-            elif elem.name in ["ul", "ol"]:
-                list_items = elem.find_all("li")
-                if not list_items: continue
-                for item in list_items:
-                    item_text = item.get_text(" ", strip=True)
-                    render_formatted_line(item_text, is_list_item=True)
+            elif tipo == "regua":
+                self.set_draw_color(r, g, b)
+                self.line(self.l_margin, self.get_y() + 2, self.l_margin + content_width, self.get_y() + 2)
+                self.ln(6)
+            elif tipo == "codigo":
+                self.set_font("Courier", "", 9)
+                self.set_text_color(0, 0, 0)
+                for linha_codigo in bloco[1]:
+                    self.multi_cell(content_width, 5, linha_codigo or " ", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
                 self.ln(2)
 
         y_after = self.get_y()
@@ -130,6 +136,406 @@ class PDF(FPDF):
         self.set_y(y_after + 5)
         self.set_text_color(0, 0, 0)
 
+# Quantidade de textos com layout memorizado (LRU)
+MARKDOWN_CACHE_SIZE = 512
+
+# Delimitadores de ênfase, do mais longo para o mais curto
+_DELIMITADORES = ('***', '___', '**', '__', '*', '_')
+_DELIM_NEGRITO = ('***', '___', '**', '__')
+_DELIM_ITALICO = ('***', '___', '*', '_')
+
+_RE_TITULO = re.compile(r'^ {0,3}(#{1,6})\s+(.*?)(?:\s+#+)?\s*$')
+_RE_ITEM = re.compile(r'^(\s*)(?:[-*+]|\d+[.)])\s+(.*)$')
+# Linha horizontal (---, ***, ___, com ou sem espaços) e sublinhado de título (=== ou ---)
+_RE_REGUA = re.compile(r'^ {0,3}([-*_])(?:\s*\1){2,}\s*$')
+_RE_SUBLINHADO = re.compile(r'^ {0,3}(=+|-+)\s*$')
+
+# Trechos trocados antes da ênfase, em uma passada: `código` fica como está, links e
+# imagens viram o texto/descrição, <autolinks> viram o endereço e tags HTML somem
+_RE_INLINE = re.compile(
+    r'(?P<codigo>`[^`]+`)'
+    r'|!?\[(?P<texto>[^\[\]]*)\]\([^()\s]*(?:\s+"[^"]*")?\)'
+    r'|<(?P<url>(?:https?|ftp)://[^\s<>]+|mailto:[^\s<>]+|[^\s<>@]+@[^\s<>@]+\.[^\s<>@]+)>'
+    r'|(?P<tag></?[A-Za-z][A-Za-z0-9-]*(?:\s[^<>]*)?/?>)')
+
+def _substituir_inline(m):
+    if m.group('codigo'):
+        return m.group('codigo')
+    if m.group('texto') is not None:
+        return m.group('texto')
+    if m.group('url'):
+        return m.group('url')
+    # <br> separa palavras; as demais tags só são removidas
+    return ' ' if m.group('tag').lower().startswith('<br') else ''
+
+def _delimitador_em(texto, i):
+    return next(d for d in _DELIMITADORES if texto.startswith(d, i))
+
+def _ultimos_fechamentos(texto):
+    """
+    Posição do último fechamento válido de cada delimitador (-1 se não houver), calculada
+    uma vez por texto: um delimitador abre ênfase só se houver fechamento depois dele.
+    """
+    ultimos = {}
+    for delim in _DELIMITADORES:
+        pos = texto.rfind(delim)
+        while pos != -1:
+            fim = pos + len(delim)
+            antes = texto[pos - 1] if pos > 0 else ' '
+            depois = texto[fim] if fim < len(texto) else ' '
+            if not antes.isspace() and not (delim[0] == '_' and depois.isalnum()):
+                break
+            pos = texto.rfind(delim, 0, pos + len(delim) - 1) if pos else -1
+        ultimos[delim] = pos
+    return ultimos
+
+def _spans_inline(texto):
+    """
+    Tokeniza a formatação inline em uma única passada (tempo linear no tamanho do texto),
+    devolvendo trechos (estilo, texto) com estilo "", "B", "I" ou "BI". Suporta
+    **negrito**/__negrito__, *itálico*/_itálico_, ***ambos***, ênfases aninhadas,
+    `código` (texto literal), escapes com barra invertida, [links](url) (fica o texto),
+    <autolinks>, tags HTML (removidas) e entidades (&amp; etc.).
+    Delimitadores sem fechamento, cercados por espaços ou no meio de palavras (snake_case)
+    ficam como texto.
+    """
+    texto = _RE_INLINE.sub(_substituir_inline, texto)
+    fechamentos = _ultimos_fechamentos(texto)
+    spans = []
+    atual = []
+    abertos = []
+    contagem = dict.fromkeys(_DELIMITADORES, 0)   # ênfases abertas por delimitador
+    i = 0
+    n = len(texto)
+
+    def fechar_trecho():
+        if not atual:
+            return
+        estilo = ('B' if any(contagem[d] for d in _DELIM_NEGRITO) else '') + \
+                 ('I' if any(contagem[d] for d in _DELIM_ITALICO) else '')
+        trecho = html.unescape(''.join(atual))
+        atual.clear()
+        if spans and spans[-1][0] == estilo:
+            spans[-1] = (estilo, spans[-1][1] + trecho)
+        else:
+            spans.append((estilo, trecho))
+
+    while i < n:
+        ch = texto[i]
+        if ch == '\\' and i + 1 < n and texto[i + 1] in '\\`*_#-+.![]<>&':
+            atual.append(texto[i + 1])
+            i += 2
+        elif ch == '`' and texto.find('`', i + 1) > i + 1:
+            fim = texto.find('`', i + 1)
+            atual.append(texto[i + 1:fim])
+            i = fim + 1
+        elif ch in '*_':
+            delim = _delimitador_em(texto, i)
+            fim = i + len(delim)
+            antes = texto[i - 1] if i > 0 else ' '
+            depois = texto[fim] if fim < n else ' '
+            if contagem[delim] and not antes.isspace() and not (ch == '_' and depois.isalnum()):
+                # Fecha a ênfase (e as que foram abertas depois dela e ficaram sem par)
+                fechar_trecho()
+                while True:
+                    aberto = abertos.pop()
+                    contagem[aberto] -= 1
+                    if aberto == delim:
+                        break
+            elif not depois.isspace() and not (ch == '_' and antes.isalnum()) and fechamentos[delim] >= fim:
+                fechar_trecho()
+                abertos.append(delim)
+                contagem[delim] += 1
+            else:
+                atual.append(delim)
+            i = fim
+        else:
+            atual.append(ch)
+            i += 1
+
+    fechar_trecho()
+    return tuple(spans)
+
+@lru_cache(maxsize=MARKDOWN_CACHE_SIZE)
+def analisar_markdown(markdown_text):
+    """
+    Converte o Markdown do usuário, em uma única passada por linha, em uma representação
+    intermediária compacta e imutável usada diretamente pelo desenho do PDF:
+      ("titulo", nivel, texto)                 -> níveis 1 a 3 (h4-h6 usam o estilo do 3);
+                                                  também títulos sublinhados com === / ---
+      ("paragrafo", spans)
+      ("lista", ((nivel, spans), ...))         -> nivel = profundidade do item (0 = raiz)
+      ("regua",)                               -> linha horizontal (---, ***, ___)
+      ("codigo", (linha, ...))                 -> bloco recuado com 4 espaços, sem formatação
+    onde spans é uma tupla de (estilo, texto), com estilo "", "B", "I" ou "BI".
+    Blocos cercados por ``` e tabelas não são reconhecidos (viram texto comum).
+    O resultado é memorizado (LRU) pelo próprio texto.
+    """
+    layout = []
+    paragrafo = []
+    itens = []     # [nivel, [linhas]] da lista atual
+    recuos = []    # recuo (em espaços) de cada nível de lista aberto
+    codigo = []    # linhas do bloco de código atual
+    linha_em_branco = False
+
+    def fechar_paragrafo():
+        if paragrafo:
+            spans = _spans_inline(" ".join(paragrafo))
+            if spans:
+                layout.append(("paragrafo", spans))
+            paragrafo.clear()
+
+    def fechar_lista():
+        if itens:
+            layout.append(("lista", tuple((nivel, _spans_inline(" ".join(linhas))) for nivel, linhas in itens)))
+            itens.clear()
+            recuos.clear()
+
+    def fechar_codigo():
+        while codigo and not codigo[-1].strip():
+            codigo.pop()
+        if codigo:
+            layout.append(("codigo", tuple(codigo)))
+            codigo.clear()
+
+    for linha in markdown_text.expandtabs(4).splitlines():
+        conteudo = linha.strip()
+
+        # Bloco de código: linhas recuadas com 4 espaços fora de parágrafos e listas
+        # (linhas em branco no meio continuam o bloco)
+        if codigo and (not conteudo or linha.startswith('    ')):
+            codigo.append(linha[4:])
+            continue
+        fechar_codigo()
+        if conteudo and linha.startswith('    ') and not paragrafo and not itens:
+            codigo.append(linha[4:])
+            continue
+
+        if not conteudo:
+            fechar_paragrafo()
+            linha_em_branco = True
+            continue
+
+        m_sublinhado = _RE_SUBLINHADO.match(linha)
+        if m_sublinhado and paragrafo:
+            # Título no estilo "setext": o parágrafo acima sublinhado com === (nível 1) ou --- (nível 2)
+            texto = "".join(t for _, t in _spans_inline(" ".join(paragrafo))).strip()
+            paragrafo.clear()
+            if texto:
+                layout.append(("titulo", 1 if m_sublinhado.group(1)[0] == '=' else 2, texto))
+            linha_em_branco = False
+            continue
+
+        m_titulo = _RE_TITULO.match(linha)
+        m_item = None if _RE_REGUA.match(linha) else _RE_ITEM.match(linha)
+
+        if m_titulo:
+            fechar_paragrafo()
+            fechar_lista()
+            texto = "".join(t for _, t in _spans_inline(m_titulo.group(2))).strip()
+            if texto:
+                layout.append(("titulo", min(len(m_titulo.group(1)), 3), texto))
+        elif m_item is None and _RE_REGUA.match(linha):
+            fechar_paragrafo()
+            fechar_lista()
+            layout.append(("regua",))
+        elif m_item:
+            # Listas podem começar logo após um parágrafo (sem linha em branco)
+            fechar_paragrafo()
+            recuo = len(m_item.group(1))
+            while recuos and recuo < recuos[-1]:
+                recuos.pop()
+            if not recuos or recuo > recuos[-1]:
+                recuos.append(recuo)
+            itens.append([len(recuos) - 1, [m_item.group(2).strip()]])
+        elif itens and (not linha_em_branco or linha[0] == ' '):
+            # Continuação do item anterior (linha seguinte ou bloco recuado)
+            itens[-1][1].append(conteudo)
+        else:
+            fechar_lista()
+            paragrafo.append(conteudo.lstrip('> ') if conteudo.startswith('>') else conteudo)
+
+        linha_em_branco = False
+
+    fechar_codigo()
+    fechar_paragrafo()
+    fechar_lista()
+    return tuple(layout)
+
+# Títulos do documento por tipo de relatório
+TITULOS_DOCUMENTO = {
+    'fase1': 'Relatório de Negócio - Fase 1 TpM',
+    'fase2': 'Relatório de Requisitos - Fase 2 TpM',
+    'fase3': 'Relatório de Implementação - Fase 3 TpM',
+    'completo': 'Relatório Completo - Ciclo de Vida TpM',
+}
+
+# Partes do relatório completo, na ordem do ciclo de vida
+FASES_COMPLETO = [
+    ('fase1', 'Fase 1 - Negócio'),
+    ('fase2', 'Fase 2 - Requisitos'),
+    ('fase3', 'Fase 3 - Implementação'),
+]
+
+# Subtítulo com a abordagem de cada fase (a Fase 1 não possui)
+SUBTITULOS_FASE = {
+    'fase2': 'Abordagem Top-Down: Do Usuário para a Coisa',
+    'fase3': 'Abordagem Bottom-Up: Do Hardware para a Interface',
+}
+
+# Campos do formulário (nome enviado pelo frontend) e título da seção no PDF
+CAMPOS_RELATORIO = {
+    # Fase 1: Negócio
+    'fase1': [
+        ('contexto', 'Contextualização'),
+        ('negocio', 'Negócio (Business)'),
+        ('regras', 'Regras de Negócio'),
+        ('especialista', 'Especialista'),
+        ('coisas', 'Coisas (Things)'),
+    ],
+    # Fase 2: Requisitos (Top-Down)
+    'fase2': [
+        ('l6_display', 'Nível 6 - Display (Visualização)'),
+        ('l5_abstraction', 'Nível 5 - Abstraction (Abstração)'),
+        ('l4_storage', 'Nível 4 - Storage (Armazenamento)'),
+        ('l3_border', 'Nível 3 - Border (Borda)'),
+        ('l2_connectivity', 'Nível 2 - Connectivity (Conectividade)'),
+        ('l1_sensor', 'Nível 1 - Sensor/Actuator (Sensores)'),
+    ],
+    # Fase 3: Implementação (Bottom-Up)
+    'fase3': [
+        ('impl_l1', 'Nível 1 - Sensor/Actuator (Hardware)'),
+        ('impl_l2', 'Nível 2 - Connectivity (Protocolos)'),
+        ('impl_l3', 'Nível 3 - Border (Gateway/Edge)'),
+        ('impl_l4', 'Nível 4 - Storage (Banco de Dados)'),
+        ('impl_l5', 'Nível 5 - Abstraction (Algoritmos)'),
+        ('impl_l6', 'Nível 6 - Display (Frontend/App)'),
+    ],
+}
+# O relatório completo usa os campos das três fases
+CAMPOS_RELATORIO['completo'] = [campo for fase, _ in FASES_COMPLETO for campo in CAMPOS_RELATORIO[fase]]
+
+def campos_do_relatorio(tipo_relatorio):
+    """
+    Lista os nomes de campos do formulário que influenciam o PDF de um tipo de relatório
+    (cabeçalho do projeto + campos da fase).
+    """
+    return ['nome_projeto', 'responsavel'] + [c for c, _ in CAMPOS_RELATORIO.get(tipo_relatorio, [])]
+
+# Extensões de anexos tratadas como imagem
+EXTENSOES_IMAGEM = ('.jpg', '.jpeg', '.png')
+
+# Página A4 (retrato) em polegadas, usada para enquadrar as imagens anexadas
+A4_POLEGADAS = (8.27, 11.69)
+
+def caminho_paginas_imagem(origem, dpi=0, qualidade=0):
+    """
+    Caminho da versão em PDF de uma imagem para um conjunto de configurações,
+    gravada ao lado do original (ex.: foto.jpg -> foto.jpg.150dpi-q80.pdf).
+    """
+    return f"{origem}.{dpi}dpi-q{qualidade}.pdf"
+
+def converter_imagem_para_pdf(origem, destino, dpi=0, qualidade=0):
+    """
+    Converte uma imagem (caminho ou stream) em um PDF de página única, pronto para ser anexado.
+    Usado no upload (versão pré-convertida gravada ao lado do original) e, como fallback,
+    na geração do relatório para imagens ainda não convertidas.
+
+    Com `dpi`, a imagem é reduzida (nunca ampliada) para caber em uma página A4 nessa
+    resolução, em retrato ou paisagem conforme a orientação da foto, e a página gerada
+    fica com o tamanho de A4. `qualidade` define a recompressão JPEG (0 = padrão do Pillow).
+    """
+    with Image.open(origem) as img:
+        if img.mode != 'RGB': img = img.convert('RGB')
+        opcoes = {}
+
+        if dpi:
+            larg_pol, alt_pol = A4_POLEGADAS
+            if img.width > img.height:
+                larg_pol, alt_pol = alt_pol, larg_pol
+            img.thumbnail((int(larg_pol * dpi), int(alt_pol * dpi)), Image.LANCZOS)
+            # Resolução efetiva que faz a imagem ocupar a página A4
+            opcoes['resolution'] = max(img.width / larg_pol, img.height / alt_pol)
+
+        if qualidade:
+            opcoes['quality'] = qualidade
+
+        img.save(destino, format='PDF', **opcoes)
+
+def abrir_anexo(anexo):
+    """
+    Abre o conteúdo de um anexo somente no momento do uso.
+    Anexos em disco ('paginas' pré-convertidas ou 'caminho' do original) são lidos direto
+    do arquivo pelo PdfReader/PIL, sem cópia para a memória, e fechados ao sair do bloco.
+    Uploads chegam como 'stream' já aberto e são repassados como estão.
+    """
+    if anexo.get('paginas'):
+        return open(anexo['paginas'], 'rb')
+    if anexo.get('caminho'):
+        return open(anexo['caminho'], 'rb')
+    return nullcontext(anexo['stream'])
+
+def precisa_conversao(anexo):
+    """Imagem que ainda não tem versão em PDF pré-convertida (será convertida na geração)."""
+    return not anexo.get('paginas') and anexo['filename'].lower().endswith(EXTENSOES_IMAGEM)
+
+def _converter_em_processo(origem, dpi, qualidade):
+    """
+    Executada no pool de conversão: recebe o caminho da imagem e devolve o PDF de página
+    única em bytes, já que streams não atravessam processos.
+    """
+    saida = io.BytesIO()
+    converter_imagem_para_pdf(origem, saida, dpi=dpi, qualidade=qualidade)
+    return saida.getvalue()
+
+class AnexosComErro(Exception):
+    """Anexos que não entraram no relatório (ver `estatisticas['anexos_com_erro']`)."""
+
+    def __init__(self, nomes):
+        super().__init__(f"Falha ao anexar: {', '.join(nomes)}")
+        self.nomes = nomes
+
+class PoolConversao:
+    """
+    Pool de processos para a conversão de imagens em PDF (decodificação e recompressão
+    pelo Pillow, que prendem a CPU), criado sob demanda. Com `max_workers` < 1 não há
+    pool e gerar_pdf_com_anexos converte tudo no próprio processo.
+    Se um processo do pool morre (ex.: OOM killer em uma imagem enorme), o executor fica
+    inutilizável; `submeter` o descarta e cria outro.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def executor(self):
+        if self.max_workers < 1:
+            return None
+        # 'spawn' evita herdar conexões e threads do processo do Flask
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def descartar(self, executor):
+        """Tira do uso um executor quebrado (o próximo `executor()` cria um novo)."""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def submeter(self, funcao, *args):
+        """Envia uma tarefa ao pool, recriando-o uma vez se ele estiver quebrado."""
+        executor = self.executor()
+        try:
+            return executor.submit(funcao, *args)
+        except BrokenProcessPool:
+            print("!!! Pool de conversão quebrado (processo encerrado); criando outro")
+            self.descartar(executor)
+            return self.executor().submit(funcao, *args)
+
 def formatar_texto_usuario(texto_bruto):
     if not texto_bruto: return "Nenhum dado fornecido."
     # Garante espaçamento em Markdown
@@ -138,21 +544,140 @@ def formatar_texto_usuario(texto_bruto):
     texto = re.sub(r'(?<!\n)\n(##)', r'\n\n\1', texto)
     return texto
 
-def gerar_pdf_com_anexos(data, lista_anexos, tipo_relatorio='fase1'):
+def tamanho_stream(stream):
+    """Tamanho em bytes de um arquivo aberto ou stream com seek, sem ler o conteúdo."""
+    try:
+        return os.fstat(stream.fileno()).st_size
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        posicao = stream.tell()
+        tamanho = stream.seek(0, io.SEEK_END)
+        stream.seek(posicao)
+        return tamanho
+
+def _desenhar_sumario(secoes):
+    """
+    Função de desenho do sumário para o insert_toc_placeholder do FPDF. É chamada no
+    pdf.output(), quando as páginas de todas as seções já são conhecidas; as seções
+    recebidas são guardadas em `secoes` para montar depois os marcadores do PDF final.
+    """
+    def desenhar(pdf, outline):
+        secoes.extend((s.name, s.level, s.page_number) for s in outline)
+        pdf.set_text_color(0, 0, 0)
+        pdf.set_font('Helvetica', 'B', 14)
+        pdf.cell(0, 10, 'Sumário', new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='L')
+        pdf.ln(4)
+        for s in outline:
+            recuo = 8 * s.level
+            pdf.set_font('Helvetica', 'B' if s.level == 0 else '', 11 if s.level == 0 else 10)
+            link = pdf.add_link(page=s.page_number)
+            pdf.set_x(pdf.l_margin + recuo)
+            pdf.cell(pdf.epw - recuo - 15, 7, s.name, new_x=XPos.RIGHT, new_y=YPos.TOP, align='L', link=link)
+            pdf.cell(15, 7, str(s.page_number), new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='R', link=link)
+    return desenhar
+
+def _renderizar_completo(pdf, data, lista_anexos, cor_destaque, secoes):
+    """
+    Corpo do relatório completo no mesmo documento FPDF: sumário, as três fases (cada uma
+    em página nova, com uma seção por campo) e, havendo anexos, a página que os lista.
+    """
+    # O sumário ocupa o resto da primeira página, abaixo do cabeçalho do projeto (cabe:
+    # são no máximo 3 fases + 17 campos + anexos); o placeholder já inicia a página seguinte
+    pdf.insert_toc_placeholder(_desenhar_sumario(secoes), pages=1)
+
+    for i, (fase, titulo) in enumerate(FASES_COMPLETO):
+        if i:
+            pdf.add_page()
+        pdf.start_section(titulo, level=0)
+        pdf.add_phase_title(titulo, SUBTITULOS_FASE.get(fase), cor_destaque)
+        for c, t in CAMPOS_RELATORIO[fase]:
+            pdf.start_section(t, level=1)
+            pdf.add_section_title(t, cor_destaque)
+            pdf.add_markdown_body(formatar_texto_usuario(data.get(c)), cor_destaque)
+
+    if lista_anexos:
+        pdf.add_page()
+        pdf.start_section('Anexos', level=0)
+        pdf.add_phase_title('Anexos', 'Arquivos incluídos a seguir, nesta ordem', cor_destaque)
+        pdf.set_text_color(0, 0, 0)
+        pdf.set_font('Helvetica', '', 10)
+        for i, anexo in enumerate(lista_anexos, 1):
+            pdf.cell(0, 7, f"{i}. {anexo['filename']}", new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='L')
+
+def _adicionar_marcadores(pdf_writer, secoes, anexos_paginas):
+    """
+    Marcadores (outline) do relatório completo: fases e campos, como no sumário, e um
+    marcador por anexo dentro de 'Anexos', apontando para a primeira página de cada arquivo.
+    """
+    pais = {}
+    for nome, nivel, pagina in secoes:
+        item = pdf_writer.add_outline_item(nome, pagina - 1, parent=pais.get(nivel - 1))
+        pais[nivel] = item
+        if nivel == 0 and nome == 'Anexos':
+            for filename, indice in anexos_paginas:
+                pdf_writer.add_outline_item(filename, indice, parent=item)
+
+def _remover_temporario(caminho):
+    try:
+        os.remove(caminho)
+    except OSError:
+        pass
+
+def _submeter_conversao(pool_conversao, anexo, dpi, qualidade):
+    """
+    Envia a conversão de uma imagem ao pool. Falhas já na leitura/envio viram um Future
+    com a exceção, para serem tratadas na vez do anexo, como as falhas da conversão.
+    Uploads (stream sem caminho) são copiados em blocos para um temporário, apagado ao fim
+    da conversão: o processo do pool só recebe o caminho, sem o arquivo inteiro em memória.
+    """
+    temporario = None
+    try:
+        caminho = anexo.get('caminho')
+        if not caminho:
+            with tempfile.NamedTemporaryFile(suffix=os.path.splitext(anexo['filename'])[1], delete=False) as f:
+                temporario = caminho = f.name
+                anexo['stream'].seek(0)
+                shutil.copyfileobj(anexo['stream'], f)
+        futuro = pool_conversao.submeter(_converter_em_processo, caminho, dpi, qualidade)
+        if temporario:
+            futuro.add_done_callback(lambda _: _remover_temporario(temporario))
+        return futuro
+    except Exception as e:
+        if temporario:
+            _remover_temporario(temporario)
+        futuro = Future()
+        futuro.set_exception(e)
+        return futuro
+
+def gerar_pdf_com_anexos(data, lista_anexos, tipo_relatorio='fase1', destino=None, dpi_imagens=0, qualidade_jpeg=0,
+                         estatisticas=None, pool_conversao=None):
+    """
+    Gera o relatório da fase e anexa os arquivos da lista.
+    Se `destino` (arquivo aberto em modo binário) for informado, o PDF final é escrito
+    diretamente nele, sem cópia intermediária em memória; caso contrário, retorna um BytesIO.
+    `dpi_imagens` e `qualidade_jpeg` valem para imagens que ainda não vieram pré-convertidas.
+    Se `estatisticas` (dict) for informado, recebe o tempo em segundos de cada etapa
+    (render, conversao, juncao, escrita) e os bytes de anexos lidos e do PDF final.
+    Anexos que falham são pulados e listados em `anexos_com_erro`; quem guarda o PDF
+    (cache, jobs) não deve publicar um relatório incompleto (ver AnexosComErro).
+
+    Com um `pool_conversao` (PoolConversao), as imagens a converter são enviadas ao pool
+    à frente da junção, no máximo 2 por processo de cada vez, e as páginas são anexadas
+    na ordem original da lista; a etapa 'conversao' passa a medir a espera pelos resultados.
+
+    `tipo_relatorio='completo'` gera as três fases em um único documento (um só FPDF e uma
+    só junção), com sumário, marcadores de navegação e os anexos ao final.
+    """
     print(f">>> PDF Generator: Iniciando para {tipo_relatorio}...")
+    est = estatisticas if estatisticas is not None else {}
+    est.update(render=0.0, conversao=0.0, juncao=0.0, escrita=0.0, bytes_anexos=0, bytes_saida=0,
+               anexos_com_erro=[])
+    inicio = time.perf_counter()
     cor_destaque = (41, 128, 185)
     
     pdf = PDF()
     
     # 1. Configura Título do Documento com base na Fase
-    if tipo_relatorio == 'fase1':
-        pdf.doc_title = 'Relatório de Negócio - Fase 1 TpM'
-    elif tipo_relatorio == 'fase2':
-        pdf.doc_title = 'Relatório de Requisitos - Fase 2 TpM'
-    elif tipo_relatorio == 'fase3':
-        pdf.doc_title = 'Relatório de Implementação - Fase 3 TpM'
-    else:
-        pdf.doc_title = 'Relatório Smart TpM'
+    pdf.doc_title = TITULOS_DOCUMENTO.get(tipo_relatorio, 'Relatório Smart TpM')
 
     pdf.add_page()
 
@@ -174,87 +699,115 @@ def gerar_pdf_com_anexos(data, lista_anexos, tipo_relatorio='fase1'):
     pdf.line(pdf.l_margin, pdf.get_y(), pdf.w - pdf.r_margin, pdf.get_y())
     pdf.ln(8)
 
-    # 3. Definição dos Campos por Fase
-    campos = []
-    titulos = []
+    completo = tipo_relatorio == 'completo'
+    secoes_sumario = []     # (nome, nível, página) preenchido no pdf.output() do relatório completo
+    anexos_paginas = []     # (nome, índice da primeira página) de cada anexo incluído
 
-    if tipo_relatorio == 'fase1':
-        # Fase 1: Negócio
-        campos = ['contexto', 'negocio', 'regras', 'especialista', 'coisas']
-        titulos = ['Contextualização', 'Negócio (Business)', 'Regras de Negócio', 'Especialista', 'Coisas (Things)']
-        
-    elif tipo_relatorio == 'fase2':
-        # Fase 2: Requisitos (Top-Down)
-        pdf.set_font('Helvetica', 'I', 10)
-        pdf.cell(0, 10, 'Abordagem Top-Down: Do Usuário para a Coisa', ln=True, align='L')
-        pdf.ln(2)
-        
-        campos = ['l6_display', 'l5_abstraction', 'l4_storage', 'l3_border', 'l2_connectivity', 'l1_sensor']
-        titulos = [
-            'Nível 6 - Display (Visualização)', 
-            'Nível 5 - Abstraction (Abstração)', 
-            'Nível 4 - Storage (Armazenamento)', 
-            'Nível 3 - Border (Borda)', 
-            'Nível 2 - Connectivity (Conectividade)', 
-            'Nível 1 - Sensor/Actuator (Sensores)'
-        ]
-
-    elif tipo_relatorio == 'fase3':
-        # Fase 3: Implementação (Bottom-Up)
-        pdf.set_font('Helvetica', 'I', 10)
-        pdf.cell(0, 10, 'Abordagem Bottom-Up: Do Hardware para a Interface', ln=True, align='L')
-        pdf.ln(2)
-        
-        campos = ['impl_l1', 'impl_l2', 'impl_l3', 'impl_l4', 'impl_l5', 'impl_l6']
-        titulos = [
-            'Nível 1 - Sensor/Actuator (Hardware)', 
-            'Nível 2 - Connectivity (Protocolos)', 
-            'Nível 3 - Border (Gateway/Edge)', 
-            'Nível 4 - Storage (Banco de Dados)', 
-            'Nível 5 - Abstraction (Algoritmos)', 
-            'Nível 6 - Display (Frontend/App)'
-        ]
-
-    # 4. Renderiza os Campos
-    for c, t in zip(campos, titulos):
-        pdf.add_section_title(t, cor_destaque)
-        # data.get(c) busca o valor do campo no dicionário enviado pelo formulário
-        pdf.add_markdown_body(formatar_texto_usuario(data.get(c)), cor_destaque)
-
-    # 5. Gera o PDF Base em Memória
-    base_pdf_bytes = pdf.output()
+    if completo:
+        # 3-4. Sumário + três fases no mesmo documento
+        _renderizar_completo(pdf, data, lista_anexos, cor_destaque, secoes_sumario)
+    else:
+        # 3. Definição dos Campos por Fase
+        if tipo_relatorio in SUBTITULOS_FASE:
+            pdf.set_font('Helvetica', 'I', 10)
+            pdf.cell(0, 10, SUBTITULOS_FASE[tipo_relatorio], ln=True, align='L')
+            pdf.ln(2)
+
+        secoes = CAMPOS_RELATORIO.get(tipo_relatorio, [])
+
+        # 4. Renderiza os Campos
+        for c, t in secoes:
+            pdf.add_section_title(t, cor_destaque)
+            # data.get(c) busca o valor do campo no dicionário enviado pelo formulário
+            pdf.add_markdown_body(formatar_texto_usuario(data.get(c)), cor_destaque)
+
+    # 5. Gera o PDF Base em Memória (o FPDF é liberado logo após o append)
+    # No completo os marcadores são refeitos no fim, já com os anexos
     pdf_writer = PdfWriter()
-    pdf_writer.append(io.BytesIO(bytes(base_pdf_bytes)))
+    pdf_writer.append(io.BytesIO(pdf.output()), import_outline=not completo)
+    del pdf
+    est['render'] = time.perf_counter() - inicio
 
     # 6. Processa Anexos (Somente se houver itens na lista)
     # A lógica de enviar lista vazia nas Fases 2 e 3 está no app.py, mas aqui garantimos que não quebra.
     if lista_anexos:
         print(f">>> PDF Generator: Anexando {len(lista_anexos)} arquivos...")
-        for anexo in lista_anexos:
+
+        # Conversões em paralelo: uma janela limitada de imagens segue à frente da junção
+        executor = pool_conversao.executor() if pool_conversao else None
+        a_converter = deque(i for i, a in enumerate(lista_anexos) if executor and precisa_conversao(a))
+        convertidos = {}
+        janela = 2 * pool_conversao.max_workers if executor else 0
+
+        def adiantar_conversoes():
+            while a_converter and len(convertidos) < janela:
+                i = a_converter.popleft()
+                convertidos[i] = _submeter_conversao(pool_conversao, lista_anexos[i], dpi_imagens, qualidade_jpeg)
+
+        for indice, anexo in enumerate(lista_anexos):
             filename = anexo['filename'].lower()
-            stream = anexo['stream']
-            
+            adiantar_conversoes()
+
             try:
-                if filename.endswith('.pdf'):
-                    pdf_writer.append(PdfReader(stream))
-                    print(f"    [OK] PDF anexado: {filename}")
-                elif filename.endswith(('.jpg', '.jpeg', '.png')):
-                    img = Image.open(stream)
-                    if img.mode != 'RGB': img = img.convert('RGB')
-                    img_pdf = io.BytesIO()
-                    img.save(img_pdf, format='PDF')
-                    img_pdf.seek(0)
-                    pdf_writer.append(PdfReader(img_pdf))
+                if indice in convertidos:
+                    if anexo.get('caminho'):
+                        est['bytes_anexos'] += os.path.getsize(anexo['caminho'])
+                    else:
+                        est['bytes_anexos'] += tamanho_stream(anexo['stream'])
+                    anexos_paginas.append((anexo['filename'], len(pdf_writer.pages)))
+                    t = time.perf_counter()
+                    paginas = convertidos.pop(indice).result()
+                    est['conversao'] += time.perf_counter() - t
+                    t = time.perf_counter()
+                    pdf_writer.append(PdfReader(io.BytesIO(paginas)))
+                    est['juncao'] += time.perf_counter() - t
                     print(f"    [OK] Imagem anexada: {filename}")
+                    continue
+
+                # O arquivo fica aberto apenas enquanto suas páginas são copiadas para o writer
+                with abrir_anexo(anexo) as stream:
+                    est['bytes_anexos'] += tamanho_stream(stream)
+                    anexos_paginas.append((anexo['filename'], len(pdf_writer.pages)))
+                    t = time.perf_counter()
+                    if anexo.get('paginas'):
+                        # Imagem já convertida em PDF no upload: apenas anexa as páginas
+                        pdf_writer.append(PdfReader(stream))
+                        print(f"    [OK] Imagem pré-convertida anexada: {filename}")
+                    elif filename.endswith('.pdf'):
+                        pdf_writer.append(PdfReader(stream))
+                        print(f"    [OK] PDF anexado: {filename}")
+                    elif filename.endswith(EXTENSOES_IMAGEM):
+                        img_pdf = io.BytesIO()
+                        converter_imagem_para_pdf(stream, img_pdf, dpi=dpi_imagens, qualidade=qualidade_jpeg)
+                        img_pdf.seek(0)
+                        est['conversao'] += time.perf_counter() - t
+                        t = time.perf_counter()
+                        pdf_writer.append(PdfReader(img_pdf))
+                        print(f"    [OK] Imagem anexada: {filename}")
+                    est['juncao'] += time.perf_counter() - t
             except Exception as e:
                 print(f"    [ERRO] Falha ao anexar {filename}: {e}")
+                est['anexos_com_erro'].append(anexo['filename'])
     else:
         print(">>> PDF Generator: Nenhum anexo para incluir.")
 
-    # 7. Finaliza
-    final_buffer = io.BytesIO()
+    if completo:
+        # Anexos que falharam (nenhuma página acrescentada) ficam sem marcador
+        total_paginas = len(pdf_writer.pages)
+        fins = [indice for _, indice in anexos_paginas[1:]] + [total_paginas]
+        _adicionar_marcadores(pdf_writer, secoes_sumario,
+                              [a for a, fim in zip(anexos_paginas, fins) if a[1] < fim])
+
+    # 7. Finaliza (no destino informado ou em um buffer em memória)
+    t = time.perf_counter()
+    final_buffer = destino if destino is not None else io.BytesIO()
+    posicao_inicial = final_buffer.tell()
     pdf_writer.write(final_buffer) 
-    final_buffer.seek(0)
+    pdf_writer.close()
+    est['escrita'] = time.perf_counter() - t
+    est['bytes_saida'] = final_buffer.tell() - posicao_inicial
+    if destino is None:
+        final_buffer.seek(0)
     
     print(">>> PDF Gerado com sucesso.")
     return final_buffer
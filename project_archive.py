@@ -0,0 +1,127 @@
+import io
+import re
+import json
+import zipfile
+from datetime import datetime
+
+# Tamanho dos blocos copiados dos anexos para o ZIP (1 MB)
+TAMANHO_BLOCO = 1024 * 1024
+
+# Identificação do formato do arquivo exportado (manifesto.json)
+FORMATO = 'smart_tpm-projetos'
+VERSAO_FORMATO = 1
+
+# Conteúdos já comprimidos: guardados sem nova compressão no ZIP
+EXTENSOES_COMPRIMIDAS = ('.jpg', '.jpeg', '.png', '.pdf', '.zip', '.gz', '.docx', '.xlsx', '.pptx')
+
+_RE_SHA256 = re.compile(r'^[0-9a-f]{64}$')
+
+
+class ArquivoInvalido(Exception):
+    """ZIP enviado para importação fora do formato exportado pela aplicação."""
+
+
+class _SaidaZip(io.RawIOBase):
+    """
+    Destino do ZipFile que só acumula os bytes escritos até serem coletados.
+    Sem seek, o zipfile grava no modo de streaming (descritores de dados após cada
+    arquivo), então o ZIP pode ser enviado aos pedaços enquanto é montado.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._partes = []
+        self._posicao = 0
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        self._partes.append(bytes(dados))
+        self._posicao += len(dados)
+        return len(dados)
+
+    def tell(self):
+        return self._posicao
+
+    def coletar(self):
+        dados = b''.join(self._partes)
+        self._partes.clear()
+        return dados
+
+
+def gerar_zip(projetos, manifesto):
+    """
+    Gerador dos bytes do ZIP de exportação, produzido aos poucos: a memória usada não
+    depende do total exportado (no máximo um bloco de anexo e um projeto por vez).
+
+    `projetos` é um iterável de (dados, arquivos), onde `dados` é o JSON do projeto
+    (com a lista 'anexos') e `arquivos` é uma lista de (sha256, caminho no disco, nome original).
+    Cada conteúdo entra uma única vez em `anexos/<sha256>`, mesmo que vários projetos
+    o usem; os projetos ficam em `projetos/<n>.json` e o `manifesto.json` fecha o arquivo.
+    """
+    saida = _SaidaZip()
+    gravados = set()
+    total = 0
+    with zipfile.ZipFile(saida, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for dados, arquivos in projetos:
+            for sha256, caminho, filename in arquivos:
+                if sha256 in gravados:
+                    continue
+                gravados.add(sha256)
+
+                info = zipfile.ZipInfo.from_file(caminho, f'anexos/{sha256}')
+                info.compress_type = zipfile.ZIP_STORED if filename.lower().endswith(EXTENSOES_COMPRIMIDAS) \
+                    else zipfile.ZIP_DEFLATED
+                with open(caminho, 'rb') as origem, zf.open(info, 'w') as destino:
+                    for bloco in iter(lambda: origem.read(TAMANHO_BLOCO), b''):
+                        destino.write(bloco)
+                        yield from _pedaco(saida)
+                yield from _pedaco(saida)
+
+            total += 1
+            zf.writestr(f'projetos/{total:06d}.json', json.dumps(dados, ensure_ascii=False, indent=1))
+            yield from _pedaco(saida)
+
+        zf.writestr('manifesto.json', json.dumps(dict(
+            manifesto, formato=FORMATO, versao=VERSAO_FORMATO, projetos=total, anexos=len(gravados),
+            gerado_em=datetime.utcnow().isoformat(timespec='seconds') + 'Z'), ensure_ascii=False, indent=1))
+    yield from _pedaco(saida)
+
+
+def _pedaco(saida):
+    # O compressor pode ainda não ter emitido nada: pedaços vazios não são enviados
+    dados = saida.coletar()
+    if dados:
+        yield dados
+
+
+class LeitorZip:
+    """Leitura de um ZIP exportado por gerar_zip (arquivo ou stream com seek)."""
+
+    def __init__(self, arquivo):
+        try:
+            self.zf = zipfile.ZipFile(arquivo)
+            self.manifesto = json.loads(self.zf.read('manifesto.json'))
+        except (zipfile.BadZipFile, KeyError, ValueError) as e:
+            raise ArquivoInvalido(f"Arquivo de exportação inválido: {e}")
+        if self.manifesto.get('formato') != FORMATO:
+            raise ArquivoInvalido("O arquivo não é uma exportação de projetos do Smart TpM.")
+        if self.manifesto.get('versao', 0) > VERSAO_FORMATO:
+            raise ArquivoInvalido(f"Versão do arquivo não suportada: {self.manifesto.get('versao')}")
+
+    def projetos(self):
+        """JSON de cada projeto, na ordem da exportação."""
+        for nome in sorted(n for n in self.zf.namelist() if n.startswith('projetos/') and n.endswith('.json')):
+            yield json.loads(self.zf.read(nome))
+
+    def abrir_anexo(self, sha256):
+        if not _RE_SHA256.match(sha256 or ''):
+            raise ArquivoInvalido(f"Hash de anexo inválido: {sha256!r}")
+        try:
+            return self.zf.open(f'anexos/{sha256}')
+        except KeyError:
+            raise ArquivoInvalido(f"Anexo ausente no arquivo: {sha256}")
+
+    def fechar(self):
+        self.zf.close()
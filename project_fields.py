@@ -0,0 +1,181 @@
+from flask import current_app
+from sqlalchemy import or_, and_
+
+from models import db, Project, ProjectField
+
+# Campos da API de projeto (chave no JSON -> coluna do model), agrupados por fase.
+# Nome e responsável vêm sempre; os anexos acompanham a Fase 1.
+CAMPOS_GERAIS = {'name': 'name', 'responsible': 'responsible'}
+CAMPOS_POR_FASE = {
+    # --- FASE 1: Negócio ---
+    'fase1': {
+        'context': 'context_desc',
+        'business_desc': 'business_desc',
+        'business_rules': 'business_rules',
+        'specialist_desc': 'specialist_desc',
+        'things_desc': 'things_desc',
+    },
+    # --- FASE 2: Requisitos (Top-Down) ---
+    'fase2': {
+        'req_l6': 'req_l6_display',
+        'req_l5': 'req_l5_abstraction',
+        'req_l4': 'req_l4_storage',
+        'req_l3': 'req_l3_border',
+        'req_l2': 'req_l2_connectivity',
+        'req_l1': 'req_l1_sensor',
+    },
+    # --- FASE 3: Implementação (Bottom-Up) ---
+    'fase3': {
+        'impl_l1': 'impl_l1_sensor',
+        'impl_l2': 'impl_l2_connectivity',
+        'impl_l3': 'impl_l3_border',
+        'impl_l4': 'impl_l4_storage',
+        'impl_l5': 'impl_l5_abstraction',
+        'impl_l6': 'impl_l6_display',
+    },
+}
+CAMPOS_PROJETO = dict(CAMPOS_GERAIS, **{k: v for campos in CAMPOS_POR_FASE.values() for k, v in campos.items()})
+
+# Campos do formulário de relatório (ver pdf_generator.CAMPOS_RELATORIO) -> chave da API de projeto
+CAMPOS_RELATORIO_PROJETO = {
+    'nome_projeto': 'name', 'responsavel': 'responsible',
+    'contexto': 'context', 'negocio': 'business_desc', 'regras': 'business_rules',
+    'especialista': 'specialist_desc', 'coisas': 'things_desc',
+    'l6_display': 'req_l6', 'l5_abstraction': 'req_l5', 'l4_storage': 'req_l4',
+    'l3_border': 'req_l3', 'l2_connectivity': 'req_l2', 'l1_sensor': 'req_l1',
+    'impl_l1': 'impl_l1', 'impl_l2': 'impl_l2', 'impl_l3': 'impl_l3',
+    'impl_l4': 'impl_l4', 'impl_l5': 'impl_l5', 'impl_l6': 'impl_l6',
+}
+
+
+def selecionar_campos_projeto(phase, fields):
+    """
+    Interpreta os seletores `phase` (ex.: 'fase2' ou '2', vírgula para várias) e `fields`
+    (chaves do JSON separadas por vírgula). Sem nenhum deles, tudo é retornado.
+    Retorna (campos {chave: coluna}, incluir_anexos); ValueError para valores desconhecidos.
+    """
+    if not phase and not fields:
+        return dict(CAMPOS_PROJETO), True
+
+    campos, incluir_anexos = dict(CAMPOS_GERAIS), False
+    for fase in filter(None, (phase or '').split(',')):
+        fase = fase.strip()
+        fase = fase if fase.startswith('fase') else f'fase{fase}'
+        if fase not in CAMPOS_POR_FASE:
+            raise ValueError(f"Fase desconhecida: {fase}")
+        campos.update(CAMPOS_POR_FASE[fase])
+        incluir_anexos = incluir_anexos or fase == 'fase1'
+    for chave in filter(None, (fields or '').split(',')):
+        chave = chave.strip()
+        if chave == 'attachments':
+            incluir_anexos = True
+        elif chave in CAMPOS_PROJETO:
+            campos[chave] = CAMPOS_PROJETO[chave]
+        else:
+            raise ValueError(f"Campo desconhecido: {chave}")
+    return campos, incluir_anexos
+
+
+# Posição de cada texto no layout em tabela: (fase, nível). Na Fase 1 o nível é a própria
+# chave (context, business_desc, ...); nas Fases 2 e 3 é o nível da arquitetura (l1..l6)
+POSICAO_CAMPO = {}
+for _fase, _campos in CAMPOS_POR_FASE.items():
+    for _chave in _campos:
+        POSICAO_CAMPO[_chave] = (int(_fase[-1]), _chave if _fase == 'fase1' else _chave.split('_', 1)[1])
+CHAVE_POR_POSICAO = {posicao: chave for chave, posicao in POSICAO_CAMPO.items()}
+
+# Onde ficam os textos das fases:
+#   'colunas' -> uma coluna Text por campo na própria tabela projects (layout original)
+#   'tabela'  -> uma linha por campo em project_fields (projects fica estreita)
+LAYOUTS = ('colunas', 'tabela')
+
+
+def layout_atual():
+    return current_app.config['PROJECT_FIELDS_LAYOUT']
+
+
+def colunas_projeto(chaves, layout=None):
+    """
+    Colunas de `projects` a carregar para montar as chaves pedidas.
+    No layout em tabela, os textos das fases não estão em `projects`.
+    """
+    layout = layout or layout_atual()
+    return [getattr(Project, CAMPOS_PROJETO[chave]) for chave in chaves
+            if chave in CAMPOS_GERAIS or layout == 'colunas']
+
+
+def ler_textos(project, chaves, layout=None):
+    """
+    Textos das fases (chave -> valor) de um projeto já carregado. No layout em tabela,
+    uma consulta busca apenas as linhas (fase, nível) pedidas.
+    """
+    layout = layout or layout_atual()
+    chaves = [chave for chave in chaves if chave in POSICAO_CAMPO]
+    if layout == 'colunas':
+        return {chave: getattr(project, CAMPOS_PROJETO[chave]) for chave in chaves}
+
+    textos = dict.fromkeys(chaves)
+    if chaves:
+        for campo in ProjectField.query.filter(ProjectField.project_id == project.id,
+                                               _filtro_posicoes(chaves)):
+            textos[CHAVE_POR_POSICAO[(campo.phase, campo.level)]] = campo.value
+    return textos
+
+
+def gravar_textos(project, valores, layout=None):
+    """
+    Grava textos das fases (chave -> valor). No layout em colunas altera o objeto do
+    projeto; no layout em tabela atualiza/insere só as linhas dos campos informados.
+    Não faz commit.
+    """
+    layout = layout or layout_atual()
+    if layout == 'tabela':
+        gravar_textos_tabela(project.id, valores)
+        return
+    for chave, valor in valores.items():
+        if chave in POSICAO_CAMPO:
+            setattr(project, CAMPOS_PROJETO[chave], valor)
+
+
+def gravar_textos_tabela(project_id, valores):
+    """Atualiza/insere as linhas de project_fields dos textos informados. Não faz commit."""
+    valores = {chave: valor for chave, valor in valores.items() if chave in POSICAO_CAMPO}
+    if not valores:
+        return
+
+    existentes = {(campo.phase, campo.level): campo for campo in
+                  ProjectField.query.filter(ProjectField.project_id == project_id, _filtro_posicoes(valores))}
+    for chave, valor in valores.items():
+        fase, nivel = POSICAO_CAMPO[chave]
+        campo = existentes.get((fase, nivel))
+        if campo is None:
+            db.session.add(ProjectField(project_id=project_id, phase=fase, level=nivel, value=valor))
+        else:
+            campo.value = valor
+
+
+def _filtro_posicoes(chaves):
+    """WHERE das linhas (fase, nível) das chaves, agrupado por fase."""
+    por_fase = {}
+    for chave in chaves:
+        fase, nivel = POSICAO_CAMPO[chave]
+        por_fase.setdefault(fase, []).append(nivel)
+    return or_(*(and_(ProjectField.phase == fase, ProjectField.level.in_(niveis))
+                 for fase, niveis in por_fase.items()))
+
+
+def migrar_layout(project, destino):
+    """
+    Move os textos de um projeto para o layout `destino`, limpando o de origem.
+    Não faz commit.
+    """
+    origem = 'colunas' if destino == 'tabela' else 'tabela'
+    # Só os textos presentes na origem: rodar a migração de novo não apaga nada no destino
+    textos = {chave: valor for chave, valor in ler_textos(project, POSICAO_CAMPO, layout=origem).items()
+              if valor is not None}
+    gravar_textos(project, textos, layout=destino)
+    if destino == 'tabela':
+        for chave in POSICAO_CAMPO:
+            setattr(project, CAMPOS_PROJETO[chave], None)
+    else:
+        ProjectField.query.filter_by(project_id=project.id).delete(synchronize_session=False)
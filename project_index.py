@@ -0,0 +1,241 @@
+import os
+import json
+import shutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from pypdf import PdfReader
+from llama_index.core import Document
+from llama_index.core.ingestion import run_transformations
+from llama_index.core.schema import MetadataMode
+from llama_index.core.settings import Settings
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from vector_store import ArmazemVetores, ARQUIVO_CABECALHO
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem trava entre processos (só a de cada processo)
+    fcntl = None
+
+# Manifesto de cada índice de projeto: embedder usado e, por anexo (sha256), o nome do
+# arquivo e os ids dos documentos (páginas) gerados a partir dele
+ARQUIVO_MANIFESTO = 'anexos.json'
+VERSAO_MANIFESTO = 1
+
+# Anexos com texto extraível; os demais (imagens etc.) são ignorados pelo índice
+EXTENSOES_TEXTO = ('.txt', '.md', '.csv')
+EXTENSOES_INDEXAVEIS = ('.pdf',) + EXTENSOES_TEXTO
+
+
+def indexavel(filename):
+    return (filename or '').lower().endswith(EXTENSOES_INDEXAVEIS)
+
+
+def extrair_documentos(sha256, caminho, filename):
+    """Um Document por página (PDF) ou um para o arquivo inteiro (texto). Páginas sem texto ficam de fora."""
+    metadados = {'sha256': sha256, 'arquivo': filename}
+    ocultos = ['sha256']
+    if filename.lower().endswith('.pdf'):
+        paginas = [(i, pagina.extract_text() or '') for i, pagina in enumerate(PdfReader(caminho).pages, start=1)]
+    else:
+        with open(caminho, encoding='utf-8', errors='replace') as f:
+            paginas = [(1, f.read())]
+    return [Document(text=texto, id_=f'{sha256}:{numero}', metadata=dict(metadados, pagina=numero),
+                     excluded_embed_metadata_keys=ocultos, excluded_llm_metadata_keys=ocultos)
+            for numero, texto in paginas if texto.strip()]
+
+
+def criar_embedder(tipo, modelo):
+    """Embedder dos índices de projeto: 'ollama' (modelo `modelo`) ou o local, sem modelo (testes)."""
+    if tipo == 'local':
+        from local_embedder import EmbedderLocal
+        return EmbedderLocal()
+    from llama_index.embeddings.ollama import OllamaEmbedding
+    return OllamaEmbedding(model_name=modelo)
+
+
+class IndicesProjetos:
+    """
+    Um índice vetorial pequeno por projeto, com os trechos dos anexos dele, em
+    `base_dir/<usuario>/<projeto>/` (ArmazemVetores + manifesto dos anexos).
+
+    A construção roda em uma thread de fundo: `agendar` recebe a lista atual de anexos e
+    o índice é sincronizado com ela (só anexos novos são lidos e vetorizados; os que saíram
+    do projeto são apagados). Pedidos seguidos para o mesmo projeto viram uma só construção.
+    Para as buscas, os índices ficam abertos (mmap) em um LRU de até `max_carregados` projetos.
+    """
+
+    def __init__(self, base_dir, tipo_embedder, modelo_embedding, max_carregados=16):
+        self.base_dir = base_dir
+        self.tipo_embedder = tipo_embedder
+        self.modelo_embedding = modelo_embedding
+        self.max_carregados = max_carregados
+        self._embedder = None
+        self._carregados = OrderedDict()   # (user_id, project_id) -> (mtime do cabeçalho, ArmazemVetores)
+        self._pendentes = {}               # (user_id, project_id) -> anexos da última chamada de agendar
+        self._em_construcao = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='indices-projetos')
+
+    def pasta(self, user_id, project_id):
+        return os.path.join(self.base_dir, str(user_id), str(project_id))
+
+    def embedder(self):
+        with self._lock:
+            if self._embedder is None:
+                self._embedder = criar_embedder(self.tipo_embedder, self.modelo_embedding)
+            return self._embedder
+
+    def identificacao_embedder(self):
+        if self.tipo_embedder == 'local':
+            return 'local'
+        return f'ollama:{self.modelo_embedding}'
+
+    # --- Construção -------------------------------------------------------
+
+    def agendar(self, user_id, project_id, anexos):
+        """
+        Sincroniza em segundo plano o índice do projeto com `anexos`, a lista completa
+        dos anexos atuais como (sha256, caminho no disco, nome original).
+        """
+        chave = (user_id, project_id)
+        with self._lock:
+            self._pendentes[chave] = list(anexos)
+            if chave in self._em_construcao:
+                return  # A construção em andamento pega a lista nova ao terminar
+            self._em_construcao.add(chave)
+        self._executor.submit(self._processar, chave)
+
+    def _processar(self, chave):
+        while True:
+            with self._lock:
+                anexos = self._pendentes.pop(chave, None)
+                if anexos is None:
+                    self._em_construcao.discard(chave)
+                    return
+            try:
+                self.construir(chave[0], chave[1], anexos)
+            except Exception as e:
+                print(f"!!! Erro ao indexar os anexos do projeto {chave[1]}: {e}")
+
+    def construir(self, user_id, project_id, anexos):
+        """Sincroniza o índice do projeto com a lista de anexos (na thread de quem chama)."""
+        pasta = self.pasta(user_id, project_id)
+        os.makedirs(pasta, exist_ok=True)
+        with open(os.path.join(pasta, '.trava'), 'w') as trava:
+            # Outro worker pode estar gravando o mesmo índice
+            if fcntl is not None:
+                fcntl.flock(trava, fcntl.LOCK_EX)
+            return self._sincronizar(pasta, user_id, project_id, anexos)
+
+    def _sincronizar(self, pasta, user_id, project_id, anexos):
+        embedder_id = self.identificacao_embedder()
+        manifesto = self._ler_manifesto(pasta)
+        if manifesto and manifesto.get('embedder') != embedder_id:
+            manifesto = None
+        indexados = manifesto['anexos'] if manifesto else {}
+
+        atuais = {sha256: (caminho, filename) for sha256, caminho, filename in anexos if indexavel(filename)}
+        novos = [sha256 for sha256 in atuais if sha256 not in indexados]
+        removidos = [sha256 for sha256 in indexados if sha256 not in atuais]
+        if manifesto and not novos and not removidos:
+            return 0
+
+        armazem = ArmazemVetores.from_persist_dir(pasta) if manifesto else ArmazemVetores()
+        for sha256 in removidos:
+            for doc_id in indexados.pop(sha256)['doc_ids']:
+                armazem.delete(doc_id)
+
+        nodes = []
+        for sha256 in novos:
+            caminho, filename = atuais[sha256]
+            try:
+                documentos = extrair_documentos(sha256, caminho, filename)
+            except Exception as e:
+                # Arquivo ilegível: fica registrado sem trechos para não ser relido a cada salvamento
+                print(f"!!! Erro ao extrair o texto de {filename}: {e}")
+                documentos = []
+            nodes.extend(run_transformations(documentos, Settings.transformations))
+            indexados[sha256] = {'arquivo': filename, 'doc_ids': [doc.doc_id for doc in documentos]}
+
+        if nodes:
+            textos = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+            for node, vetor in zip(nodes, self.embedder().get_text_embedding_batch(textos)):
+                node.embedding = vetor
+            armazem.add(nodes)
+        armazem.gravar(pasta)
+        self._gravar_manifesto(pasta, {'versao': VERSAO_MANIFESTO, 'embedder': embedder_id, 'anexos': indexados})
+
+        with self._lock:
+            self._carregados.pop((user_id, project_id), None)
+        print(f"--- Índice do projeto {project_id}: +{len(novos)} -{len(removidos)} anexo(s), "
+              f"{armazem.total()} trecho(s)")
+        return len(nodes)
+
+    def _ler_manifesto(self, pasta):
+        try:
+            with open(os.path.join(pasta, ARQUIVO_MANIFESTO), encoding='utf-8') as f:
+                manifesto = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifesto.get('versao') != VERSAO_MANIFESTO or \
+                not os.path.exists(os.path.join(pasta, ARQUIVO_CABECALHO)):
+            return None
+        return manifesto
+
+    def _gravar_manifesto(self, pasta, manifesto):
+        caminho = os.path.join(pasta, ARQUIVO_MANIFESTO)
+        with open(caminho + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(manifesto, f, ensure_ascii=False)
+        os.replace(caminho + '.tmp', caminho)
+
+    def remover(self, user_id, project_id):
+        """Apaga o índice de um projeto excluído."""
+        with self._lock:
+            self._carregados.pop((user_id, project_id), None)
+            self._pendentes.pop((user_id, project_id), None)
+        shutil.rmtree(self.pasta(user_id, project_id), ignore_errors=True)
+
+    # --- Busca ------------------------------------------------------------
+
+    def _armazem(self, user_id, project_id):
+        """Índice aberto do projeto (ou None se ainda não existe), recarregado se outro processo o regravou."""
+        chave = (user_id, project_id)
+        try:
+            versao = os.stat(os.path.join(self.pasta(user_id, project_id), ARQUIVO_CABECALHO)).st_mtime_ns
+        except OSError:
+            return None
+        with self._lock:
+            item = self._carregados.get(chave)
+            if item and item[0] == versao:
+                self._carregados.move_to_end(chave)
+                return item[1]
+
+        armazem = ArmazemVetores.from_persist_dir(self.pasta(user_id, project_id))
+        with self._lock:
+            self._carregados[chave] = (versao, armazem)
+            self._carregados.move_to_end(chave)
+            while len(self._carregados) > self.max_carregados:
+                self._carregados.popitem(last=False)
+        return armazem
+
+    def buscar(self, user_id, project_id, consulta, k=5):
+        """Trechos dos anexos do projeto mais parecidos com a consulta, do mais para o menos similar."""
+        armazem = self._armazem(user_id, project_id)
+        if armazem is None or armazem.total() == 0:
+            return []
+        vetor = self.embedder().get_query_embedding(consulta)
+        resultado = armazem.query(VectorStoreQuery(query_embedding=vetor, similarity_top_k=k))
+        return [{
+            'sha256': node.metadata.get('sha256'),
+            'arquivo': node.metadata.get('arquivo'),
+            'pagina': node.metadata.get('pagina'),
+            'trecho': node.get_content(),
+            'score': round(score, 4),
+        } for node, score in zip(resultado.nodes, resultado.similarities)]
+
+    def carregados(self):
+        with self._lock:
+            return len(self._carregados)
@@ -0,0 +1,225 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+
+# Tamanho dos blocos lidos ao calcular hashes de arquivos (1 MB)
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Marcador da geração do cache de cada projeto (trocado a cada invalidação)
+ARQUIVO_GERACAO = 'geracao'
+
+# Memória dos hashes já calculados: (caminho, tamanho, mtime) -> sha256
+_hashes_arquivos = {}
+_hashes_lock = threading.Lock()
+
+
+def hash_stream(stream):
+    """
+    Calcula o SHA-256 de um stream em blocos e devolve o ponteiro ao início.
+    """
+    h = hashlib.sha256()
+    stream.seek(0)
+    for bloco in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+        h.update(bloco)
+    stream.seek(0)
+    return h.hexdigest()
+
+
+def hash_arquivo(caminho):
+    """
+    Calcula o SHA-256 de um arquivo em disco.
+    O resultado fica memorizado enquanto tamanho e data de modificação não mudarem.
+    """
+    st = os.stat(caminho)
+    chave = (caminho, st.st_size, st.st_mtime_ns)
+    with _hashes_lock:
+        if chave in _hashes_arquivos:
+            return _hashes_arquivos[chave]
+
+    with open(caminho, 'rb') as f:
+        digest = hash_stream(f)
+
+    with _hashes_lock:
+        _hashes_arquivos[chave] = digest
+    return digest
+
+
+class ReportCache:
+    """
+    Cache em disco dos relatórios PDF gerados.
+
+    Cada relatório é endereçado pelo conteúdo: a chave é o hash do tipo de relatório,
+    dos campos do formulário e dos hashes dos anexos. Os arquivos ficam agrupados por
+    usuário/projeto para que salvar ou remover anexos invalide apenas aquele projeto.
+    A invalidação troca a geração do projeto, que entra na chave: um PDF ainda em
+    geração com dados anteriores é gravado com a chave antiga e nunca mais é servido.
+    Quando o tamanho total passa de `max_bytes`, os relatórios menos usados recentemente
+    (LRU pela data de modificação, atualizada a cada acerto) são removidos.
+    """
+
+    def __init__(self, base_dir, max_bytes):
+        self.base_dir = base_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def chave(tipo_relatorio, campos, hashes_anexos, opcoes=None, geracao=None):
+        payload = json.dumps({
+            'geracao': geracao,
+            'tipo': tipo_relatorio,
+            'campos': campos,
+            'anexos': list(hashes_anexos),
+            'opcoes': opcoes or {},
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _pasta(self, user_id, project_id):
+        return os.path.join(self.base_dir, str(user_id), str(project_id or 'avulso'))
+
+    def caminho(self, user_id, project_id, chave):
+        return os.path.join(self._pasta(user_id, project_id), f'{chave}.pdf')
+
+    def abrir(self, user_id, project_id, chave):
+        """
+        Abre (modo binário) o PDF em cache, ou retorna None, e marca o acesso para o LRU.
+        Quem recebe deve ler pelo arquivo aberto, não pelo caminho: uma invalidação ou o
+        limite de tamanho podem apagá-lo do cache a qualquer momento (no POSIX o arquivo
+        aberto continua legível).
+        """
+        path = self.caminho(user_id, project_id, chave)
+        try:
+            arquivo = open(path, 'rb')
+        except OSError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return arquivo
+
+    @contextmanager
+    def escrever(self, user_id, project_id, chave, manter_aberto=False):
+        """
+        Abre um arquivo temporário dentro do cache para o gerador escrever o PDF diretamente.
+        Ao sair sem erro, o arquivo é publicado de forma atômica (rename) e o limite de
+        tamanho é aplicado; em caso de erro, o temporário é descartado.
+        Com `manter_aberto`, o arquivo não é fechado ao publicar: volta ao início e fica
+        com quem chamou (para enviá-lo sem reabrir pelo caminho, ver `abrir`).
+        """
+        pasta = self._pasta(user_id, project_id)
+        os.makedirs(pasta, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=pasta, suffix='.tmp')
+        tmp = os.fdopen(fd, 'w+b')
+        try:
+            yield tmp
+            tmp.flush()
+            path = self.caminho(user_id, project_id, chave)
+            os.replace(tmp_path, path)
+        except BaseException:
+            tmp.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        if manter_aberto:
+            tmp.seek(0)
+        else:
+            tmp.close()
+        self._aplicar_limite(manter=path)
+
+    def guardar(self, user_id, project_id, chave, pdf_buffer):
+        """
+        Grava um PDF já gerado em memória e retorna o caminho no cache.
+        """
+        with self.escrever(user_id, project_id, chave) as tmp:
+            pdf_buffer.seek(0)
+            shutil.copyfileobj(pdf_buffer, tmp)
+        return self.caminho(user_id, project_id, chave)
+
+    def publicar(self, user_id, project_id, chave, origem):
+        """
+        Coloca no cache um PDF já gerado em outro lugar (ex.: pasta de um job),
+        usando hard link quando possível para não copiar os bytes.
+        """
+        pasta = self._pasta(user_id, project_id)
+        os.makedirs(pasta, exist_ok=True)
+
+        tmp_path = os.path.join(pasta, f'{chave}.{os.getpid()}.tmp')
+        try:
+            os.link(origem, tmp_path)
+        except OSError:
+            shutil.copyfile(origem, tmp_path)
+        path = self.caminho(user_id, project_id, chave)
+        os.replace(tmp_path, path)
+
+        self._aplicar_limite(manter=path)
+        return path
+
+    def geracao(self, user_id, project_id):
+        """
+        Geração atual do cache do projeto. Deve ser lida antes dos dados do relatório,
+        para que uma invalidação no meio da geração mude a chave.
+        """
+        try:
+            with open(os.path.join(self._pasta(user_id, project_id), ARQUIVO_GERACAO), encoding='utf-8') as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    def invalidar(self, user_id, project_id):
+        """
+        Troca a geração do projeto e remove os relatórios já gravados. A pasta não é
+        apagada: escritas em andamento (temporários) terminam normalmente, com a chave antiga.
+        """
+        pasta = self._pasta(user_id, project_id)
+        os.makedirs(pasta, exist_ok=True)
+        marcador = os.path.join(pasta, ARQUIVO_GERACAO)
+        tmp_path = f'{marcador}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(uuid.uuid4().hex)
+        os.replace(tmp_path, marcador)
+
+        for nome in os.listdir(pasta):
+            if nome.endswith('.pdf'):
+                try:
+                    os.remove(os.path.join(pasta, nome))
+                except OSError:
+                    pass
+
+    def _aplicar_limite(self, manter=None):
+        with self._lock:
+            entradas = []
+            total = 0
+            for raiz, _, arquivos in os.walk(self.base_dir):
+                for nome in arquivos:
+                    if not nome.endswith('.pdf'):
+                        continue
+                    path = os.path.join(raiz, nome)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    total += st.st_size
+                    # O relatório recém-gravado conta no total, mas nunca é removido
+                    if path != manter:
+                        entradas.append((st.st_mtime, st.st_size, path))
+
+            if total <= self.max_bytes:
+                return
+
+            # Remove os menos usados recentemente até voltar ao limite
+            entradas.sort()
+            for _, tamanho, path in entradas:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= tamanho
+                except OSError:
+                    pass
@@ -0,0 +1,253 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from pdf_generator import gerar_pdf_com_anexos, AnexosComErro
+from report_cache import ReportCache
+
+# Arquivos dentro da pasta de cada job
+ARQUIVO_META = 'meta.json'
+ARQUIVO_RELATORIO = 'relatorio.pdf'
+ARQUIVO_ERRO = 'erro.txt'
+
+# Ids de job são uuid4 em hexadecimal (evita caminhos arbitrários vindos da URL)
+_JOB_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+# Jobs ainda pendentes só são removidos depois deste tempo (segundos): sobras de um
+# processo encerrado no meio da geração, que nunca chegarão a concluir
+MAX_PENDENTE = 24 * 3600
+
+
+def _executar_job(job_dir, data, lista_anexos, tipo_relatorio, dpi_imagens, qualidade_jpeg, publicar_em):
+    """
+    Executada no processo do pool: gera o PDF dentro da pasta do job e, se configurado,
+    publica o resultado no cache de relatórios para as próximas requisições.
+    Retorna as estatísticas da geração (tempos por etapa e bytes), ou None em caso de erro.
+    """
+    destino_path = os.path.join(job_dir, ARQUIVO_RELATORIO)
+    tmp_path = destino_path + '.tmp'
+    estatisticas = {}
+    try:
+        with open(tmp_path, 'wb') as destino:
+            gerar_pdf_com_anexos(data, lista_anexos, tipo_relatorio=tipo_relatorio, destino=destino,
+                                 dpi_imagens=dpi_imagens, qualidade_jpeg=qualidade_jpeg,
+                                 estatisticas=estatisticas)
+        # Relatório sem algum anexo vira erro do job: não é entregue nem publicado no cache
+        if estatisticas['anexos_com_erro']:
+            raise AnexosComErro(estatisticas['anexos_com_erro'])
+        os.replace(tmp_path, destino_path)
+    except Exception as e:
+        print(f"!!! Erro no job de relatório {os.path.basename(job_dir)}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        with open(os.path.join(job_dir, ARQUIVO_ERRO), 'w', encoding='utf-8') as f:
+            f.write(str(e))
+        return None
+
+    # Os anexos enviados no request só eram necessários durante a geração
+    shutil.rmtree(os.path.join(job_dir, 'anexos'), ignore_errors=True)
+
+    if publicar_em:
+        try:
+            cache = ReportCache(publicar_em['dir'], publicar_em['max_bytes'])
+            cache.publicar(publicar_em['user_id'], publicar_em['project_id'], publicar_em['chave'], destino_path)
+        except Exception as e:
+            print(f"!!! Erro ao publicar relatório do job no cache: {e}")
+
+    return estatisticas
+
+
+class ReportJobs:
+    """
+    Geração de relatórios em segundo plano.
+
+    Cada job tem uma pasta própria em `base_dir` com os metadados, o PDF final ou a
+    mensagem de erro. Como o estado fica em disco, qualquer worker do gunicorn consegue
+    responder ao polling de status. Os PDFs são gerados por um pool de processos de
+    tamanho limitado, e jobs concluídos há mais de `ttl` segundos são removidos automaticamente
+    (os pendentes ficam até terminar).
+    `ao_concluir(estatisticas, tipo_relatorio)`, se informado, é chamado neste processo
+    quando um PDF fica pronto (as métricas do processo do pool não seriam vistas aqui).
+    """
+
+    def __init__(self, base_dir, max_workers, ttl, ao_concluir=None):
+        self.base_dir = base_dir
+        self.max_workers = max_workers
+        self.ttl = ttl
+        self.ao_concluir = ao_concluir
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        # Criado sob demanda; 'spawn' evita herdar conexões e threads do processo do Flask
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _enviar(self, *args):
+        """
+        Envia o job ao pool. Se um processo do pool morreu (ex.: OOM), o executor fica
+        inutilizável para sempre: é descartado e um novo é criado (uma tentativa).
+        """
+        executor = self._pool()
+        try:
+            return executor.submit(_executar_job, *args)
+        except BrokenProcessPool:
+            print("!!! Pool de jobs de relatório quebrado (processo encerrado); criando outro")
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+            return self._pool().submit(_executar_job, *args)
+
+    def _pasta(self, job_id):
+        return os.path.join(self.base_dir, job_id)
+
+    def submeter(self, user_id, data, lista_anexos, tipo_relatorio, filename_pdf,
+                 dpi_imagens=0, qualidade_jpeg=0, publicar_em=None, pronto=None):
+        """
+        Cria o job e o envia ao pool. Anexos que chegaram como stream (uploads) são gravados
+        na pasta do job, pois o processo do pool só recebe caminhos.
+        Se `pronto` (PDF já gerado e aberto, ex.: do cache) for informado, o job já
+        nasce concluído, sem passar pelo pool.
+        Retorna o id do job.
+        """
+        self.limpar_expirados()
+
+        job_id = uuid.uuid4().hex
+        job_dir = self._pasta(job_id)
+        os.makedirs(job_dir)
+
+        with open(os.path.join(job_dir, ARQUIVO_META), 'w', encoding='utf-8') as f:
+            json.dump({
+                'user_id': user_id,
+                'tipo_relatorio': tipo_relatorio,
+                'filename': filename_pdf,
+                'criado_em': time.time(),
+            }, f)
+
+        if pronto:
+            _vincular(pronto, os.path.join(job_dir, ARQUIVO_RELATORIO))
+            return job_id
+
+        anexos_job = []
+        for i, anexo in enumerate(lista_anexos):
+            if 'stream' in anexo:
+                pasta_anexos = os.path.join(job_dir, 'anexos')
+                os.makedirs(pasta_anexos, exist_ok=True)
+                caminho = os.path.join(pasta_anexos, f'{i:03d}_{os.path.basename(anexo["filename"])}')
+                with open(caminho, 'wb') as f:
+                    anexo['stream'].seek(0)
+                    shutil.copyfileobj(anexo['stream'], f)
+                anexo = {k: v for k, v in anexo.items() if k != 'stream'}
+                anexo['caminho'] = caminho
+            anexos_job.append(anexo)
+
+        future = self._enviar(job_dir, dict(data), anexos_job, tipo_relatorio,
+                              dpi_imagens, qualidade_jpeg, publicar_em)
+
+        def _finalizar(fut):
+            # Falhas fora do gerador (ex.: processo do pool encerrado) também viram erro do job
+            if fut.exception() is not None:
+                try:
+                    with open(os.path.join(job_dir, ARQUIVO_ERRO), 'w', encoding='utf-8') as f:
+                        f.write(str(fut.exception()))
+                except OSError:
+                    pass
+            elif fut.result() and self.ao_concluir:
+                try:
+                    self.ao_concluir(fut.result(), tipo_relatorio)
+                except Exception as e:
+                    print(f"!!! Erro ao registrar a conclusão do job: {e}")
+
+        future.add_done_callback(_finalizar)
+        return job_id
+
+    def _meta(self, job_id, user_id):
+        if not _JOB_ID_RE.match(job_id or ''):
+            return None
+        try:
+            with open(os.path.join(self._pasta(job_id), ARQUIVO_META), encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # Cada usuário só enxerga os próprios jobs
+        if meta.get('user_id') != user_id:
+            return None
+        return meta
+
+    def status(self, job_id, user_id):
+        """
+        Retorna {'status': 'pendente'|'concluido'|'erro', ...} ou None se o job não existir
+        (ou já tiver expirado).
+        """
+        self.limpar_expirados()
+        meta = self._meta(job_id, user_id)
+        if meta is None:
+            return None
+
+        job_dir = self._pasta(job_id)
+        if os.path.exists(os.path.join(job_dir, ARQUIVO_RELATORIO)):
+            return {'status': 'concluido', 'filename': meta['filename']}
+        if os.path.exists(os.path.join(job_dir, ARQUIVO_ERRO)):
+            with open(os.path.join(job_dir, ARQUIVO_ERRO), encoding='utf-8') as f:
+                return {'status': 'erro', 'error': f.read()}
+        return {'status': 'pendente'}
+
+    def arquivo(self, job_id, user_id):
+        """
+        Retorna (PDF aberto em modo binário, nome para download) de um job concluído, ou None.
+        O arquivo é entregue já aberto: a limpeza dos expirados pode apagar a pasta do job.
+        """
+        meta = self._meta(job_id, user_id)
+        if meta is None:
+            return None
+        try:
+            return open(os.path.join(self._pasta(job_id), ARQUIVO_RELATORIO), 'rb'), meta['filename']
+        except OSError:
+            return None
+
+    def limpar_expirados(self):
+        """
+        Remove as pastas de jobs concluídos (PDF ou erro) há mais de `ttl` segundos.
+        A data da pasta muda quando o PDF ou o erro é gravado nela, então conta a partir
+        da conclusão. Jobs pendentes (ainda gerando) não são removidos, salvo os abandonados
+        há mais de MAX_PENDENTE segundos.
+        """
+        if not os.path.isdir(self.base_dir):
+            return
+        agora = time.time()
+        for job_id in os.listdir(self.base_dir):
+            job_dir = self._pasta(job_id)
+            try:
+                idade = agora - os.path.getmtime(job_dir)
+                terminado = os.path.exists(os.path.join(job_dir, ARQUIVO_RELATORIO)) or \
+                    os.path.exists(os.path.join(job_dir, ARQUIVO_ERRO))
+                if idade > (self.ttl if terminado else max(self.ttl, MAX_PENDENTE)):
+                    shutil.rmtree(job_dir, ignore_errors=True)
+            except OSError:
+                pass
+
+
+def _vincular(origem, destino):
+    """
+    Cria um hard link do arquivo aberto `origem` (sem copiar bytes) ou, se não for possível
+    (ex.: já apagado do cache pelo caminho), copia o conteúdo pelo próprio arquivo aberto.
+    """
+    try:
+        os.link(origem.name, destino)
+    except OSError:
+        tmp_path = destino + '.tmp'
+        origem.seek(0)
+        with open(tmp_path, 'wb') as f:
+            shutil.copyfileobj(origem, f)
+        os.replace(tmp_path, destino)
@@ -0,0 +1,111 @@
+import os
+import time
+import threading
+
+from flask_login import UserMixin
+
+
+class UsuarioSessao(UserMixin):
+    """
+    Cópia leve dos dados do usuário logado, desligada da sessão do SQLAlchemy.
+    É o `current_user` das requisições: basta para identificar o dono dos projetos
+    e para os templates. Quem for alterar o usuário deve carregar a linha do banco.
+    """
+
+    def __init__(self, id, username, email):
+        self.id = id
+        self.username = username
+        self.email = email
+
+    @classmethod
+    def de(cls, user):
+        return cls(user.id, user.username, user.email)
+
+    def __repr__(self):
+        return f'<UsuarioSessao {self.username}>'
+
+
+class UserCache:
+    """
+    Cache por processo dos usuários carregados pelo Flask-Login, com validade (TTL).
+
+    Evita uma consulta ao banco em toda requisição autenticada. Como cada worker tem
+    o seu cache, a invalidação também "toca" um arquivo marcador: os demais processos
+    (outros workers e comandos CLI) percebem a mudança da data dele e descartam tudo.
+    """
+
+    def __init__(self, ttl, marcador, max_itens=10000):
+        self.ttl = ttl
+        self.marcador = marcador
+        self.max_itens = max_itens
+        self.acertos = 0
+        self.faltas = 0
+        self._itens = {}    # user_id -> (expira_em, UsuarioSessao)
+        self._geracao = self._ler_marcador()
+        self._lock = threading.Lock()
+
+    def _ler_marcador(self):
+        try:
+            return os.stat(self.marcador).st_mtime_ns
+        except OSError:
+            return None
+
+    def obter(self, user_id, carregar):
+        """
+        Retorna o usuário do cache ou chama `carregar(user_id)` (que deve devolver um
+        UsuarioSessao ou None) e guarda o resultado até expirar.
+        """
+        agora = time.monotonic()
+        geracao = self._ler_marcador()
+        with self._lock:
+            if geracao != self._geracao:
+                self._itens.clear()
+                self._geracao = geracao
+
+            item = self._itens.get(user_id)
+            if item and item[0] > agora:
+                self.acertos += 1
+                return item[1]
+            self.faltas += 1
+
+        usuario = carregar(user_id)
+        if usuario is None:
+            return None
+
+        with self._lock:
+            if len(self._itens) >= self.max_itens:
+                # Cheio: sai o item que expiraria primeiro
+                del self._itens[min(self._itens, key=lambda k: self._itens[k][0])]
+            self._itens[user_id] = (agora + self.ttl, usuario)
+        return usuario
+
+    def invalidar(self, user_id=None):
+        """
+        Descarta um usuário (ou todos) neste processo e avisa os demais processos
+        atualizando o marcador.
+        """
+        with self._lock:
+            if user_id is None:
+                self._itens.clear()
+            else:
+                self._itens.pop(user_id, None)
+
+        try:
+            os.makedirs(os.path.dirname(self.marcador), exist_ok=True)
+            with open(self.marcador, 'a'):
+                pass
+            os.utime(self.marcador)
+        except OSError as e:
+            print(f"!!! Erro ao atualizar o marcador do cache de usuários: {e}")
+
+        with self._lock:
+            self._geracao = self._ler_marcador()
+
+    def estatisticas(self):
+        total = self.acertos + self.faltas
+        return {
+            'acertos': self.acertos,
+            'faltas': self.faltas,
+            'taxa_acerto': round(self.acertos / total, 4) if total else None,
+            'itens': len(self._itens),
+        }
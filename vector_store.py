@@ -0,0 +1,336 @@
+import os
+import json
+import mmap
+import zlib
+from typing import Any, List, Optional
+
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+from llama_index.core.vector_stores.utils import metadata_dict_to_node, node_to_metadata_dict
+
+# Cabeçalho do armazenamento: dimensão, total de trechos e a geração atual dos arquivos.
+# Cada gravação cria arquivos de uma nova geração e só então troca o cabeçalho, então
+# uma interrupção no meio deixa o índice anterior intacto.
+ARQUIVO_CABECALHO = 'vetores.json'
+VERSAO_FORMATO = 1
+
+# Linhas copiadas por vez ao regravar a matriz de vetores
+LINHAS_POR_BLOCO = 65536
+
+
+def _caminho(pasta, nome, geracao, extensao):
+    return os.path.join(pasta, f'{nome}.{geracao}.{extensao}')
+
+
+def _arquivos_geracao(pasta, geracao):
+    return [_caminho(pasta, 'vetores', geracao, 'f32'),
+            _caminho(pasta, 'trechos', geracao, 'idx'),
+            _caminho(pasta, 'trechos', geracao, 'dat'),
+            _caminho(pasta, 'ids', geracao, 'json')]
+
+
+def ler_cabecalho(pasta):
+    try:
+        with open(os.path.join(pasta, ARQUIVO_CABECALHO), encoding='utf-8') as f:
+            cabecalho = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cabecalho.get('versao') != VERSAO_FORMATO:
+        return None
+    return cabecalho
+
+
+def normalizar(vetores):
+    """Vetores (linhas) com norma 1: a similaridade de cosseno vira um produto escalar."""
+    normas = np.linalg.norm(vetores, axis=-1, keepdims=True)
+    normas[normas == 0] = 1.0
+    return vetores / normas
+
+
+def _sequencias(linhas):
+    """Linhas ordenadas agrupadas em intervalos contíguos [inicio, fim)."""
+    if not len(linhas):
+        return []
+    quebras = np.flatnonzero(np.diff(linhas) != 1) + 1
+    return [(int(parte[0]), int(parte[-1]) + 1) for parte in np.split(linhas, quebras)]
+
+
+class _Segmento:
+    """
+    Arquivos de uma geração, abertos com mmap só para leitura:
+      vetores.<g>.f32  matriz float32 (total x dimensão), linhas normalizadas
+      trechos.<g>.idx  offsets uint64 (total + 1) de cada registro em trechos.<g>.dat
+      trechos.<g>.dat  registros (nó sem embedding, JSON comprimido com zlib) concatenados
+      ids.<g>.json     id do trecho e do documento de origem de cada linha (lido só quando preciso)
+    Abrir não lê nada além do cabeçalho: as páginas vêm do disco conforme a busca as usa.
+    """
+
+    def __init__(self, pasta, cabecalho):
+        self.pasta = pasta
+        self.geracao = cabecalho['geracao']
+        self.total = cabecalho['total']
+        self.dimensao = cabecalho['dimensao']
+        self._ids = None
+        self._dados = None
+        if self.total:
+            arq_vetores, arq_offsets, arq_dados, _ = _arquivos_geracao(pasta, self.geracao)
+            self.vetores = np.memmap(arq_vetores, dtype=np.float32, mode='r', shape=(self.total, self.dimensao))
+            self.offsets = np.memmap(arq_offsets, dtype=np.uint64, mode='r', shape=(self.total + 1,))
+            with open(arq_dados, 'rb') as f:
+                self._dados = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.vetores = np.empty((0, self.dimensao or 0), dtype=np.float32)
+            self.offsets = np.zeros(1, dtype=np.uint64)
+
+    def registro(self, linha):
+        """Bytes comprimidos do registro da linha."""
+        return self.dados(int(self.offsets[linha]), int(self.offsets[linha + 1]))
+
+    def dados(self, inicio, fim):
+        return self._dados[inicio:fim]
+
+    def ids(self):
+        """(ids dos trechos, ids dos documentos de origem), na ordem das linhas."""
+        if self._ids is None:
+            with open(_arquivos_geracao(self.pasta, self.geracao)[3], encoding='utf-8') as f:
+                dados = json.load(f)
+            self._ids = (dados['ids'], dados['refs'])
+        return self._ids
+
+    def fechar(self):
+        # Os memmaps do NumPy são liberados quando não há mais referências
+        self.vetores = self.offsets = None
+        if self._dados is not None:
+            self._dados.close()
+            self._dados = None
+
+
+class ArmazemVetores(BasePydanticVectorStore):
+    """
+    Vector store do LlamaIndex persistido em arquivos binários mapeados em memória,
+    no lugar do default__vector_store.json/docstore.json.
+
+    O texto e os metadados dos trechos ficam no próprio armazenamento (stores_text),
+    então o docstore.json do índice guarda só os hashes dos documentos.
+    Alterações (add/delete) ficam em memória até o persist, que regrava os arquivos.
+    A busca é o produto da matriz mapeada pelo vetor da consulta, em NumPy.
+    """
+
+    stores_text: bool = True
+    is_embedding_query: bool = True
+
+    _pasta: Optional[str] = PrivateAttr(default=None)
+    _segmento: Optional[_Segmento] = PrivateAttr(default=None)
+    _removidas: set = PrivateAttr(default_factory=set)
+    _novos: dict = PrivateAttr(default_factory=dict)
+    _linhas: Optional[dict] = PrivateAttr(default=None)
+
+    def __init__(self, pasta: Optional[str] = None, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self._pasta = pasta
+        cabecalho = ler_cabecalho(pasta) if pasta else None
+        if cabecalho:
+            self._segmento = _Segmento(pasta, cabecalho)
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str) -> "ArmazemVetores":
+        return cls(pasta=persist_dir)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ArmazemVetores"
+
+    @property
+    def client(self) -> Any:
+        return None
+
+    @property
+    def dimensao(self):
+        if self._segmento is not None and self._segmento.total:
+            return self._segmento.dimensao
+        if self._novos:
+            return len(next(iter(self._novos.values()))[1])
+        return None
+
+    def total(self):
+        """Trechos no armazenamento, contando as alterações ainda não gravadas."""
+        total = self._segmento.total if self._segmento is not None else 0
+        return total - len(self._removidas) + len(self._novos)
+
+    def _linhas_por_id(self):
+        """id do trecho -> linha do segmento em disco (carregado na primeira alteração)."""
+        if self._linhas is None:
+            self._linhas = {}
+            if self._segmento is not None and self._segmento.total:
+                ids, _ = self._segmento.ids()
+                self._linhas = {node_id: i for i, node_id in enumerate(ids)}
+        return self._linhas
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+        vetores = normalizar(np.asarray([node.get_embedding() for node in nodes], dtype=np.float32))
+        dimensao = self.dimensao
+        if dimensao is not None and vetores.shape[1] != dimensao:
+            raise ValueError(f"Dimensão do embedding ({vetores.shape[1]}) diferente da do índice ({dimensao}).")
+
+        linhas = self._linhas_por_id()
+        ids = []
+        for node, vetor in zip(nodes, vetores):
+            # Mesmo id já indexado: a versão nova substitui a antiga
+            if node.node_id in linhas:
+                self._removidas.add(linhas[node.node_id])
+            self._novos.pop(node.node_id, None)
+
+            metadados = node_to_metadata_dict(node, remove_text=False, flat_metadata=False)
+            registro = zlib.compress(json.dumps(metadados, ensure_ascii=False).encode('utf-8'))
+            self._novos[node.node_id] = (node.ref_doc_id, vetor, registro)
+            ids.append(node.node_id)
+        return ids
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        if self._segmento is not None and self._segmento.total:
+            _, refs = self._segmento.ids()
+            self._removidas.update(i for i, ref in enumerate(refs) if ref == ref_doc_id)
+        self._novos = {i: n for i, n in self._novos.items() if n[0] != ref_doc_id}
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.mode != VectorStoreQueryMode.DEFAULT:
+            raise ValueError(f"Modo de busca não suportado pelo ArmazemVetores: {query.mode}")
+        if query.filters is not None:
+            raise ValueError("Filtros de metadados não são suportados pelo ArmazemVetores.")
+        if query.query_embedding is None:
+            raise ValueError("A busca precisa do embedding da consulta.")
+        if self.total() == 0:
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+
+        consulta = normalizar(np.asarray(query.query_embedding, dtype=np.float32))
+        partes = []
+        if self._segmento is not None and self._segmento.total:
+            partes.append(self._segmento.vetores @ consulta)
+        if self._novos:
+            partes.append(np.stack([n[1] for n in self._novos.values()]) @ consulta)
+        pontos = np.concatenate(partes) if len(partes) > 1 else partes[0].copy()
+
+        if self._removidas:
+            pontos[np.fromiter(self._removidas, dtype=np.int64)] = -np.inf
+        if query.doc_ids or query.node_ids:
+            pontos[~self._mascara(query.doc_ids, query.node_ids)] = -np.inf
+
+        k = min(query.similarity_top_k, len(pontos))
+        if k < 1:
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+        melhores = np.argpartition(-pontos, k - 1)[:k]
+        melhores = melhores[np.argsort(-pontos[melhores], kind='stable')]
+
+        nodes, similaridades, ids = [], [], []
+        for linha in melhores:
+            if pontos[linha] == -np.inf:
+                break
+            node = self._node(int(linha))
+            nodes.append(node)
+            similaridades.append(float(pontos[linha]))
+            ids.append(node.node_id)
+        return VectorStoreQueryResult(nodes=nodes, similarities=similaridades, ids=ids)
+
+    def _mascara(self, doc_ids, node_ids):
+        """Linhas cujo trecho está em node_ids e/ou cujo documento está em doc_ids."""
+        ids, refs = self._segmento.ids() if self._segmento is not None and self._segmento.total else ([], [])
+        ids = ids + list(self._novos)
+        refs = refs + [n[0] for n in self._novos.values()]
+        mascara = np.ones(len(ids), dtype=bool)
+        if doc_ids:
+            doc_ids = set(doc_ids)
+            mascara &= np.fromiter((ref in doc_ids for ref in refs), dtype=bool, count=len(refs))
+        if node_ids:
+            node_ids = set(node_ids)
+            mascara &= np.fromiter((i in node_ids for i in ids), dtype=bool, count=len(ids))
+        return mascara
+
+    def _node(self, linha):
+        total = self._segmento.total if self._segmento is not None else 0
+        if linha < total:
+            registro = self._segmento.registro(linha)
+        else:
+            registro = list(self._novos.values())[linha - total][2]
+        return metadata_dict_to_node(json.loads(zlib.decompress(registro)))
+
+    def persist(self, persist_path: str, fs: Any = None) -> None:
+        """
+        Grava na pasta de `persist_path` (o StorageContext passa o caminho do antigo
+        default__vector_store.json, que é apagado se ainda existir).
+        """
+        pasta = os.path.dirname(persist_path) or '.'
+        if os.path.exists(persist_path):
+            os.remove(persist_path)
+        self.gravar(pasta)
+
+    def gravar(self, pasta):
+        segmento = self._segmento
+        mesma_pasta = segmento is not None and os.path.abspath(segmento.pasta) == os.path.abspath(pasta)
+        if mesma_pasta and not self._removidas and not self._novos:
+            return
+
+        os.makedirs(pasta, exist_ok=True)
+        anterior = ler_cabecalho(pasta)
+        geracao = anterior['geracao'] + 1 if anterior else 1
+        arq_vetores, arq_offsets, arq_dados, arq_ids = _arquivos_geracao(pasta, geracao)
+
+        total_segmento = segmento.total if segmento is not None else 0
+        manter = np.ones(total_segmento, dtype=bool)
+        if self._removidas:
+            manter[np.fromiter(self._removidas, dtype=np.int64)] = False
+        mantidas = np.flatnonzero(manter)
+        ids_antigos, refs_antigos = segmento.ids() if total_segmento else ([], [])
+
+        ids, refs, offsets = [], [], [np.zeros(1, dtype=np.uint64)]
+        posicao = 0
+        with open(arq_vetores, 'wb') as f_vetores, open(arq_dados, 'wb') as f_dados:
+            # Linhas mantidas do segmento atual: copiadas em sequências contíguas, sem decodificar
+            for inicio_seq, fim_seq in _sequencias(mantidas):
+                for inicio in range(inicio_seq, fim_seq, LINHAS_POR_BLOCO):
+                    fim = min(fim_seq, inicio + LINHAS_POR_BLOCO)
+                    f_vetores.write(segmento.vetores[inicio:fim].tobytes())
+                    base, limite = int(segmento.offsets[inicio]), int(segmento.offsets[fim])
+                    f_dados.write(segmento.dados(base, limite))
+                    offsets.append(segmento.offsets[inicio + 1:fim + 1] - np.uint64(base) + np.uint64(posicao))
+                    posicao += limite - base
+                ids.extend(ids_antigos[inicio_seq:fim_seq])
+                refs.extend(refs_antigos[inicio_seq:fim_seq])
+            for node_id, (ref_doc_id, vetor, registro) in self._novos.items():
+                f_vetores.write(vetor.astype(np.float32).tobytes())
+                f_dados.write(registro)
+                posicao += len(registro)
+                offsets.append(np.array([posicao], dtype=np.uint64))
+                ids.append(node_id)
+                refs.append(ref_doc_id)
+        np.concatenate(offsets).tofile(arq_offsets)
+        with open(arq_ids, 'w', encoding='utf-8') as f:
+            json.dump({'ids': ids, 'refs': refs}, f, ensure_ascii=False)
+
+        cabecalho = {'versao': VERSAO_FORMATO, 'geracao': geracao, 'total': len(ids), 'dimensao': self.dimensao}
+        caminho = os.path.join(pasta, ARQUIVO_CABECALHO)
+        with open(caminho + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(cabecalho, f)
+        os.replace(caminho + '.tmp', caminho)
+
+        # A geração anterior só é apagada depois que o novo cabeçalho está no lugar
+        if segmento is not None:
+            segmento.fechar()
+        if anterior:
+            for arquivo in _arquivos_geracao(pasta, anterior['geracao']):
+                if os.path.exists(arquivo):
+                    os.remove(arquivo)
+
+        self._pasta = pasta
+        self._segmento = _Segmento(pasta, cabecalho)
+        self._removidas = set()
+        self._novos = {}
+        self._linhas = None